@@ -3,17 +3,262 @@ Autenticación y manejo de JWT
 """
 import jwt
 import bcrypt
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from sqlalchemy.util import await_only
+import asyncio
 from datetime import datetime, timedelta
 from typing import Optional
+import math
+import multiprocessing
 import os
+import threading
+import time
+import uuid
 from dotenv import load_dotenv
 
+from revocation import revocation_list
+
 load_dotenv()
 
 # Configuración
 SECRET_KEY = os.getenv("SECRET_KEY", "demo_secret_key_super_segura_para_jwt_minimo_32_caracteres_aqui")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_HOURS = 24
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+
+# Emails con permisos de administrador (separados por comas)
+ADMIN_EMAILS = {
+    email.strip().lower()
+    for email in os.getenv("ADMIN_EMAILS", "").split(",")
+    if email.strip()
+}
+
+# Coste de bcrypt: fijo si se define BCRYPT_ROUNDS, si no se calibra al arrancar
+# para que un hash tarde unos BCRYPT_TARGET_MS (el guardado en app_settings solo sube)
+BCRYPT_ROUNDS_ENV = os.getenv("BCRYPT_ROUNDS")
+BCRYPT_TARGET_MS = float(os.getenv("BCRYPT_TARGET_MS", "100"))
+BCRYPT_MIN_ROUNDS = int(os.getenv("BCRYPT_MIN_ROUNDS", "10"))
+BCRYPT_MAX_ROUNDS = int(os.getenv("BCRYPT_MAX_ROUNDS", "16"))
+
+# Pool de procesos para bcrypt (0 = ejecutar en el propio hilo)
+PASSWORD_POOL_WORKERS = int(os.getenv("PASSWORD_POOL_WORKERS", str(os.cpu_count() or 1)))
+# Operaciones que pueden esperar en cola además de las que se están ejecutando
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", str(4 * max(PASSWORD_POOL_WORKERS, 1))))
+# Tiempo máximo esperando el resultado de una operación
+PASSWORD_TIMEOUT_SECONDS = float(os.getenv("PASSWORD_TIMEOUT_SECONDS", "10"))
+
+
+# ============================================================================
+# POOL DE PROCESOS PARA BCRYPT
+# ============================================================================
+
+class PasswordPoolBusy(Exception):
+    """El pool de bcrypt está saturado: la petición debe responder 503"""
+
+
+_password_pool: Optional[ProcessPoolExecutor] = None
+_password_pool_lock = threading.Lock()
+_password_slots = threading.BoundedSemaphore(max(PASSWORD_POOL_WORKERS, 1) + PASSWORD_QUEUE_LIMIT)
+
+
+def _get_password_pool() -> ProcessPoolExecutor:
+    """Crea el pool de procesos la primera vez que se necesita"""
+    global _password_pool
+    with _password_pool_lock:
+        if _password_pool is None:
+            _password_pool = ProcessPoolExecutor(
+                max_workers=PASSWORD_POOL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _password_pool
+
+
+def shutdown_password_pool():
+    """Cierra el pool de procesos (al parar el servidor)"""
+    global _password_pool
+    with _password_pool_lock:
+        if _password_pool is not None:
+            _password_pool.shutdown(wait=False, cancel_futures=True)
+            _password_pool = None
+
+
+def _run_password_task(fn, *args):
+    """
+    Ejecuta una operación de bcrypt en el pool con cola acotada
+    
+    Raises:
+        PasswordPoolBusy: Si la cola está llena o la operación tarda demasiado
+    """
+    on_event_loop = _on_event_loop()
+    
+    if PASSWORD_POOL_WORKERS <= 0:
+        if on_event_loop:
+            # Modo DB_ASYNC: no bloquear el event loop con bcrypt
+            return await_only(asyncio.get_running_loop().run_in_executor(None, fn, *args))
+        return fn(*args)
+    
+    # Sin espera: si no hay hueco se rechaza enseguida
+    if not _password_slots.acquire(blocking=False):
+        raise PasswordPoolBusy("Demasiadas operaciones de contraseña en curso")
+    
+    try:
+        future = _get_password_pool().submit(fn, *args)
+    except Exception:
+        _password_slots.release()
+        raise
+    # El hueco se libera cuando la operación termina (o se cancela), no cuando
+    # se deja de esperar: tras un timeout sigue ocupando un proceso del pool
+    future.add_done_callback(lambda _: _password_slots.release())
+    
+    try:
+        if on_event_loop:
+            return await_only(asyncio.wait_for(asyncio.wrap_future(future), PASSWORD_TIMEOUT_SECONDS))
+        return future.result(timeout=PASSWORD_TIMEOUT_SECONDS)
+    except (FutureTimeoutError, asyncio.TimeoutError):
+        # Si aún estaba en cola se descarta y libera su hueco ya
+        future.cancel()
+        raise PasswordPoolBusy("Tiempo de espera agotado en el pool de contraseñas")
+
+
+def _on_event_loop() -> bool:
+    """
+    Indica si el código síncrono se ejecuta en el hilo del event loop
+    
+    Ocurre con DB_ASYNC, donde los endpoints corren dentro de AsyncSession.run_sync
+    y las esperas se hacen con await_only en lugar de bloqueando el hilo.
+    """
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def _hashpw(password_bytes: bytes, rounds: int) -> bytes:
+    """Hashea en el proceso del pool"""
+    return bcrypt.hashpw(password_bytes, bcrypt.gensalt(rounds=rounds))
+
+
+def _checkpw(password_bytes: bytes, hashed_bytes: bytes) -> bool:
+    """Verifica en el proceso del pool"""
+    return bcrypt.checkpw(password_bytes, hashed_bytes)
+
+
+# ============================================================================
+# CALIBRACIÓN DEL COSTE DE BCRYPT
+# ============================================================================
+
+_bcrypt_rounds = int(BCRYPT_ROUNDS_ENV or 12)
+_bcrypt_calibration: dict = {"rounds": _bcrypt_rounds, "source": "env" if BCRYPT_ROUNDS_ENV else "default"}
+
+
+BCRYPT_SETTING_KEY = "bcrypt_rounds"
+
+
+def _store_bcrypt_rounds(rounds: int) -> int:
+    """
+    Guarda el coste medido solo si sube respecto al guardado en app_settings
+    
+    Args:
+        rounds: Coste medido en este arranque
+        
+    Returns:
+        Coste vigente: el mayor entre el guardado y el medido
+    """
+    from sqlalchemy.exc import IntegrityError
+    from database import SessionLocal, AppSetting
+    
+    db = SessionLocal()
+    try:
+        # Dos intentos: si otro worker inserta la fila a la vez, se compara con la suya
+        for _ in range(2):
+            setting = db.get(AppSetting, BCRYPT_SETTING_KEY)
+            if setting is not None and int(setting.value) >= rounds:
+                return int(setting.value)
+            if setting is None:
+                db.add(AppSetting(key=BCRYPT_SETTING_KEY, value=str(rounds)))
+            else:
+                setting.value = str(rounds)
+            try:
+                db.commit()
+                return rounds
+            except IntegrityError:
+                db.rollback()
+        return rounds
+    finally:
+        db.close()
+
+
+def calibrate_bcrypt_rounds(target_ms: float = BCRYPT_TARGET_MS, probe_rounds: int = 8) -> int:
+    """
+    Elige el coste de bcrypt cuyo hash tarda lo más cerca posible de target_ms
+    
+    Mide un hash con un coste bajo y extrapola (cada ronda duplica el
+    tiempo) en cada arranque, así el coste sigue al hardware. El coste en
+    uso se guarda en app_settings y solo sube: con max(guardado, medido)
+    todos los workers usan el mismo y una medición más baja (un arranque
+    con la máquina cargada) no hace rehashear contraseñas. Si BCRYPT_ROUNDS
+    está definido no se calibra.
+    
+    Args:
+        target_ms: Latencia objetivo de un hash en milisegundos
+        probe_rounds: Coste usado para la medición
+        
+    Returns:
+        Coste elegido (y aplicado a los nuevos hashes)
+    """
+    global _bcrypt_rounds, _bcrypt_calibration
+    
+    if BCRYPT_ROUNDS_ENV:
+        return _bcrypt_rounds
+    
+    salt = bcrypt.gensalt(rounds=probe_rounds)
+    bcrypt.hashpw(b"calibration", salt)  # Calentamiento
+    samples = []
+    for _ in range(3):
+        t0 = time.perf_counter()
+        bcrypt.hashpw(b"calibration", salt)
+        samples.append((time.perf_counter() - t0) * 1000)
+    probe_ms = min(samples)
+    
+    rounds = probe_rounds + round(math.log2(target_ms / probe_ms))
+    measured = max(BCRYPT_MIN_ROUNDS, min(BCRYPT_MAX_ROUNDS, rounds))
+    rounds = _store_bcrypt_rounds(measured)
+    
+    _bcrypt_rounds = rounds
+    _bcrypt_calibration = {
+        "rounds": rounds,
+        "source": "calibrated",
+        "measured_rounds": measured,
+        "target_ms": target_ms,
+        "estimated_ms": round(probe_ms * 2 ** (rounds - probe_rounds), 1)
+    }
+    print(f"[AUTH] ⚙️ Coste de bcrypt calibrado: {rounds} (medido {measured}, "
+          f"~{_bcrypt_calibration['estimated_ms']} ms por hash)")
+    return rounds
+
+
+def get_bcrypt_calibration() -> dict:
+    """Coste de bcrypt en uso y cómo se eligió"""
+    return dict(_bcrypt_calibration)
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """
+    Indica si un hash se generó con un coste menor que el actual
+    
+    Solo se sube el coste: un hash más fuerte que el objetivo se deja como está
+    
+    Args:
+        hashed_password: Hash con formato $2b$<coste>$...
+        
+    Returns:
+        True si conviene volver a hashear la contraseña
+    """
+    try:
+        return int(hashed_password.split("$")[2]) < _bcrypt_rounds
+    except (IndexError, ValueError):
+        return False
 
 
 # ============================================================================
@@ -22,20 +267,22 @@ ACCESS_TOKEN_EXPIRE_HOURS = 24
 
 def hash_password(password: str) -> str:
     """
-    Hashea una contraseña usando bcrypt
+    Hashea una contraseña usando bcrypt (en el pool de procesos)
     
     Args:
         password: Contraseña en texto plano
         
     Returns:
         Hash de la contraseña
+        
+    Raises:
+        PasswordPoolBusy: Si el pool está saturado
     """
     # Convertir a bytes
     password_bytes = password.encode('utf-8')
     
     # Generar salt y hashear
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password_bytes, salt)
+    hashed = _run_password_task(_hashpw, password_bytes, _bcrypt_rounds)
     
     # Devolver como string
     return hashed.decode('utf-8')
@@ -43,7 +290,7 @@ def hash_password(password: str) -> str:
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
-    Verifica una contraseña contra su hash
+    Verifica una contraseña contra su hash (en el pool de procesos)
     
     Args:
         plain_password: Contraseña en texto plano
@@ -51,6 +298,9 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         
     Returns:
         True si la contraseña es correcta
+        
+    Raises:
+        PasswordPoolBusy: Si el pool está saturado
     """
     try:
         # Convertir ambos a bytes
@@ -58,7 +308,9 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         hashed_bytes = hashed_password.encode('utf-8')
         
         # Verificar
-        return bcrypt.checkpw(password_bytes, hashed_bytes)
+        return _run_password_task(_checkpw, password_bytes, hashed_bytes)
+    except PasswordPoolBusy:
+        raise
     except Exception as e:
         print(f"[AUTH] ❌ Error verificando password: {e}")
         return False
@@ -70,10 +322,11 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """
-    Crea un token JWT con los datos proporcionados
+    Crea un access token JWT de vida corta con los datos proporcionados
     
     Args:
-        data: Diccionario con los datos a incluir en el token
+        data: Diccionario con los datos a incluir en el token (user_id,
+            email y sid = jti del refresh token de la sesión)
         expires_delta: Tiempo de expiración personalizado
         
     Returns:
@@ -84,14 +337,34 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
+        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "type": "access", "jti": uuid.uuid4().hex})
     
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+def create_refresh_token(user_id: int) -> tuple[str, str, datetime]:
+    """
+    Crea un refresh token JWT de vida larga (se guarda en BD para poder revocarlo)
+    
+    Args:
+        user_id: ID del usuario
+        
+    Returns:
+        Tupla (token, jti, fecha de expiración)
+    """
+    jti = uuid.uuid4().hex
+    expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    token = jwt.encode(
+        {"user_id": user_id, "type": "refresh", "jti": jti, "exp": expire},
+        SECRET_KEY,
+        algorithm=ALGORITHM
+    )
+    return token, jti, expire
+
+
 def decode_access_token(token: str) -> Optional[dict]:
     """
     Decodifica y valida un token JWT
@@ -115,32 +388,58 @@ def decode_access_token(token: str) -> Optional[dict]:
 
 def get_user_from_token(token: str) -> Optional[dict]:
     """
-    Extrae la información del usuario desde un token
+    Extrae la información del usuario desde un access token
+    
+    La verificación no consulta la BD: la revocación de la sesión se mira
+    en la lista en memoria (revocation.py)
     
     Args:
         token: Token JWT como string
         
     Returns:
-        Diccionario con user_id y email o None
+        Diccionario con user_id, email, exp y sid o None
     """
     payload = decode_access_token(token)
     
     if payload is None:
         return None
     
+    # Un refresh token no sirve como access token
+    if payload.get("type") == "refresh":
+        return None
+    
     user_id = payload.get("user_id")
     email = payload.get("email")
     
     if user_id is None or email is None:
         return None
     
+    sid = payload.get("sid")
+    if revocation_list.is_revoked(sid):
+        print("[AUTH] 🚫 Sesión revocada")
+        return None
+    
     return {
         "user_id": user_id,
         "email": email,
-        "exp": payload.get("exp")
+        "exp": payload.get("exp"),
+        "sid": sid
     }
 
 
+def is_admin(user_data: dict) -> bool:
+    """
+    Indica si el usuario del token es administrador (ADMIN_EMAILS)
+    
+    Args:
+        user_data: Diccionario devuelto por get_user_from_token
+        
+    Returns:
+        True si su email está en ADMIN_EMAILS
+    """
+    return (user_data.get("email") or "").lower() in ADMIN_EMAILS
+
+
 # ============================================================================
 # TEST
 # ============================================================================
@@ -0,0 +1,76 @@
+"""
+Benchmark de /api/analytics/proyectos: GROUP BY en la BD vs agregación en Python
+
+Siembra varios años de historial y compara el endpoint (agregados en SQL)
+con descargar todas las filas y agregarlas en Python.
+
+Uso:
+    python benchmarks/bench_analytics.py
+"""
+from collections import defaultdict
+from datetime import date
+
+from common import reset_db, seed, QueryCounter, timeit, print_header
+from database import SessionLocal, Imputacion, engine
+from migrations import run_migrations
+from routes.analytics_routes import get_estadisticas_proyectos
+from utils import get_monday_of_week
+
+
+def stats_in_python(db, user_id: int, desde: date, hasta: date) -> tuple[dict, dict, int]:
+    """Alternativa ingenua: traer todas las filas y agregar en Python (mismas métricas)"""
+    por_proyecto = defaultdict(list)
+    por_dia = defaultdict(float)
+    filas = 0
+    for project_id, fecha, horas in db.query(Imputacion.project_id, Imputacion.fecha, Imputacion.horas).filter(
+        Imputacion.user_id == user_id,
+        Imputacion.fecha.between(desde, hasta),
+        Imputacion.horas > 0
+    ):
+        filas += 1
+        por_proyecto[(project_id, get_monday_of_week(fecha))].append(horas)
+        por_dia[fecha] += horas
+    
+    por_semana = defaultdict(list)
+    for fecha, horas in por_dia.items():
+        por_semana[get_monday_of_week(fecha)].append(horas)
+    
+    def _agg(values):
+        return sum(values), len(values), max(values), sum(1 for h in values if h > 8)
+    
+    return (
+        {key: _agg(values) for key, values in por_proyecto.items()},
+        {key: _agg(values) for key, values in por_semana.items()},
+        filas
+    )
+
+
+def main():
+    print_header("Analítica: GROUP BY en SQL vs Python (5 años de historial)")
+    reset_db()
+    run_migrations(engine)
+    user_ids = seed(num_users=40, num_weeks=52 * 5, start=date(2020, 1, 6))
+    user = {"user_id": user_ids[len(user_ids) // 2], "email": "bench@example.com"}
+    desde, hasta = date(2020, 1, 1), date(2024, 12, 31)
+    
+    db = SessionLocal()
+    try:
+        print(f"Filas de imputaciones: {db.query(Imputacion).count()}")
+        
+        for periodo in ("dia", "semana", "mes"):
+            fn = lambda: get_estadisticas_proyectos(desde, hasta, periodo, user, db)
+            with QueryCounter() as counter:
+                result = fn()
+            stats = timeit(fn, repeat=20)
+            print(f"SQL {periodo:<7} queries={counter.count} buckets={sum(len(p['periodos']) for p in result['proyectos']):<5} "
+                  f"mean={stats['mean']:.2f}ms p99={stats['p99']:.2f}ms")
+        
+        _, _, filas = stats_in_python(db, user["user_id"], desde, hasta)
+        stats = timeit(lambda: stats_in_python(db, user["user_id"], desde, hasta), repeat=20)
+        print(f"Python semana  filas transferidas={filas} mean={stats['mean']:.2f}ms p99={stats['p99']:.2f}ms")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
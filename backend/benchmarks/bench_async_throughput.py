@@ -0,0 +1,172 @@
+"""
+Benchmark: throughput con peticiones concurrentes en modo síncrono y DB_ASYNC
+
+Arranca el servidor con uvicorn en un subproceso dos veces: con los endpoints
+síncronos (threadpool de Starlette) y con DB_ASYNC=true (async def sobre
+aiosqlite). En cada caso lanza varios niveles de concurrencia con una mezcla de
+lecturas y escrituras (/rango, /projects, /chat y POST /imputaciones) y mide
+peticiones por segundo y latencias.
+
+Uso:
+    python benchmarks/bench_async_throughput.py
+"""
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+PORT = 8766
+BASE_URL = f"http://127.0.0.1:{PORT}"
+
+USERS = 8
+CONCURRENCY_LEVELS = [8, 32, 96]
+DURATION_SECONDS = 8
+
+# Días laborables de junio de 2024: cada cliente escribe en su propia celda
+WORKING_DAYS = [d for d in range(3, 29) if d % 7 not in (1, 2)]
+
+
+def request(method: str, path: str, body: dict = None, token: str = None) -> tuple[int, dict]:
+    """Petición HTTP mínima con urllib (sin dependencias extra)"""
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(BASE_URL + path, data=data, headers=headers, method=method)
+    try:
+        with urllib.request.urlopen(req, timeout=60) as resp:
+            return resp.status, json.loads(resp.read() or b"null")
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+
+def start_server(env_overrides: dict) -> subprocess.Popen:
+    db_path = os.path.join(tempfile.gettempdir(), "bench_async.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{db_path}", **env_overrides}
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(PORT), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(BASE_URL + "/health", timeout=1)
+            return proc
+        except Exception:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("El servidor no arrancó")
+
+
+def setup_users() -> list[tuple[str, list[int]]]:
+    """Registra usuarios con dos proyectos cada uno"""
+    users = []
+    for i in range(USERS):
+        _, data = request("POST", "/api/auth/register", {"email": f"bench{i}@test.com", "password": "secret1"})
+        token = data["token"]
+        projects = [
+            request("POST", "/api/projects", {"nombre": f"P{j}"}, token=token)[1]["id"]
+            for j in range(2)
+        ]
+        users.append((token, projects))
+    return users
+
+
+def one_request(rng: random.Random, token: str, cell: tuple[int, str]) -> int:
+    """Una petición de la mezcla: 40% rango, 20% proyectos, 20% chat, 20% escritura"""
+    roll = rng.random()
+    if roll < 0.4:
+        return request("GET", "/api/imputaciones/rango?from=2024-06-03&to=2024-06-28", token=token)[0]
+    if roll < 0.6:
+        return request("GET", "/api/projects", token=token)[0]
+    if roll < 0.8:
+        return request("GET", "/api/chat/messages", token=token)[0]
+    project_id, fecha = cell
+    body = {"project_id": project_id, "fecha": fecha, "horas": rng.randint(0, 8)}
+    return request("POST", "/api/imputaciones", body, token=token)[0]
+
+
+def run_level(users: list, concurrency: int) -> dict:
+    """Lanza `concurrency` clientes durante DURATION_SECONDS"""
+    stop = threading.Event()
+    latencies: list[float] = []
+    errors = [0]
+    lock = threading.Lock()
+    
+    def client(idx: int):
+        rng = random.Random(idx)
+        token, projects = users[idx % len(users)]
+        slot = idx // len(users)
+        cell = (projects[slot % 2], f"2024-06-{WORKING_DAYS[slot // 2]:02d}")
+        local, local_errors = [], 0
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            status = one_request(rng, token, cell)
+            local.append((time.perf_counter() - t0) * 1000)
+            if status >= 400:
+                local_errors += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+    
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(DURATION_SECONDS)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    
+    latencies.sort()
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50": statistics.median(latencies),
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "errors": errors[0],
+    }
+
+
+def run_mode(label: str, env_overrides: dict) -> dict:
+    proc = start_server(env_overrides)
+    try:
+        users = setup_users()
+        results = {}
+        for concurrency in CONCURRENCY_LEVELS:
+            results[concurrency] = run_level(users, concurrency)
+            r = results[concurrency]
+            print(f"  {label:<8} c={concurrency:<4} {r['rps']:8.1f} req/s   "
+                  f"p50 {r['p50']:7.1f} ms   p99 {r['p99']:7.1f} ms   errores {r['errors']}")
+        return results
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    print("=" * 72)
+    print(f"Throughput concurrente ({DURATION_SECONDS}s por nivel, {USERS} usuarios)")
+    print("=" * 72)
+    
+    sync_results = run_mode("sync", {"DB_ASYNC": "false"})
+    async_results = run_mode("async", {"DB_ASYNC": "true"})
+    
+    print("-" * 72)
+    for concurrency in CONCURRENCY_LEVELS:
+        ratio = async_results[concurrency]["rps"] / sync_results[concurrency]["rps"]
+        print(f"  c={concurrency:<4} async/sync: {ratio:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
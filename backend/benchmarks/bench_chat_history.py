@@ -0,0 +1,95 @@
+"""
+Benchmark de GET /api/chat/messages: abrir el chat y cargar páginas anteriores
+
+Siembra un historial largo para un usuario (entre otros usuarios con el suyo)
+y compara:
+
+- antes: limit=500 ordenado por created_at ascendente (los 500 más antiguos),
+  del que el frontend solo mostraba los últimos 50.
+- última página: lo que pide ahora el chat al abrirse (limit=50, del más nuevo
+  al más antiguo).
+- página anterior: before_id sobre el índice (user_id, id), aquí desde el
+  principio del historial, el peor caso para un OFFSET.
+
+Uso:
+    python benchmarks/bench_chat_history.py
+"""
+from datetime import datetime, timedelta
+
+from common import reset_db, seed, timeit, print_header
+from database import SessionLocal, ChatMessage, engine
+from migrations import run_migrations
+from routes.chat_routes import get_chat_messages
+
+from sqlalchemy import text
+
+USERS = 20
+MESSAGES_PER_USER = 5000
+PAGE = 50
+
+
+def seed_chat(user_ids: list[int]):
+    db = SessionLocal()
+    try:
+        start = datetime(2024, 1, 1)
+        for i in range(MESSAGES_PER_USER):
+            db.bulk_insert_mappings(ChatMessage, [
+                {
+                    "user_id": user_id,
+                    "role": "user" if i % 2 else "bot",
+                    "message": f"Mensaje {i} " + "x" * 120,
+                    "created_at": start + timedelta(minutes=i)
+                }
+                for user_id in user_ids
+            ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def old_query(db, user_id: int) -> list:
+    """Consulta anterior: los 500 más antiguos por created_at"""
+    return db.query(ChatMessage)\
+        .filter(ChatMessage.user_id == user_id)\
+        .order_by(ChatMessage.created_at.asc())\
+        .limit(500)\
+        .all()
+
+
+def main():
+    print_header(f"Historial de chat: {MESSAGES_PER_USER} mensajes por usuario, {USERS} usuarios")
+    reset_db()
+    run_migrations(engine)
+    user_ids = seed(num_users=USERS, num_weeks=1)
+    seed_chat(user_ids)
+    user = {"user_id": user_ids[USERS // 2]}
+    
+    db = SessionLocal()
+    try:
+        # Cursor a dos páginas del principio: de las más profundas del historial
+        cursor = old_query(db, user["user_id"])[PAGE * 2].id
+        
+        cases = [
+            ("antes (limit=500)", lambda: old_query(db, user["user_id"])),
+            ("última página", lambda: get_chat_messages(
+                limit=PAGE, before_id=None, after_id=None, current_user=user, db=db)),
+            ("página anterior", lambda: get_chat_messages(
+                limit=PAGE, before_id=cursor, after_id=None, current_user=user, db=db)),
+        ]
+        for label, fn in cases:
+            rows = len(fn())
+            # Sin identity map entre repeticiones: cada carga construye sus objetos
+            stats = timeit(lambda: (db.expunge_all(), fn()), repeat=200)
+            print(f"  {label:<20} {rows:>4} filas   p50 {stats['p50']:6.2f} ms   p99 {stats['p99']:6.2f} ms")
+        
+        plan = db.execute(text(
+            "EXPLAIN QUERY PLAN SELECT * FROM chat_messages WHERE user_id = :u AND id < :c ORDER BY id DESC LIMIT 50"
+        ), {"u": user["user_id"], "c": cursor}).fetchall()
+        print("-" * 70)
+        print("  plan (before_id): " + "; ".join(row[-1] for row in plan))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
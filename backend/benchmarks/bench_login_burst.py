@@ -0,0 +1,132 @@
+"""
+Prueba de carga: latencia de /api/imputaciones/semana durante una ráfaga de logins
+
+Arranca el servidor con uvicorn en un subproceso dos veces: con bcrypt en el
+propio hilo (PASSWORD_POOL_WORKERS=0) y con el pool de procesos acotado. En
+cada caso mide la latencia de /semana sin carga y mientras muchos clientes
+hacen login a la vez.
+
+Uso:
+    python benchmarks/bench_login_burst.py
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+PORT = 8765
+BASE_URL = f"http://127.0.0.1:{PORT}"
+
+LOGIN_CLIENTS = 48
+LOGINS_PER_CLIENT = 4
+SEMANA_REQUESTS = 200
+
+
+def request(method: str, path: str, body: dict = None, token: str = None) -> tuple[int, dict]:
+    """Petición HTTP mínima con urllib (sin dependencias extra)"""
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(BASE_URL + path, data=data, headers=headers, method=method)
+    try:
+        with urllib.request.urlopen(req, timeout=60) as resp:
+            return resp.status, json.loads(resp.read() or b"null")
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+
+def start_server(env_overrides: dict) -> subprocess.Popen:
+    db_path = os.path.join(tempfile.gettempdir(), "bench_login.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{db_path}", **env_overrides}
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(PORT), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(BASE_URL + "/health", timeout=1)
+            return proc
+        except Exception:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("El servidor no arrancó")
+
+
+def measure_semana(token: str, stop: threading.Event = None) -> list[float]:
+    """Lanza peticiones a /semana secuencialmente y devuelve latencias en ms"""
+    samples = []
+    for _ in range(SEMANA_REQUESTS):
+        if stop is not None and stop.is_set():
+            break
+        t0 = time.perf_counter()
+        request("GET", "/api/imputaciones/semana/2024-06-12", token=token)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+def p99(samples: list[float]) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+
+def run_scenario(nombre: str, env_overrides: dict):
+    proc = start_server(env_overrides)
+    try:
+        status, data = request("POST", "/api/auth/register", {"email": "bench@example.com", "password": "secret1"})
+        token = data["token"]
+        status, project = request("POST", "/api/projects", {"nombre": "Bench"}, token)
+        request("POST", "/api/imputaciones", {"project_id": project["id"], "fecha": "2024-06-12", "horas": 8}, token)
+        
+        baseline = measure_semana(token)
+        
+        login_status: dict[int, int] = {}
+        lock = threading.Lock()
+        
+        def login_client():
+            for _ in range(LOGINS_PER_CLIENT):
+                code, _ = request("POST", "/api/auth/login", {"email": "bench@example.com", "password": "secret1"})
+                with lock:
+                    login_status[code] = login_status.get(code, 0) + 1
+        
+        clients = [threading.Thread(target=login_client) for _ in range(LOGIN_CLIENTS)]
+        for t in clients:
+            t.start()
+        time.sleep(0.2)
+        
+        t0 = time.perf_counter()
+        burst = measure_semana(token)
+        semana_time = time.perf_counter() - t0
+        for t in clients:
+            t.join()
+        
+        print(f"\n{nombre}")
+        print(f"  semana sin carga    p50={statistics.median(baseline):7.2f}ms p99={p99(baseline):7.2f}ms")
+        print(f"  semana con ráfaga   p50={statistics.median(burst):7.2f}ms p99={p99(burst):7.2f}ms "
+              f"({len(burst)} peticiones en {semana_time:.1f}s)")
+        print(f"  logins por código   {dict(sorted(login_status.items()))}")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    print("=" * 70)
+    print(f"⏱️  /semana durante {LOGIN_CLIENTS}x{LOGINS_PER_CLIENT} logins concurrentes")
+    print("=" * 70)
+    run_scenario("bcrypt en el threadpool (PASSWORD_POOL_WORKERS=0)", {"PASSWORD_POOL_WORKERS": "0"})
+    run_scenario("bcrypt en pool de procesos acotado", {})
+
+
+if __name__ == "__main__":
+    main()
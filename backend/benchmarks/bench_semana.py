@@ -0,0 +1,64 @@
+"""
+Benchmark de GET /api/imputaciones/semana: N+1 original vs consulta única
+
+Uso:
+    python benchmarks/bench_semana.py
+"""
+from datetime import date
+
+from common import reset_db, seed, QueryCounter, timeit, print_header
+from database import SessionLocal, Imputacion, Project
+from utils import get_monday_of_week, get_week_dates
+from routes.imputacion_routes import build_semana_data
+
+
+def build_semana_data_legacy(db, user_id: int, lunes: date) -> list:
+    """Implementación original: una query de proyectos + una por proyecto"""
+    fechas = get_week_dates(lunes)
+    projects = db.query(Project).filter(
+        Project.user_id == user_id
+    ).order_by(Project.created_at).all()
+    
+    proyectos_data = []
+    for project in projects:
+        imputaciones = db.query(Imputacion).filter(
+            Imputacion.user_id == user_id,
+            Imputacion.project_id == project.id,
+            Imputacion.fecha.in_(fechas)
+        ).all()
+        if not imputaciones or sum(imp.horas for imp in imputaciones) == 0:
+            continue
+        imputaciones_dict = {imp.fecha: imp.horas for imp in imputaciones}
+        proyectos_data.append({
+            "id": project.id,
+            "nombre": project.nombre,
+            "color": project.color,
+            "horas": {f.isoformat(): imputaciones_dict.get(f, 0) for f in fechas}
+        })
+    return proyectos_data
+
+
+def main():
+    print_header("Semana: N+1 vs consulta única")
+    reset_db()
+    user_ids = seed(num_users=100, num_weeks=104)
+    user_id = user_ids[len(user_ids) // 2]
+    lunes = get_monday_of_week(date(2024, 6, 12))
+    
+    db = SessionLocal()
+    try:
+        # Ambas implementaciones deben devolver lo mismo
+        assert build_semana_data(db, user_id, lunes) == build_semana_data_legacy(db, user_id, lunes)
+        
+        for nombre, fn in [("legacy (N+1)", build_semana_data_legacy), ("consulta única", build_semana_data)]:
+            with QueryCounter() as counter:
+                fn(db, user_id, lunes)
+            stats = timeit(lambda: fn(db, user_id, lunes))
+            print(f"{nombre:<16} queries={counter.count:<3} "
+                  f"mean={stats['mean']:.3f}ms p50={stats['p50']:.3f}ms p99={stats['p99']:.3f}ms")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Benchmark: commits y tiempo de escritura al teclear en la rejilla por WebSocket
+
+Simula a varios usuarios tecleando en unas pocas celdas (cada pulsación es un
+"imputar"). Compara un commit por edición (save_imputacion) con el buffer de
+escritura diferida de writebehind.py, contando commits y sentencias SQL.
+
+Uso:
+    python benchmarks/bench_write_behind.py
+"""
+import asyncio
+import time
+from datetime import date, timedelta
+
+from common import reset_db, seed, print_header, QueryCounter
+
+from sqlalchemy import event
+
+from database import engine, SessionLocal, Project
+from routes.websocket_routes import save_imputacion
+from writebehind import WriteBehindBuffer
+
+USERS = 10
+CELLS_PER_USER = 5
+KEYSTROKES_PER_CELL = 20
+# Pausa entre pulsaciones del mismo usuario
+KEYSTROKE_MS = 5
+FLUSH_MS = 250
+
+MONDAY = date(2024, 1, 1)
+
+
+class CommitCounter:
+    """Cuenta los commits del engine dentro de un bloque with"""
+    
+    def __init__(self):
+        self.count = 0
+    
+    def _on_commit(self, *args):
+        self.count += 1
+    
+    def __enter__(self):
+        event.listen(engine, "commit", self._on_commit)
+        return self
+    
+    def __exit__(self, *exc):
+        event.remove(engine, "commit", self._on_commit)
+
+
+def edits(user_id: int, project_ids: list[int]) -> list[tuple]:
+    """Pulsaciones de un usuario: cada celda recibe KEYSTROKES_PER_CELL valores seguidos"""
+    cells = [(project_ids[i % len(project_ids)], MONDAY + timedelta(days=i % 5)) for i in range(CELLS_PER_USER)]
+    return [
+        (user_id, project_id, fecha, float(k % 9))
+        for project_id, fecha in cells
+        for k in range(KEYSTROKES_PER_CELL)
+    ]
+
+
+async def typing(user_edits: list[tuple], write):
+    for edit in user_edits:
+        await write(*edit)
+        await asyncio.sleep(KEYSTROKE_MS / 1000)
+
+
+async def direct(workload: list[list[tuple]]):
+    """Un commit por edición, como el WebSocket sin buffer"""
+    db = SessionLocal()
+    
+    async def write(user_id, project_id, fecha, horas):
+        save_imputacion(db, user_id, project_id, fecha, horas)
+    
+    try:
+        await asyncio.gather(*(typing(user_edits, write) for user_edits in workload))
+    finally:
+        db.close()
+
+
+async def buffered(workload: list[list[tuple]]):
+    """Escritura diferida: último valor por celda, volcado cada FLUSH_MS"""
+    buffer = WriteBehindBuffer(enabled=True, flush_ms=FLUSH_MS)
+    await buffer.start(lambda user_id, message: None)
+    
+    async def write(user_id, project_id, fecha, horas):
+        buffer.put(user_id, project_id, fecha, horas)
+    
+    await asyncio.gather(*(typing(user_edits, write) for user_edits in workload))
+    await buffer.stop()
+    return buffer.stats()
+
+
+def run(label: str, coro_fn, workload: list[list[tuple]]):
+    with CommitCounter() as commits, QueryCounter() as queries:
+        t0 = time.perf_counter()
+        result = asyncio.run(coro_fn(workload))
+        elapsed = time.perf_counter() - t0
+    
+    total = sum(len(user_edits) for user_edits in workload)
+    print(f"  {label:<16} {total} ediciones   {commits.count:>5} commits   "
+          f"{queries.count:>6} queries   {elapsed * 1000:8.1f} ms")
+    return result
+
+
+def main():
+    print_header(f"Escritura por WebSocket: {USERS} usuarios, {CELLS_PER_USER} celdas, "
+                 f"{KEYSTROKES_PER_CELL} pulsaciones por celda")
+    
+    reset_db()
+    user_ids = seed(num_users=USERS, num_weeks=1, start=MONDAY)
+    db = SessionLocal()
+    try:
+        workload = [
+            edits(user_id, [p for (p,) in db.query(Project.id).filter(Project.user_id == user_id)])
+            for user_id in user_ids
+        ]
+    finally:
+        db.close()
+    
+    run("commit a commit", direct, workload)
+    stats = run(f"buffer {FLUSH_MS} ms", buffered, workload)
+    print(f"  coalescidas: {stats['coalesced']}   filas escritas: {stats['written']}   "
+          f"volcados: {stats['flushes']}")
+
+
+if __name__ == "__main__":
+    main()
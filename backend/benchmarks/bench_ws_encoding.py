@@ -0,0 +1,131 @@
+"""
+Benchmark: bytes en la red y CPU por difusión según la codificación WebSocket
+
+Simula un usuario muy activo con varias pestañas abiertas: la mayoría de las
+difusiones son una celda (imputacion_updated) y algunas un lote de la semana
+(imputaciones_updated). Compara:
+
+- json por pestaña: como antes, send_json codificaba una vez por conexión.
+- json: texto JSON codificado una vez por difusión (deliver_to_user).
+- binary: frames binarios de wsframing.py codificados una vez por difusión.
+
+Para cada uno mide bytes por difusión (todas las pestañas), con y sin
+permessage-deflate (un compresor por conexión con context takeover, como
+negocian por defecto navegador y uvicorn), y CPU de codificación, compresión
+y decodificación por difusión.
+
+Uso:
+    python benchmarks/bench_ws_encoding.py
+"""
+import json
+import random
+import time
+import zlib
+from datetime import date, timedelta
+
+from common import print_header
+
+from wsframing import encode_message, decode_binary, encode_json
+
+TABS = 5
+BROADCASTS = 5000
+BATCH_RATIO = 0.2
+SEED = 7
+
+# Cola que permessage-deflate quita de cada mensaje comprimido
+DEFLATE_TAIL = b"\x00\x00\xff\xff"
+
+
+def workload() -> list[dict]:
+    """Difusiones de un usuario: celdas sueltas y algún lote de semana"""
+    rng = random.Random(SEED)
+    monday = date(2024, 6, 3)
+    projects = [1287, 1288, 1301]
+    messages = []
+    for seq in range(1, BROADCASTS + 1):
+        week = monday + timedelta(weeks=rng.randint(0, 3))
+        if rng.random() < BATCH_RATIO:
+            cells = [
+                {"project_id": project_id, "fecha": (week + timedelta(days=d)).isoformat(), "horas": rng.randint(0, 16) / 2}
+                for project_id in rng.sample(projects, rng.randint(1, 3))
+                for d in range(5)
+            ]
+            messages.append({"type": "imputaciones_updated", "imputaciones": cells, "seq": seq})
+        else:
+            messages.append({
+                "type": "imputacion_updated",
+                "project_id": rng.choice(projects),
+                "fecha": (week + timedelta(days=rng.randint(0, 4))).isoformat(),
+                "horas": rng.randint(0, 16) / 2,
+                "seq": seq
+            })
+    return messages
+
+
+def deflate(compressor, payload) -> bytes:
+    data = payload.encode() if isinstance(payload, str) else payload
+    out = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return out[:-len(DEFLATE_TAIL)] if out.endswith(DEFLATE_TAIL) else out
+
+
+def decode(payload) -> dict:
+    return json.loads(payload) if isinstance(payload, str) else decode_binary(payload)
+
+
+def run(label: str, messages: list[dict], encoding: str, per_tab: bool) -> dict:
+    compressors = [zlib.compressobj(wbits=-15) for _ in range(TABS)]
+    raw_bytes = deflated_bytes = 0
+    encode_time = deflate_time = decode_time = 0.0
+    
+    for message in messages:
+        t0 = time.perf_counter()
+        if per_tab:
+            payloads = [encode_json(message) for _ in range(TABS)]
+        else:
+            payloads = [encode_message(message, encoding)] * TABS
+        encode_time += time.perf_counter() - t0
+        
+        for payload, compressor in zip(payloads, compressors):
+            raw_bytes += len(payload.encode()) if isinstance(payload, str) else len(payload)
+            t0 = time.perf_counter()
+            deflated_bytes += len(deflate(compressor, payload))
+            deflate_time += time.perf_counter() - t0
+        
+        # Cada pestaña decodifica su copia
+        t0 = time.perf_counter()
+        for payload in payloads:
+            decode(payload)
+        decode_time += time.perf_counter() - t0
+    
+    n = len(messages)
+    result = {
+        "bytes": raw_bytes / n,
+        "deflated": deflated_bytes / n,
+        "encode_us": encode_time / n * 1e6,
+        "deflate_us": deflate_time / n * 1e6,
+        "decode_us": decode_time / n * 1e6,
+    }
+    print(f"  {label:<18} {result['bytes']:8.0f} B {result['deflated']:8.0f} B   "
+          f"{result['encode_us']:7.1f} µs {result['deflate_us']:8.1f} µs {result['decode_us']:8.1f} µs")
+    return result
+
+
+def main():
+    messages = workload()
+    batches = sum(1 for m in messages if m["type"] == "imputaciones_updated")
+    print_header(f"Codificación WebSocket: {BROADCASTS} difusiones ({batches} lotes) a {TABS} pestañas")
+    print(f"  {'':<18} {'bytes':>10} {'deflate':>10}   {'codificar':>10} {'comprimir':>11} {'decodificar':>11}")
+    print("  (por difusión, sumando todas las pestañas)")
+    
+    base = run("json por pestaña", messages, "json", per_tab=True)
+    run("json", messages, "json", per_tab=False)
+    binary = run("binary", messages, "binary", per_tab=False)
+    
+    print("-" * 70)
+    print(f"  binary vs json por pestaña: {base['bytes'] / binary['bytes']:.1f}x menos bytes, "
+          f"{base['deflated'] / binary['deflated']:.1f}x con deflate, "
+          f"{base['encode_us'] / binary['encode_us']:.1f}x menos CPU de codificación")
+
+
+if __name__ == "__main__":
+    main()
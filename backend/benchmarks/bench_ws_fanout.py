@@ -0,0 +1,92 @@
+"""
+Benchmark: latencia de difusión WebSocket con un cliente lento
+
+Simula un usuario con varias pestañas conectadas, una de ellas lenta (cada
+envío tarda SLOW_SEND_MS). Compara la difusión secuencial anterior (await
+send_json conexión a conexión) con las colas por conexión de
+routes/websocket_routes.py, midiendo cuánto tardan en llegar los mensajes a
+las pestañas rápidas.
+
+Uso:
+    python benchmarks/bench_ws_fanout.py
+"""
+import asyncio
+import json
+import statistics
+import time
+
+from common import print_header
+
+import routes.websocket_routes as ws_routes
+
+USER_ID = 1
+FAST_TABS = 4
+SLOW_SEND_MS = 200
+MESSAGES = 20
+
+
+class FakeWebSocket:
+    """WebSocket de prueba que registra cuándo recibe cada mensaje"""
+    
+    def __init__(self, delay_ms: float):
+        self.delay = delay_ms / 1000
+        self.received: list[float] = []
+    
+    async def send_json(self, message: dict):
+        await asyncio.sleep(self.delay)
+        self.received.append(time.perf_counter() - message["sent_at"])
+    
+    async def send_text(self, text: str):
+        await self.send_json(json.loads(text))
+    
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def sequential(fast: list[FakeWebSocket], slow: FakeWebSocket):
+    """Difusión anterior: se espera a cada socket antes de pasar al siguiente"""
+    for i in range(MESSAGES):
+        sent_at = time.perf_counter()
+        for websocket in [slow, *fast]:
+            await websocket.send_json({"i": i, "sent_at": sent_at})
+
+
+async def queued(fast: list[FakeWebSocket], slow: FakeWebSocket, policy: str):
+    """Difusión con cola y tarea de envío por conexión"""
+    connections = [ws_routes.Connection(websocket, USER_ID, policy=policy) for websocket in [slow, *fast]]
+    for connection in connections:
+        connection.start()
+        ws_routes.add_connection(connection)
+    
+    for i in range(MESSAGES):
+        ws_routes.deliver_to_user(USER_ID, {"i": i, "sent_at": time.perf_counter()})
+        await asyncio.sleep(0.01)
+    
+    # Dar tiempo a que las pestañas rápidas vacíen su cola
+    await asyncio.sleep(0.1)
+    for connection in connections:
+        ws_routes.remove_connection(connection)
+        await connection.shutdown()
+
+
+def report(label: str, fast: list[FakeWebSocket]):
+    latencies = sorted(ms * 1000 for websocket in fast for ms in websocket.received)
+    print(f"  {label:<24} recibidos {len(latencies):>3}   "
+          f"p50 {statistics.median(latencies):8.2f} ms   máx {latencies[-1]:8.2f} ms")
+
+
+async def main():
+    print_header(f"Difusión WebSocket: {FAST_TABS} pestañas rápidas + 1 lenta ({SLOW_SEND_MS} ms por envío)")
+    
+    fast, slow = [FakeWebSocket(0) for _ in range(FAST_TABS)], FakeWebSocket(SLOW_SEND_MS)
+    await sequential(fast, slow)
+    report("secuencial", fast)
+    
+    for policy in ws_routes.SLOW_CONSUMER_POLICIES:
+        fast, slow = [FakeWebSocket(0) for _ in range(FAST_TABS)], FakeWebSocket(SLOW_SEND_MS)
+        await queued(fast, slow, policy)
+        report(f"colas ({policy})", fast)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,127 @@
+"""
+Benchmark: conexiones WebSocket muertas con y sin latidos
+
+Simula clientes que se conectan y desconectan sin parar; una parte de ellos
+desaparece sin cerrar el socket (portátil suspendido, red móvil caída): deja
+de responder pero el servidor nunca recibe el cierre. Ejecuta el endpoint
+real (routes/websocket_routes.websocket_endpoint) y compara:
+
+- sin latidos: las conexiones muertas se quedan en el registro para siempre
+  y acaban agotando el límite de conexiones por usuario.
+- con latidos: el servidor envía ping y cierra las que no responden en
+  idle_timeout.
+
+Los tiempos están escalados (latido 0.1 s, inactividad 0.5 s) para que la
+prueba dure unos segundos.
+
+Uso:
+    python benchmarks/bench_ws_idle.py
+"""
+import asyncio
+import contextlib
+import io
+import os
+import random
+import time
+
+# Sin límite de interacciones: solo se mide el registro de conexiones
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+
+from common import reset_db, seed, print_header
+
+from fastapi import WebSocketDisconnect
+
+import routes.websocket_routes as ws_routes
+from auth import create_access_token
+
+USERS = 5
+MAX_PER_USER = 5
+DURATION_SECONDS = 4
+CONNECT_EVERY_MS = 40
+LIFETIME_SECONDS = 0.5
+DEAD_RATIO = 0.3
+HEARTBEAT_SECONDS = 0.1
+IDLE_TIMEOUT_SECONDS = 0.5
+SEED = 3
+
+
+class FakeClient:
+    """Cliente simulado: responde a los ping mientras vive; uno muerto no responde ni cierra"""
+    
+    def __init__(self, lifetime: float, dead: bool):
+        self.query_params = {}
+        self.incoming: asyncio.Queue = asyncio.Queue()
+        self.dead = dead
+        self.rejected = False
+        # El vivo cierra al terminar; el muerto deja de responder a mitad de vida
+        self.gone_at = time.monotonic() + (lifetime / 2 if dead else lifetime)
+        if not dead:
+            asyncio.get_running_loop().call_later(lifetime, self.incoming.put_nowait, None)
+    
+    async def accept(self):
+        pass
+    
+    async def receive_json(self) -> dict:
+        message = await self.incoming.get()
+        if message is None:
+            raise WebSocketDisconnect()
+        return message
+    
+    async def send_text(self, text: str):
+        if '"ping"' in text and time.monotonic() < self.gone_at:
+            self.incoming.put_nowait({"action": "pong"})
+    
+    async def send_bytes(self, data: bytes):
+        pass
+    
+    async def close(self, code: int = 1000, reason: str = None):
+        if code == ws_routes.CLOSE_TRY_AGAIN_LATER:
+            self.rejected = True
+        self.incoming.put_nowait(None)
+
+
+async def run(label: str, tokens: list[str], heartbeat: float, idle_timeout: float):
+    registry = ws_routes.connection_registry = ws_routes.ConnectionRegistry(
+        max_per_user=MAX_PER_USER, max_total=0, heartbeat_seconds=heartbeat, idle_timeout=idle_timeout
+    )
+    await registry.start()
+    rng = random.Random(SEED)
+    
+    clients, tasks, samples = [], [], []
+    t0 = time.monotonic()
+    with contextlib.redirect_stdout(io.StringIO()):
+        while time.monotonic() - t0 < DURATION_SECONDS:
+            client = FakeClient(LIFETIME_SECONDS, dead=rng.random() < DEAD_RATIO)
+            clients.append(client)
+            tasks.append(asyncio.create_task(ws_routes.websocket_endpoint(client, rng.choice(tokens))))
+            samples.append(registry.total)
+            await asyncio.sleep(CONNECT_EVERY_MS / 1000)
+        
+        await registry.stop()
+        stats = registry.stats()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    
+    rejected = sum(1 for client in clients if client.rejected)
+    rejected_alive = sum(1 for client in clients if client.rejected and not client.dead)
+    print(f"  {label:<14} {len(clients):>4} intentos   conexiones al final {stats['connections']:>3} "
+          f"(pico {max(samples):>3})   cerradas por inactividad {stats['reaped']:>3}   "
+          f"rechazadas {rejected:>3} ({rejected_alive} clientes vivos)")
+
+
+async def main():
+    print_header(f"Conexiones muertas: {int(DEAD_RATIO * 100)}% de clientes desaparecen sin cerrar, "
+                 f"máx. {MAX_PER_USER} por usuario")
+    reset_db()
+    tokens = [
+        create_access_token({"user_id": user_id, "email": f"bench{i}@example.com"})
+        for i, user_id in enumerate(seed(num_users=USERS, num_weeks=1))
+    ]
+    
+    await run("sin latidos", tokens, heartbeat=0, idle_timeout=0)
+    await run("con latidos", tokens, heartbeat=HEARTBEAT_SECONDS, idle_timeout=IDLE_TIMEOUT_SECONDS)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
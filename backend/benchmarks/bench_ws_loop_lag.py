@@ -0,0 +1,158 @@
+"""
+Benchmark: retraso del event loop con muchos WebSocket guardando a la vez
+
+Ejecuta el endpoint real (routes/websocket_routes.websocket_endpoint) con
+sockets simulados que envían "imputar" seguidos, mientras una tarea mide
+cuánto se retrasa un sleep de 1 ms (el tiempo que el event loop pasa
+bloqueado). Compara:
+
+- en el event loop: cada mensaje abre una sesión síncrona y consulta y hace
+  commit dentro del propio event loop (el comportamiento anterior).
+- executor: database.run_with_session, una sesión por mensaje en el executor
+  de base de datos (o AsyncSession con DB_ASYNC=true).
+
+Uso:
+    python benchmarks/bench_ws_loop_lag.py
+"""
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import time
+from datetime import date, timedelta
+
+# Sin límite de interacciones: se miden todas las escrituras
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+
+from common import reset_db, seed, print_header
+
+from fastapi import WebSocketDisconnect
+
+import routes.websocket_routes as ws_routes
+from auth import create_access_token
+from broadcast import broadcast_bus
+from database import SessionLocal, Project, run_with_session
+
+SOCKETS = 20
+MESSAGES_PER_SOCKET = 40
+# Pausa entre mensajes de un mismo socket (alguien tecleando en la rejilla)
+MESSAGE_INTERVAL_MS = 5
+PROBE_MS = 1
+
+MONDAY = date(2024, 1, 1)
+
+
+class FakeWebSocket:
+    """WebSocket simulado: entrega los mensajes preparados y descarta lo que recibe"""
+    
+    def __init__(self, messages: list[dict]):
+        self.query_params = {}
+        self.incoming = list(messages)
+        self.sent = 0
+    
+    async def accept(self):
+        pass
+    
+    async def receive_json(self) -> dict:
+        if not self.incoming:
+            raise WebSocketDisconnect()
+        await asyncio.sleep(MESSAGE_INTERVAL_MS / 1000)
+        return self.incoming.pop(0)
+    
+    async def send_text(self, text: str):
+        self.sent += 1
+    
+    async def send_bytes(self, data: bytes):
+        self.sent += 1
+    
+    async def close(self, code: int = 1000, reason: str = None):
+        pass
+
+
+async def run_inline(func, *args, **kwargs):
+    """Comportamiento anterior: sesión síncrona usada dentro del event loop"""
+    db = SessionLocal()
+    try:
+        return func(db, *args, **kwargs)
+    finally:
+        db.close()
+
+
+async def probe(lags: list[float], stop: asyncio.Event):
+    """Mide el retraso de un sleep corto mientras dura la prueba"""
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(PROBE_MS / 1000)
+        lags.append((time.perf_counter() - t0) * 1000 - PROBE_MS)
+
+
+def socket_messages(project_ids: list[int], socket: int) -> list[dict]:
+    return [
+        {
+            "action": "imputar",
+            "project_id": project_ids[i % len(project_ids)],
+            "fecha": (MONDAY + timedelta(days=7 * (socket % 4) + i % 5)).isoformat(),
+            "horas": float(i % 9)
+        }
+        for i in range(MESSAGES_PER_SOCKET)
+    ]
+
+
+async def run(label: str, runner, users: list[tuple[str, list[int]]]):
+    ws_routes.run_with_session = runner
+    lags: list[float] = []
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(lags, stop))
+    
+    sockets = [
+        FakeWebSocket(socket_messages(projects, i))
+        for i, (_, projects) in enumerate(users)
+    ]
+    t0 = time.perf_counter()
+    # Sin los logs por mensaje del endpoint
+    with contextlib.redirect_stdout(io.StringIO()):
+        await asyncio.gather(*(
+            ws_routes.websocket_endpoint(websocket, token)
+            for websocket, (token, _) in zip(sockets, users)
+        ))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await probe_task
+    
+    lags.sort()
+    sent = sum(websocket.sent for websocket in sockets)
+    print(f"  {label:<16} {SOCKETS * MESSAGES_PER_SOCKET / elapsed:7.0f} msg/s   "
+          f"retraso p50 {statistics.median(lags):6.2f} ms   p99 {lags[int(len(lags) * 0.99)]:6.2f} ms   "
+          f"máx {lags[-1]:7.2f} ms   ({sent} envíos)")
+
+
+def setup() -> list[tuple[str, list[int]]]:
+    reset_db()
+    user_ids = seed(num_users=SOCKETS, num_weeks=4, start=MONDAY)
+    db = SessionLocal()
+    try:
+        return [
+            (
+                create_access_token({"user_id": user_id, "email": f"bench{i}@example.com"}),
+                [p for (p,) in db.query(Project.id).filter(Project.user_id == user_id)]
+            )
+            for i, user_id in enumerate(user_ids)
+        ]
+    finally:
+        db.close()
+
+
+async def main():
+    print_header(f"Retraso del event loop: {SOCKETS} WebSockets x {MESSAGES_PER_SOCKET} imputaciones")
+    
+    await broadcast_bus.start(ws_routes.deliver_to_user)
+    
+    users = setup()
+    await run("en el event loop", run_inline, users)
+    users = setup()
+    await run("executor", run_with_session, users)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
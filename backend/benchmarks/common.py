@@ -0,0 +1,117 @@
+"""
+Utilidades compartidas por los benchmarks: BD temporal, datos sembrados y contador de queries
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+# Añadir el directorio del backend al path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Usar siempre una BD temporal para no tocar demo.db
+BENCH_DB_PATH = os.path.join(tempfile.gettempdir(), "bench_demo.db")
+os.environ["DATABASE_URL"] = os.getenv("BENCH_DATABASE_URL", f"sqlite:///{BENCH_DB_PATH}")
+
+from sqlalchemy import event
+
+from database import Base, engine, SessionLocal, User, Project, Imputacion
+from utils import get_monday_of_week, is_weekend
+
+
+def reset_db():
+    """Borra y recrea todas las tablas de la BD de benchmark"""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+
+def seed(num_users: int = 50, num_weeks: int = 52, projects_per_user: int = 3, start: date = None) -> list[int]:
+    """
+    Siembra usuarios, proyectos e imputaciones L-V
+    
+    Args:
+        num_users: Número de usuarios
+        num_weeks: Semanas de historial por usuario
+        projects_per_user: Proyectos por usuario (máximo 3)
+        start: Primer lunes del historial
+        
+    Returns:
+        Lista de IDs de usuario creados
+    """
+    start = get_monday_of_week(start or date(2024, 1, 1))
+    db = SessionLocal()
+    user_ids = []
+    
+    try:
+        for u in range(num_users):
+            user = User(email=f"bench{u}@example.com", password="x")
+            db.add(user)
+            db.flush()
+            user_ids.append(user.id)
+            
+            projects = [Project(user_id=user.id, nombre=f"Proyecto {p}") for p in range(projects_per_user)]
+            db.add_all(projects)
+            db.flush()
+            
+            rows = []
+            for d in range(num_weeks * 7):
+                fecha = start + timedelta(days=d)
+                if is_weekend(fecha):
+                    continue
+                for i, project in enumerate(projects):
+                    rows.append({
+                        "user_id": user.id,
+                        "project_id": project.id,
+                        "fecha": fecha,
+                        "horas": float((d + i + u) % 9)
+                    })
+            db.bulk_insert_mappings(Imputacion, rows)
+        
+        db.commit()
+    finally:
+        db.close()
+    
+    return user_ids
+
+
+class QueryCounter:
+    """Cuenta las sentencias SQL ejecutadas por el engine dentro de un bloque with"""
+    
+    def __init__(self):
+        self.count = 0
+    
+    def _on_execute(self, *args, **kwargs):
+        self.count += 1
+    
+    def __enter__(self):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+        return self
+    
+    def __exit__(self, *exc):
+        event.remove(engine, "before_cursor_execute", self._on_execute)
+
+
+def timeit(fn, repeat: int = 200) -> dict:
+    """
+    Ejecuta fn repetidamente y devuelve estadísticas de latencia en ms
+    """
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return {
+        "mean": sum(samples) / len(samples),
+        "p50": samples[len(samples) // 2],
+        "p99": samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    }
+
+
+def print_header(title: str):
+    print("=" * 70)
+    print(f"⏱️  {title}")
+    print("=" * 70)
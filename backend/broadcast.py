@@ -0,0 +1,233 @@
+"""
+Bus de difusión entre workers para los mensajes WebSocket
+
+Cada worker de uvicorn solo conoce sus propias conexiones, así que
+broadcast_to_user publica en un bus compartido y cada worker entrega a sus
+conexiones locales lo que recibe. Backends (BROADCAST_BACKEND):
+
+- "memory": un solo proceso; se entrega directamente, sin E/S.
+- "db": tabla broadcast_events en la base de datos de la aplicación. Cada
+  worker inserta sus mensajes en bloque y lee los de los demás cada
+  BROADCAST_POLL_MS. Sirve para varios workers en una misma máquina (SQLite)
+  o en varias (PostgreSQL/MySQL).
+
+Para otro backend (p. ej. Redis pub/sub) basta con una subclase de
+BroadcastBus que implemente publish (sin bloquear el event loop), start y
+stop, y entregue los mensajes recibidos llamando a self.deliver(user_id,
+message); después se registra en BROADCAST_BACKENDS.
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Callable, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BROADCAST_BACKEND = os.getenv("BROADCAST_BACKEND", "memory")
+BROADCAST_POLL_MS = int(os.getenv("BROADCAST_POLL_MS", "100"))
+# Los eventos más antiguos se borran: solo sirven para entregar en vivo
+BROADCAST_RETENTION_SECONDS = int(os.getenv("BROADCAST_RETENTION_SECONDS", "60"))
+# Ids que se releen por detrás del último visto: en PostgreSQL/MySQL un id menor
+# puede confirmarse después de uno mayor si dos workers insertan a la vez
+BROADCAST_ID_LOOKBACK = 200
+
+# Identificador de este proceso para no entregarse dos veces sus propios eventos
+WORKER_ID = uuid.uuid4().hex[:12]
+
+
+class BroadcastBus:
+    """Interfaz del bus: publish(user_id, message) y entrega con self.deliver"""
+    
+    name = "base"
+    
+    def __init__(self):
+        self.deliver: Optional[Callable[[int, dict], int]] = None
+        self.published = 0
+        self.received = 0
+    
+    async def start(self, deliver: Callable[[int, dict], int]):
+        """
+        Arranca el bus
+        
+        Args:
+            deliver: Función que entrega un mensaje a las conexiones locales de un usuario
+        """
+        self.deliver = deliver
+    
+    async def stop(self):
+        """Para el bus (al apagar el servidor)"""
+    
+    def publish(self, user_id: int, message: dict):
+        """Publica un mensaje para todas las conexiones del usuario, en cualquier worker"""
+        raise NotImplementedError
+    
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "worker": WORKER_ID,
+            "published": self.published,
+            "received": self.received
+        }
+
+
+class MemoryBus(BroadcastBus):
+    """Un solo proceso: la publicación es la entrega local"""
+    
+    name = "memory"
+    
+    def publish(self, user_id: int, message: dict):
+        self.published += 1
+        if self.deliver is not None:
+            self.deliver(user_id, message)
+
+
+class DatabaseBus(BroadcastBus):
+    """
+    Bus sobre la tabla broadcast_events, compartida por todos los workers
+    
+    Los mensajes propios se entregan en local al momento; la tabla solo la
+    leen los demás workers. Las inserciones pendientes y la lectura de
+    eventos nuevos se hacen juntas, fuera del event loop, en cada pasada.
+    """
+    
+    name = "db"
+    
+    def __init__(self, poll_ms: int = BROADCAST_POLL_MS, retention_seconds: int = BROADCAST_RETENTION_SECONDS):
+        super().__init__()
+        self.poll_interval = poll_ms / 1000
+        self.retention_seconds = retention_seconds
+        self._pending: list[dict] = []
+        self._last_id = 0
+        # Ids ya entregados dentro de la ventana de relectura
+        self._seen: set[int] = set()
+        self._next_prune = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self.errors = 0
+    
+    async def start(self, deliver: Callable[[int, dict], int]):
+        from fastapi.concurrency import run_in_threadpool
+        
+        await super().start(deliver)
+        # Empezar desde el último evento: el historial no se reenvía
+        self._last_id = await run_in_threadpool(self._max_id)
+        self._task = asyncio.create_task(self._run())
+        print(f"[BROADCAST] 📡 Bus 'db' iniciado (worker {WORKER_ID}, cada {int(self.poll_interval * 1000)} ms)")
+    
+    async def stop(self):
+        from fastapi.concurrency import run_in_threadpool
+        
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        # Publicar lo que quede pendiente
+        if self._pending:
+            pending, self._pending = self._pending, []
+            await run_in_threadpool(self._exchange, pending)
+    
+    def publish(self, user_id: int, message: dict):
+        self.published += 1
+        self._pending.append({
+            "origin": WORKER_ID,
+            "user_id": user_id,
+            "payload": json.dumps(message, default=str),
+            "created_at": time.time()
+        })
+        if self.deliver is not None:
+            self.deliver(user_id, message)
+    
+    @staticmethod
+    def _max_id() -> int:
+        from sqlalchemy import func
+        from database import SessionLocal, BroadcastEvent
+        
+        db = SessionLocal()
+        try:
+            return db.query(func.max(BroadcastEvent.id)).scalar() or 0
+        finally:
+            db.close()
+    
+    def _exchange(self, pending: list[dict]) -> list[tuple[int, int, str]]:
+        """Inserta los eventos propios y lee los nuevos de otros workers (en un hilo)"""
+        from sqlalchemy import func
+        from database import SessionLocal, BroadcastEvent
+        
+        db = SessionLocal()
+        try:
+            if pending:
+                db.bulk_insert_mappings(BroadcastEvent, pending)
+            
+            if time.monotonic() >= self._next_prune:
+                db.query(BroadcastEvent).filter(
+                    BroadcastEvent.created_at < time.time() - self.retention_seconds
+                ).delete(synchronize_session=False)
+                self._next_prune = time.monotonic() + self.retention_seconds / 2
+            
+            db.commit()
+            
+            # Ids reiniciados (p. ej. una tabla creada sin AUTOINCREMENT que se
+            # ha vaciado): volver a leer desde el principio
+            max_id = db.query(func.max(BroadcastEvent.id)).scalar() or 0
+            if max_id and max_id < self._last_id:
+                print(f"[BROADCAST] ⚠️ Ids de broadcast_events reiniciados ({max_id} < {self._last_id})")
+                self._last_id = 0
+                self._seen = set()
+            
+            return db.query(BroadcastEvent.id, BroadcastEvent.user_id, BroadcastEvent.payload).filter(
+                BroadcastEvent.id > self._last_id - BROADCAST_ID_LOOKBACK,
+                BroadcastEvent.origin != WORKER_ID
+            ).order_by(BroadcastEvent.id).all()
+        finally:
+            db.close()
+    
+    async def _run(self):
+        from fastapi.concurrency import run_in_threadpool
+        
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            pending, self._pending = self._pending, []
+            try:
+                events = await run_in_threadpool(self._exchange, pending)
+            except Exception as e:
+                self.errors += 1
+                print(f"[BROADCAST] ❌ Error en el bus: {e}")
+                # Reintentar en la siguiente pasada
+                self._pending[:0] = pending
+                continue
+            
+            for event_id, user_id, payload in events:
+                if event_id in self._seen:
+                    continue
+                self._seen.add(event_id)
+                self._last_id = max(self._last_id, event_id)
+                self.received += 1
+                self.deliver(user_id, json.loads(payload))
+            
+            floor = self._last_id - BROADCAST_ID_LOOKBACK
+            self._seen = {event_id for event_id in self._seen if event_id > floor}
+    
+    def stats(self) -> dict:
+        return {**super().stats(), "pending": len(self._pending), "errors": self.errors}
+
+
+BROADCAST_BACKENDS = {
+    MemoryBus.name: MemoryBus,
+    DatabaseBus.name: DatabaseBus,
+}
+
+
+def create_bus(backend: str = BROADCAST_BACKEND) -> BroadcastBus:
+    """Crea el bus configurado en BROADCAST_BACKEND"""
+    if backend not in BROADCAST_BACKENDS:
+        raise ValueError(f"BROADCAST_BACKEND debe ser uno de {list(BROADCAST_BACKENDS)}")
+    return BROADCAST_BACKENDS[backend]()
+
+
+# Instancia global compartida
+broadcast_bus = create_bus()
@@ -0,0 +1,240 @@
+"""
+Cachés en memoria (LRU + TTL) con invalidación explícita
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Hashable, Iterable, Optional
+
+from dotenv import load_dotenv
+
+from utils import get_monday_of_week
+
+load_dotenv()
+
+# Configuración
+WEEK_CACHE_SIZE = int(os.getenv("WEEK_CACHE_SIZE", "2048"))
+WEEK_CACHE_TTL_SECONDS = float(os.getenv("WEEK_CACHE_TTL_SECONDS", "300"))
+# Ids de proyecto de cada usuario (validación de las ediciones por WebSocket)
+PROJECT_CACHE_SIZE = int(os.getenv("PROJECT_CACHE_SIZE", "10000"))
+PROJECT_CACHE_TTL_SECONDS = float(os.getenv("PROJECT_CACHE_TTL_SECONDS", "60"))
+
+
+class TTLCache:
+    """
+    Caché genérica acotada (LRU) con caducidad por entrada, segura entre hilos
+    """
+    
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+    
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Devuelve el valor o None si no está o ha caducado"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Guarda un valor; ttl limita la caducidad por debajo de la de la caché"""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if self.max_size <= 0 or ttl <= 0:
+            return
+        
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+    
+    def pop(self, key: Hashable) -> None:
+        """Invalida una entrada"""
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+    
+    def clear(self) -> None:
+        """Vacía la caché"""
+        with self._lock:
+            self._data.clear()
+    
+    def stats(self) -> dict:
+        """Contadores para dimensionar la caché"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations
+            }
+
+
+class WeekCache:
+    """
+    Caché acotada de respuestas de semana indexada por (user_id, lunes)
+    
+    Es segura entre hilos (las rutas síncronas se ejecutan en el threadpool).
+    Cada usuario tiene una generación que se incrementa al invalidar; un
+    valor calculado con una generación anterior no se guarda, para que una
+    lectura concurrente con una escritura no deje datos viejos en la caché.
+    
+    Las entradas guardan además la versión de datos del usuario: con varios
+    workers, una escritura en otro proceso no invalida esta caché, pero sí
+    cambia la versión y la entrada deja de servirse.
+    """
+    
+    def __init__(self, max_size: int = WEEK_CACHE_SIZE, ttl: float = WEEK_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._generations: dict[int, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+    
+    def generation(self, user_id: int) -> int:
+        """Generación actual del usuario (se pasa a set() tras calcular)"""
+        with self._lock:
+            return self._generations.get(user_id, 0)
+    
+    def get(self, user_id: int, lunes: date, version: Optional[int] = None) -> Optional[list]:
+        """
+        Obtiene los proyectos cacheados de una semana
+        
+        Args:
+            user_id: ID del usuario
+            lunes: Lunes de la semana
+            version: Versión de datos actual del usuario (si se conoce)
+        
+        Returns:
+            Lista de proyectos o None si no está, ha caducado o es de otra versión
+        """
+        key = (user_id, lunes)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            value, expires_at, entry_version = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            
+            if version is not None and entry_version != version:
+                # Escrito desde otro worker
+                del self._data[key]
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def set(self, user_id: int, lunes: date, value: list, generation: int, version: Optional[int] = None) -> None:
+        """
+        Guarda los proyectos de una semana si no ha habido invalidaciones
+        desde que se leyó la generación
+        """
+        if self.max_size <= 0:
+            return
+        
+        key = (user_id, lunes)
+        with self._lock:
+            if self._generations.get(user_id, 0) != generation:
+                return
+            
+            self._data[key] = (value, time.monotonic() + self.ttl, version)
+            self._data.move_to_end(key)
+            
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+    
+    def invalidate(self, user_id: int, fechas: Iterable[date]) -> None:
+        """
+        Invalida las semanas que contienen las fechas dadas
+        
+        Args:
+            user_id: ID del usuario
+            fechas: Fechas modificadas
+        """
+        lunes_set = {get_monday_of_week(fecha) for fecha in fechas}
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            for lunes in lunes_set:
+                if self._data.pop((user_id, lunes), None) is not None:
+                    self.invalidations += 1
+    
+    def invalidate_user(self, user_id: int) -> None:
+        """Invalida todas las semanas de un usuario (p.ej. al borrar un proyecto)"""
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            keys = [key for key in self._data if key[0] == user_id]
+            for key in keys:
+                del self._data[key]
+            self.invalidations += len(keys)
+    
+    def clear(self) -> None:
+        """Vacía la caché"""
+        with self._lock:
+            self._data.clear()
+            self._generations.clear()
+    
+    def stats(self) -> dict:
+        """Contadores para dimensionar la caché"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations
+            }
+
+
+# Instancias globales compartidas por las rutas REST y WebSocket
+week_cache = WeekCache()
+# {user_id: frozenset(project_id)}; se invalida al crear o borrar un proyecto
+project_ids_cache = TTLCache(max_size=PROJECT_CACHE_SIZE, ttl=PROJECT_CACHE_TTL_SECONDS)
@@ -1,11 +1,19 @@
 """
 Base de datos y modelos SQLAlchemy
 """
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date, DateTime, ForeignKey, CheckConstraint, UniqueConstraint
+from sqlalchemy import create_engine, Column, Integer, String, Float, Date, DateTime, ForeignKey, CheckConstraint, UniqueConstraint, Index
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from fastapi import Depends
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date
+from typing import Optional
+import asyncio
+import functools
+import inspect
 import os
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -21,6 +29,66 @@ engine = create_engine(
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Modo asíncrono: los endpoints se sirven como async def sobre un motor asíncrono
+# (aiosqlite en local, asyncpg en PostgreSQL) en lugar del threadpool de Starlette
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() in ("1", "true", "yes")
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+
+def to_async_url(url: str) -> str:
+    """
+    Traduce una URL de base de datos síncrona a su driver asíncrono
+    
+    Args:
+        url: URL síncrona (DATABASE_URL)
+        
+    Returns:
+        URL equivalente con driver asíncrono
+    """
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.get_backend_name(), parsed.drivername)
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+
+# Hilos para la base de datos fuera de las peticiones HTTP (WebSocket, buffer de
+# escritura) en modo síncrono: acotado y separado del threadpool de Starlette
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "4"))
+
+async_engine = None
+AsyncSessionLocal = None
+
+if DB_ASYNC:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    
+    # Fallar al arrancar con un mensaje claro, no en la primera petición
+    try:
+        import greenlet  # noqa: F401  (lo usa AsyncSession.run_sync)
+    except ImportError as e:
+        raise ImportError("DB_ASYNC=true requiere greenlet (pip install greenlet)") from e
+    
+    # SQLite: con muchas peticiones en vuelo los escritores esperan más el bloqueo
+    try:
+        async_engine = create_async_engine(
+            ASYNC_DATABASE_URL,
+            connect_args={"timeout": 30} if "sqlite" in ASYNC_DATABASE_URL else {}
+        )
+    except ImportError as e:
+        raise ImportError(
+            f"DB_ASYNC=true requiere el driver {make_url(ASYNC_DATABASE_URL).drivername} "
+            f"(pip install {e.name or 'el driver asíncrono'})"
+        ) from e
+    # Sin expirar al hacer commit: la respuesta se serializa fuera de la sesión
+    AsyncSessionLocal = async_sessionmaker(
+        async_engine, autoflush=False, expire_on_commit=False
+    )
+
 
 # ============================================================================
 # MODELOS
@@ -53,10 +121,12 @@ class Project(Base):
     # Relaciones
     user = relationship("User", back_populates="projects")
     imputaciones = relationship("Imputacion", back_populates="project", cascade="all, delete-orphan")
+    totales = relationship("ImputacionTotal", back_populates="project", cascade="all, delete-orphan")
     
     # Constraints
     __table_args__ = (
         UniqueConstraint('user_id', 'nombre', name='unique_user_project'),
+        Index('ix_projects_user_created', 'user_id', 'created_at'),
     )
 
 
@@ -72,6 +142,13 @@ class ChatMessage(Base):
     
     # Relación
     user = relationship("User", backref="chat_messages")
+    
+    # Índices
+    __table_args__ = (
+        Index('ix_chat_messages_user_created', 'user_id', 'created_at'),
+        # Paginación por cursor (before_id / after_id) del historial
+        Index('ix_chat_messages_user_id', 'user_id', 'id'),
+    )
 
 
 class Imputacion(Base):
@@ -94,9 +171,136 @@ class Imputacion(Base):
     __table_args__ = (
         UniqueConstraint('user_id', 'project_id', 'fecha', name='unique_user_project_fecha'),
         CheckConstraint('horas >= 0 AND horas <= 24', name='check_horas_range'),
+        Index('ix_imputaciones_user_fecha', 'user_id', 'fecha'),
+    )
+
+
+class ImputacionTotal(Base):
+    """
+    Total de horas por usuario, proyecto y periodo (semana o mes)
+    
+    Se mantiene de forma incremental en la misma transacción que cada
+    escritura de imputaciones. Se puede reconstruir con rebuild_totales.py
+    """
+    __tablename__ = "imputacion_totales"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    project_id = Column(Integer, ForeignKey("projects.id", ondelete="CASCADE"), nullable=False)
+    periodo = Column(String(6), nullable=False)  # 'semana' o 'mes'
+    inicio = Column(Date, nullable=False)  # Lunes de la semana o día 1 del mes
+    horas = Column(Float, default=0)
+    
+    # Relaciones
+    project = relationship("Project", back_populates="totales")
+    
+    # Constraints
+    __table_args__ = (
+        UniqueConstraint('user_id', 'project_id', 'periodo', 'inicio', name='unique_user_project_periodo'),
     )
 
 
+class UserDataVersion(Base):
+    """
+    Versión de los datos de un usuario (proyectos e imputaciones)
+    
+    Se incrementa en cada escritura y permite responder 304 a las lecturas
+    condicionales (ETag) sin consultar la tabla de imputaciones
+    """
+    __tablename__ = "user_data_versions"
+    
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class ChangeLogEntry(Base):
+    """
+    Cambio de los datos de un usuario con su número de secuencia
+    
+    El número de secuencia es la versión de datos (UserDataVersion) tras el
+    cambio. Se guardan los últimos CHANGE_LOG_SIZE por usuario para que un
+    WebSocket que se reconecta reciba solo lo que se perdió (ver
+    utils.get_changes_since). message es el mensaje WebSocket en JSON.
+    """
+    __tablename__ = "change_log"
+    
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    seq = Column(Integer, primary_key=True)
+    message = Column(String, nullable=False)  # JSON
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class RefreshToken(Base):
+    """
+    Refresh token (sesión) de un usuario
+    
+    El jti viaja como claim "sid" en los access tokens de la sesión; al
+    revocarlo se rechazan todos ellos (ver revocation.py)
+    """
+    __tablename__ = "refresh_tokens"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    jti = Column(String(32), unique=True, nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
+    revoked_at = Column(DateTime, nullable=True, index=True)
+
+
+class RateLimitBucket(Base):
+    """
+    Estado persistido de un token bucket del limitador (ver ratelimit.py)
+    
+    Se escribe en bloque cada RATE_LIMIT_PERSIST_SECONDS, nunca por petición
+    """
+    __tablename__ = "rate_limit_buckets"
+    
+    key = Column(String(120), primary_key=True)  # "politica:clave", p. ej. "user:5"
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)  # timestamp unix
+
+
+class BroadcastEvent(Base):
+    """
+    Mensaje WebSocket publicado en el bus compartido entre workers (ver broadcast.py)
+    
+    Solo sirve para la entrega en vivo: se borra pasados BROADCAST_RETENTION_SECONDS
+    """
+    __tablename__ = "broadcast_events"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    origin = Column(String(12), nullable=False)  # worker que lo publicó
+    user_id = Column(Integer, nullable=False)
+    payload = Column(String, nullable=False)  # JSON
+    created_at = Column(Float, nullable=False, index=True)  # timestamp unix
+    
+    # Sin AUTOINCREMENT, SQLite reutiliza los ids al vaciarse la tabla y los
+    # workers (que leen por encima del último id visto) dejarían de ver eventos
+    __table_args__ = {"sqlite_autoincrement": True}
+
+
+class AppSetting(Base):
+    """
+    Valor compartido por todos los workers y reinicios
+    
+    P. ej. el coste de bcrypt en uso (ver auth.calibrate_bcrypt_rounds)
+    """
+    __tablename__ = "app_settings"
+    
+    key = Column(String(60), primary_key=True)
+    value = Column(String, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class SchemaVersion(Base):
+    """Versión del esquema aplicada (una sola fila, ver migrations.py)"""
+    __tablename__ = "schema_version"
+    
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 # ============================================================================
 # FUNCIONES AUXILIARES
 # ============================================================================
@@ -110,10 +314,114 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    """Generador de sesión asíncrona de base de datos (modo DB_ASYNC)"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def db_handler(func):
+    """
+    Adapta un endpoint o dependencia síncrona al modo de base de datos configurado
+    
+    En modo síncrono devuelve la función tal cual (Starlette la ejecuta en su
+    threadpool). Con DB_ASYNC la convierte en async def: recibe una AsyncSession
+    y ejecuta el cuerpo con run_sync, de modo que la E/S de base de datos la hace
+    el driver asíncrono sin ocupar hilos. La lógica es la misma en ambos modos.
+    
+    Args:
+        func: Función con un parámetro db: Session = Depends(get_db)
+        
+    Returns:
+        La función original o su versión asíncrona
+    """
+    if not DB_ASYNC:
+        return func
+    
+    signature = inspect.signature(func)
+    parameters = [
+        param.replace(default=Depends(get_async_db)) if param.name == "db" else param
+        for param in signature.parameters.values()
+    ]
+    
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        db = kwargs.pop("db")
+        return await db.run_sync(lambda session: func(*args, db=session, **kwargs))
+    
+    wrapper.__signature__ = signature.replace(parameters=parameters)
+    return wrapper
+
+
+_db_executor: Optional[ThreadPoolExecutor] = None
+_db_executor_lock = threading.Lock()
+
+
+def _get_db_executor() -> ThreadPoolExecutor:
+    """Crea el executor de base de datos la primera vez que se usa"""
+    global _db_executor
+    with _db_executor_lock:
+        if _db_executor is None:
+            _db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+        return _db_executor
+
+
+def shutdown_db_executor():
+    """Cierra el executor de base de datos (al parar el servidor)"""
+    global _db_executor
+    with _db_executor_lock:
+        if _db_executor is not None:
+            _db_executor.shutdown(wait=True)
+            _db_executor = None
+
+
+def _call_with_session(func, *args, **kwargs):
+    db = SessionLocal()
+    try:
+        return func(db, *args, **kwargs)
+    finally:
+        db.close()
+
+
+async def run_with_session(func, *args, **kwargs):
+    """
+    Ejecuta func(session, *args, **kwargs) con una sesión nueva sin bloquear el event loop
+    
+    Para código async fuera de las peticiones HTTP (p. ej. cada mensaje de un
+    WebSocket): la sesión vive solo lo que dura la llamada. Con DB_ASYNC se
+    usa una AsyncSession y run_sync; en modo síncrono, una sesión normal en
+    el executor de base de datos (DB_EXECUTOR_WORKERS hilos).
+    
+    Args:
+        func: Función síncrona que recibe la sesión como primer argumento
+        
+    Returns:
+        Lo que devuelva func
+    """
+    if DB_ASYNC:
+        async with AsyncSessionLocal() as db:
+            return await db.run_sync(func, *args, **kwargs)
+    
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_db_executor(), functools.partial(_call_with_session, func, *args, **kwargs)
+    )
+
+
 def init_db():
-    """Inicializa la base de datos creando todas las tablas"""
-    Base.metadata.create_all(bind=engine)
-    print("[DB] ✅ Base de datos inicializada correctamente")
+    """
+    Inicializa la base de datos aplicando las migraciones pendientes
+    
+    Si el esquema ya está en la última versión no se hace ningún trabajo
+    de esquema (ni create_all)
+    """
+    from migrations import run_migrations
+    
+    applied = run_migrations(engine)
+    if applied:
+        print(f"[DB] ✅ Base de datos inicializada correctamente ({len(applied)} migraciones aplicadas)")
+    else:
+        print("[DB] ✅ Base de datos al día")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,49 @@
+"""
+Script para importar imputaciones históricas desde un CSV (project, fecha, horas)
+
+Uso:
+    python import_imputaciones.py <email> <fichero.csv>
+"""
+import sys
+from pathlib import Path
+
+# Añadir el directorio del backend al path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from database import SessionLocal, User, init_db
+from importer import ImputacionImporter
+
+
+def main():
+    """Importa el CSV para el usuario indicado"""
+    if len(sys.argv) != 3:
+        print("Uso: python import_imputaciones.py <email> <fichero.csv>")
+        sys.exit(1)
+    
+    email, path = sys.argv[1].lower(), sys.argv[2]
+    init_db()
+    
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.email == email).first()
+        if not user:
+            print(f"❌ Usuario no encontrado: {email}")
+            sys.exit(1)
+        
+        print(f"📥 Importando {path} para {email}...")
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            report = ImputacionImporter(db, user.id).run(f)
+        
+        print(f"✅ Procesadas: {report['procesadas']} | Importadas: {report['importadas']} | Rechazadas: {report['rechazadas']}")
+        if report["proyectos_creados"]:
+            print(f"📋 Proyectos creados: {', '.join(report['proyectos_creados'])}")
+        for error in report["errores"]:
+            print(f"   ⚠️ Línea {error['linea']}: {error['error']}")
+        if report["errores_truncados"]:
+            print("   ... (errores truncados)")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
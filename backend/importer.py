@@ -0,0 +1,190 @@
+"""
+Importación masiva de imputaciones históricas desde CSV
+"""
+import csv
+from datetime import date
+from typing import Iterable, Optional
+
+from sqlalchemy.orm import Session
+
+from cache import week_cache
+from database import Imputacion, Project
+from utils import (
+    is_weekend, validate_hours, upsert_imputaciones, apply_totales_delta, bump_data_version, lock_user_data
+)
+
+# Filas validadas y escritas por transacción
+IMPORT_CHUNK_SIZE = 5000
+
+# Máximo de errores detallados en el informe (el total se cuenta siempre)
+MAX_REPORTED_ERRORS = 1000
+
+# Máximo de proyectos por usuario (ver validate_project_limit)
+MAX_PROJECTS = 3
+
+
+class ImportReport:
+    """Informe de una importación: contadores y filas rechazadas"""
+    
+    def __init__(self):
+        self.procesadas = 0
+        self.importadas = 0
+        self.rechazadas = 0
+        self.proyectos_creados: list[str] = []
+        self.errores: list[dict] = []
+    
+    def reject(self, linea: int, error: str):
+        self.rechazadas += 1
+        if len(self.errores) < MAX_REPORTED_ERRORS:
+            self.errores.append({"linea": linea, "error": error})
+    
+    def to_dict(self) -> dict:
+        return {
+            "procesadas": self.procesadas,
+            "importadas": self.importadas,
+            "rechazadas": self.rechazadas,
+            "proyectos_creados": self.proyectos_creados,
+            "errores": self.errores,
+            "errores_truncados": self.rechazadas > len(self.errores)
+        }
+
+
+class ImputacionImporter:
+    """
+    Importa filas (project, fecha, horas) de un usuario por bloques
+    
+    Cada bloque se valida de una vez (fin de semana, rango de horas,
+    existencia de proyecto y límite de 3 proyectos) y se escribe con un
+    upsert en una sola transacción. Las filas inválidas van al informe.
+    """
+    
+    def __init__(self, db: Session, user_id: int, create_projects: bool = True,
+                 chunk_size: int = IMPORT_CHUNK_SIZE):
+        self.db = db
+        self.user_id = user_id
+        self.create_projects = create_projects
+        self.chunk_size = chunk_size
+        self.report = ImportReport()
+        
+        # Proyectos del usuario por nombre (se resuelven una sola vez)
+        self.projects = {
+            nombre: project_id
+            for project_id, nombre in db.query(Project.id, Project.nombre).filter(Project.user_id == user_id)
+        }
+    
+    def _resolve_project(self, nombre: str) -> tuple[Optional[int], Optional[str]]:
+        """Devuelve (project_id, error) creando el proyecto si está permitido"""
+        project_id = self.projects.get(nombre)
+        if project_id is not None:
+            return project_id, None
+        
+        if not self.create_projects:
+            return None, f"Proyecto no encontrado: {nombre}"
+        
+        if len(self.projects) >= MAX_PROJECTS:
+            return None, f"Máximo {MAX_PROJECTS} proyectos permitidos (no se puede crear '{nombre}')"
+        
+        if not nombre or len(nombre) > 100:
+            return None, "Nombre de proyecto inválido"
+        
+        project = Project(user_id=self.user_id, nombre=nombre)
+        self.db.add(project)
+        self.db.flush()
+        self.projects[nombre] = project.id
+        self.report.proyectos_creados.append(nombre)
+        return project.id, None
+    
+    def _write_chunk(self, chunk: list[tuple[int, dict]]):
+        """Valida y escribe un bloque de filas (linea, row) en una transacción"""
+        rows: dict[tuple, dict] = {}
+        creados = len(self.report.proyectos_creados)
+        
+        for linea, row in chunk:
+            nombre = (row.get("project") or row.get("proyecto") or "").strip()
+            try:
+                fecha = date.fromisoformat((row.get("fecha") or "").strip())
+                horas = float((row.get("horas") or "").strip().replace(",", "."))
+            except ValueError:
+                self.report.reject(linea, "Fecha u horas con formato inválido")
+                continue
+            
+            if is_weekend(fecha):
+                self.report.reject(linea, "No se puede imputar en sábado o domingo")
+                continue
+            
+            if not validate_hours(horas):
+                self.report.reject(linea, "Las horas deben estar entre 0 y 24")
+                continue
+            
+            project_id, error = self._resolve_project(nombre)
+            if error:
+                self.report.reject(linea, error)
+                continue
+            
+            # Si una celda se repite en el bloque gana la última fila
+            rows[(project_id, fecha)] = {
+                "user_id": self.user_id,
+                "project_id": project_id,
+                "fecha": fecha,
+                "horas": horas
+            }
+        
+        if not rows:
+            if len(self.report.proyectos_creados) > creados:
+                bump_data_version(self.db, self.user_id)
+            self.db.commit()
+            return
+        
+        fechas = [fecha for _, fecha in rows]
+        lock_user_data(self.db, self.user_id)
+        anteriores = {
+            (project_id, fecha): horas
+            for project_id, fecha, horas in self.db.query(
+                Imputacion.project_id, Imputacion.fecha, Imputacion.horas
+            ).filter(
+                Imputacion.user_id == self.user_id,
+                Imputacion.project_id.in_({key[0] for key in rows}),
+                Imputacion.fecha.between(min(fechas), max(fechas))
+            ).with_for_update()
+        }
+        
+        upsert_imputaciones(self.db, list(rows.values()))
+        apply_totales_delta(self.db, self.user_id, [
+            (project_id, fecha, row["horas"] - anteriores.get((project_id, fecha), 0))
+            for (project_id, fecha), row in rows.items()
+        ])
+        bump_data_version(self.db, self.user_id)
+        self.db.commit()
+        
+        week_cache.invalidate(self.user_id, fechas)
+        self.report.importadas += len(rows)
+    
+    def run(self, lines: Iterable[str]) -> dict:
+        """
+        Importa un CSV con cabecera project (o proyecto), fecha y horas
+        
+        Args:
+            lines: Líneas del CSV (fichero abierto, generador, etc.)
+            
+        Returns:
+            Informe de la importación
+        """
+        reader = csv.DictReader(lines)
+        
+        if not reader.fieldnames or "fecha" not in reader.fieldnames or "horas" not in reader.fieldnames \
+                or not ({"project", "proyecto"} & set(reader.fieldnames)):
+            self.report.reject(1, "Cabecera inválida: se esperan las columnas project, fecha y horas")
+            return self.report.to_dict()
+        
+        chunk = []
+        for row in reader:
+            self.report.procesadas += 1
+            chunk.append((reader.line_num, row))
+            if len(chunk) >= self.chunk_size:
+                self._write_chunk(chunk)
+                chunk = []
+        
+        if chunk:
+            self._write_chunk(chunk)
+        
+        return self.report.to_dict()
@@ -1,6 +1,8 @@
 """
 Servidor principal FastAPI
 """
+import asyncio
+import os
 import sys
 from pathlib import Path
 
@@ -13,12 +15,19 @@ import uvicorn
 
 # Imports de módulos locales
 try:
-    from database import init_db
-    from routes.auth_routes import router as auth_router
+    from database import init_db, async_engine, shutdown_db_executor
+    from auth import shutdown_password_pool, calibrate_bcrypt_rounds, get_bcrypt_calibration
+    from revocation import revocation_list
+    from ratelimit import RateLimitMiddleware, rate_limiter
+    from broadcast import broadcast_bus
+    from writebehind import write_buffer
+    from cache import week_cache, project_ids_cache
+    from routes.auth_routes import router as auth_router, token_cache, user_exists_cache
     from routes.project_routes import router as project_router
     from routes.imputacion_routes import router as imputacion_router
-    from routes.websocket_routes import router as websocket_router
+    from routes.websocket_routes import router as websocket_router, deliver_to_user, broadcast_to_user, connection_registry
     from routes.chat_routes import router as chat_router
+    from routes.analytics_routes import router as analytics_router
 except ImportError as e:
     print(f"❌ Error importando módulos: {e}")
     print("Verifica que todas las dependencias estén instaladas")
@@ -35,9 +44,12 @@ app = FastAPI(
 )
 
 # ============================================================================
-# CONFIGURAR CORS
+# LIMITADOR DE PETICIONES Y CORS
 # ============================================================================
 
+# Se añade antes que CORS para que las respuestas 429 lleven también cabeceras CORS
+app.add_middleware(RateLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -62,6 +74,7 @@ app.include_router(project_router)
 app.include_router(imputacion_router)
 app.include_router(websocket_router)
 app.include_router(chat_router)
+app.include_router(analytics_router)
 
 # ============================================================================
 # EVENTOS
@@ -72,6 +85,14 @@ async def startup_event():
     """Inicializa la base de datos al arrancar"""
     try:
         init_db()
+        calibrate_bcrypt_rounds()
+        revocation_list.load()
+        app.state.revocation_task = asyncio.create_task(revocation_list.run_sync())
+        rate_limiter.load()
+        app.state.rate_limit_task = asyncio.create_task(rate_limiter.run_persistence())
+        await broadcast_bus.start(deliver_to_user)
+        await write_buffer.start(broadcast_to_user)
+        await connection_registry.start()
         print("\n" + "="*70)
         print("🚀 DEMO GESTIÓN DE HORAS - SERVIDOR INICIADO")
         print("="*70)
@@ -85,6 +106,25 @@ async def startup_event():
         import traceback
         traceback.print_exc()
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Para las tareas de fondo, guarda el limitador, vuelca el buffer de escritura, para los latidos y el bus de difusión y libera los pools y el motor asíncrono"""
+    for name in ("rate_limit_task", "revocation_task"):
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+    try:
+        rate_limiter.persist()
+    except Exception as e:
+        print(f"[RATELIMIT] ❌ Error guardando buckets: {e}")
+    await connection_registry.stop()
+    await write_buffer.stop()
+    shutdown_db_executor()
+    await broadcast_bus.stop()
+    shutdown_password_pool()
+    if async_engine is not None:
+        await async_engine.dispose()
+
 # ============================================================================
 # ENDPOINTS BÁSICOS
 # ============================================================================
@@ -100,6 +140,7 @@ async def root():
             "auth": "/api/auth",
             "projects": "/api/projects",
             "imputaciones": "/api/imputaciones",
+            "analytics": "/api/analytics",
             "websocket": "/ws/{token}"
         },
         "docs": "/docs"
@@ -111,7 +152,19 @@ async def health_check():
     return {
         "status": "ok",
         "cors": "enabled",
-        "database": "sqlite"
+        "database": "sqlite",
+        "week_cache": week_cache.stats(),
+        "project_cache": project_ids_cache.stats(),
+        "bcrypt": get_bcrypt_calibration(),
+        "auth_cache": {
+            "tokens": token_cache.stats(),
+            "users": user_exists_cache.stats(),
+            "revocations": revocation_list.stats()
+        },
+        "rate_limit": rate_limiter.stats(),
+        "broadcast": broadcast_bus.stats(),
+        "write_behind": write_buffer.stats(),
+        "websocket": connection_registry.stats()
     }
 
 # ============================================================================
@@ -125,5 +178,7 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8003,
         reload=True,
-        log_level="info"
+        log_level="info",
+        # Compresión permessage-deflate de los mensajes WebSocket (la negocia el navegador)
+        ws_per_message_deflate=os.getenv("WS_PER_MESSAGE_DEFLATE", "true").lower() == "true"
     )
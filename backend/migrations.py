@@ -0,0 +1,184 @@
+"""
+Migraciones de esquema versionadas e idempotentes
+
+Cada migración tiene un número de versión creciente. La versión aplicada se
+guarda en la tabla schema_version; al arrancar solo se ejecutan las
+migraciones pendientes y, si el esquema está al día, no se toca nada.
+
+Para añadir una migración basta con añadir una entrada al final de MIGRATIONS.
+Las tablas nuevas las crea create_all (se ejecuta siempre que haya
+migraciones pendientes); las migraciones se encargan de lo que create_all no
+hace sobre tablas existentes: índices y columnas nuevas.
+"""
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+
+from database import Base, SchemaVersion, BroadcastEvent
+
+
+# ============================================================================
+# HELPERS
+# ============================================================================
+
+def create_index(conn: Connection, name: str, table: str, columns: List[str], unique: bool = False):
+    """
+    Crea un índice si no existe, sin bloquear escrituras cuando el motor lo permite
+    
+    En PostgreSQL usa CREATE INDEX CONCURRENTLY (requiere conexión en
+    autocommit, ver run_migrations). En SQLite la creación es rápida y
+    IF NOT EXISTS la hace idempotente.
+    
+    Args:
+        conn: Conexión en autocommit
+        name: Nombre del índice
+        table: Tabla
+        columns: Columnas del índice
+        unique: Índice único
+    """
+    cols = ", ".join(columns)
+    unique_sql = "UNIQUE " if unique else ""
+    
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(f"CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({cols})"))
+    elif conn.dialect.name == "mysql":
+        existing = {index["name"] for index in inspect(conn).get_indexes(table)}
+        if name not in existing:
+            conn.execute(text(f"CREATE {unique_sql}INDEX {name} ON {table} ({cols})"))
+    else:
+        conn.execute(text(f"CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({cols})"))
+
+
+def add_column(conn: Connection, table: str, column: str, ddl: str):
+    """
+    Añade una columna si no existe
+    
+    Args:
+        conn: Conexión
+        table: Tabla
+        column: Nombre de la columna
+        ddl: Tipo y opciones SQL (p.ej. "INTEGER NOT NULL DEFAULT 0")
+    """
+    existing = {col["name"] for col in inspect(conn).get_columns(table)}
+    if column not in existing:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+# ============================================================================
+# MIGRACIONES
+# ============================================================================
+
+def _new_tables(conn: Connection):
+    """Solo tablas nuevas: las crea create_all antes de aplicar migraciones"""
+
+
+def _hot_path_indexes(conn: Connection):
+    """Índices compuestos para las consultas más frecuentes"""
+    # Rango de fechas de un usuario (semana, rango, exportación)
+    create_index(conn, "ix_imputaciones_user_fecha", "imputaciones", ["user_id", "fecha"])
+    # Historial de chat de un usuario ordenado por fecha
+    create_index(conn, "ix_chat_messages_user_created", "chat_messages", ["user_id", "created_at"])
+    # Proyectos de un usuario ordenados por creación
+    create_index(conn, "ix_projects_user_created", "projects", ["user_id", "created_at"])
+
+
+def _chat_keyset_index(conn: Connection):
+    """Índice para paginar el historial de chat por id (before_id / after_id)"""
+    create_index(conn, "ix_chat_messages_user_id", "chat_messages", ["user_id", "id"])
+
+
+def _broadcast_events_autoincrement(conn: Connection):
+    """
+    Recrea broadcast_events con AUTOINCREMENT en SQLite
+    
+    SQLite no permite cambiarlo con ALTER TABLE; la tabla solo guarda eventos
+    de los últimos segundos, así que se puede borrar y crear de nuevo.
+    """
+    if conn.dialect.name != "sqlite":
+        return
+    table = BroadcastEvent.__table__
+    table.drop(conn, checkfirst=True)
+    table.create(conn)
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "Esquema inicial", _new_tables),
+    (2, "Índices compuestos de imputaciones, chat y proyectos", _hot_path_indexes),
+    (3, "Tabla refresh_tokens (creada por create_all)", _new_tables),
+    (4, "Tabla rate_limit_buckets (creada por create_all)", _new_tables),
+    (5, "Tabla broadcast_events (creada por create_all)", _new_tables),
+    (6, "Tabla change_log (creada por create_all)", _new_tables),
+    (7, "Índice (user_id, id) del historial de chat", _chat_keyset_index),
+    (8, "broadcast_events con AUTOINCREMENT en SQLite", _broadcast_events_autoincrement),
+    (9, "Tabla app_settings (creada por create_all)", _new_tables),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# ============================================================================
+# EJECUCIÓN
+# ============================================================================
+
+def get_schema_version(engine: Engine) -> int:
+    """
+    Obtiene la versión de esquema aplicada (0 si la BD no está versionada)
+    """
+    with engine.connect() as conn:
+        if not inspect(conn).has_table(SchemaVersion.__tablename__):
+            return 0
+        version = conn.execute(text(f"SELECT version FROM {SchemaVersion.__tablename__} WHERE id = 1")).scalar()
+        return version or 0
+
+
+def _set_schema_version(engine: Engine, version: int):
+    """Guarda la versión de esquema aplicada"""
+    table = SchemaVersion.__table__
+    with engine.begin() as conn:
+        updated = conn.execute(table.update().where(table.c.id == 1).values(version=version)).rowcount
+        if not updated:
+            try:
+                conn.execute(table.insert().values(id=1, version=version))
+            except IntegrityError:
+                # Otro worker la insertó a la vez
+                conn.execute(table.update().where(table.c.id == 1).values(version=version))
+
+
+def run_migrations(engine: Engine) -> List[int]:
+    """
+    Aplica las migraciones pendientes
+    
+    Args:
+        engine: Engine de SQLAlchemy
+        
+    Returns:
+        Versiones aplicadas (vacía si el esquema ya estaba al día)
+    """
+    current = get_schema_version(engine)
+    if current >= LATEST_VERSION:
+        return []
+    
+    # Tablas nuevas (incluida schema_version)
+    Base.metadata.create_all(bind=engine)
+    
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        
+        print(f"[DB] 🔄 Migración {version}: {description}")
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            migrate(conn)
+        _set_schema_version(engine, version)
+        applied.append(version)
+    
+    return applied
+
+
+if __name__ == "__main__":
+    from database import engine
+    
+    applied = run_migrations(engine)
+    print(f"✅ Esquema en versión {LATEST_VERSION} ({len(applied)} migraciones aplicadas)")
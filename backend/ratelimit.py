@@ -0,0 +1,372 @@
+"""
+Limitador de peticiones con token buckets por usuario e IP
+
+Cada clave (p. ej. "user:5" o "ip:1.2.3.4") tiene un bucket con capacidad
+`limit` que se rellena a razón de limit/window tokens por segundo. El estado
+vive en memoria como una tupla (tokens, actualizado) por clave y solo se
+guardan los buckets que no están llenos: un bucket lleno equivale a no tenerlo.
+La persistencia es periódica (RATE_LIMIT_PERSIST_SECONDS) y en bloque, de modo
+que un cliente abusivo no genera escrituras en la BD por cada petición.
+
+Las respuestas llevan las cabeceras RateLimit-Limit, RateLimit-Remaining,
+RateLimit-Reset y RateLimit-Policy del bucket más restrictivo, y Retry-After
+cuando se rechaza con 429.
+"""
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+RATE_LIMIT_PERSIST_SECONDS = float(os.getenv("RATE_LIMIT_PERSIST_SECONDS", "30"))
+# Detrás de un proxy inverso: tomar la IP del cliente de X-Forwarded-For
+RATE_LIMIT_TRUST_PROXY = os.getenv(
+    "RATE_LIMIT_TRUST_PROXY", "false"
+).lower() in ("1", "true", "yes")
+
+# Rutas que no se limitan
+RATE_LIMIT_EXEMPT_PATHS = {"/", "/health", "/docs", "/redoc", "/openapi.json"}
+AUTH_PATHS = {"/api/auth/login", "/api/auth/register", "/api/auth/refresh"}
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+class RateLimitPolicy:
+    """
+    Política "limit/window": hasta `limit` peticiones de golpe y `limit` por
+    `window` segundos sostenidas
+    """
+    
+    def __init__(self, name: str, spec: str):
+        limit, window = spec.split("/")
+        self.name = name
+        self.limit = int(limit)
+        self.window = float(window)
+        self.rate = self.limit / self.window
+    
+    @property
+    def header(self) -> str:
+        return f"{self.limit};w={int(self.window)}"
+
+
+class RateLimitResult(NamedTuple):
+    """Resultado de consumir de uno o varios buckets"""
+    allowed: bool
+    policy: RateLimitPolicy
+    remaining: int
+    reset: int
+    retry_after: int
+
+
+# Peticiones por IP (todas), por usuario autenticado (todas) y por usuario en
+# escrituras: las "interacciones" (crear/borrar proyectos, imputar horas...)
+POLICY_IP = RateLimitPolicy("ip", os.getenv("RATE_LIMIT_IP", "300/60"))
+POLICY_USER = RateLimitPolicy("user", os.getenv("RATE_LIMIT_USER", "120/60"))
+POLICY_INTERACTIONS = RateLimitPolicy("interacciones", os.getenv("RATE_LIMIT_INTERACTIONS", "60/60"))
+# Login/registro/refresh por IP: frena la fuerza bruta y las ráfagas de bcrypt
+POLICY_AUTH = RateLimitPolicy("auth", os.getenv("RATE_LIMIT_AUTH", "20/60"))
+
+POLICIES = {
+    policy.name: policy
+    for policy in (POLICY_IP, POLICY_USER, POLICY_INTERACTIONS, POLICY_AUTH)
+}
+
+
+class RateLimiter:
+    """Conjunto de token buckets en memoria con persistencia periódica"""
+    
+    def __init__(self, enabled: bool = RATE_LIMIT_ENABLED,
+                 persist_interval: float = RATE_LIMIT_PERSIST_SECONDS):
+        self.enabled = enabled
+        self.persist_interval = persist_interval
+        # "politica:clave" -> (tokens, timestamp de la última actualización)
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._dirty: set[str] = set()
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.persists = 0
+    
+    @staticmethod
+    def _tokens(policy: RateLimitPolicy, state: Optional[tuple[float, float]], now: float) -> float:
+        """Tokens disponibles ahora tras rellenar desde la última actualización"""
+        if state is None:
+            return float(policy.limit)
+        tokens, updated = state
+        return min(float(policy.limit), tokens + (now - updated) * policy.rate)
+    
+    def hit(self, checks: list[tuple[RateLimitPolicy, str]],
+            cost: int = 1) -> Optional[RateLimitResult]:
+        """
+        Consume `cost` tokens de todos los buckets indicados, o de ninguno
+        
+        Args:
+            checks: Pares (política, clave) a comprobar
+            cost: Tokens a consumir de cada bucket
+            
+        Returns:
+            Resultado del bucket rechazado o, si se admite, del más restrictivo
+            (None si el limitador está desactivado o no hay comprobaciones)
+        """
+        if not self.enabled or not checks:
+            return None
+        
+        now = time.time()
+        with self._lock:
+            available = []
+            for policy, key in checks:
+                bucket_key = f"{policy.name}:{key}"
+                tokens = self._tokens(policy, self._buckets.get(bucket_key), now)
+                available.append((policy, bucket_key, tokens))
+            
+            denied = next(((p, k, t) for p, k, t in available if t < cost), None)
+            if denied is not None:
+                self.rejected += 1
+                policy, _, tokens = denied
+                retry_after = math.ceil((cost - tokens) / policy.rate)
+                reset = math.ceil((policy.limit - tokens) / policy.rate)
+                return RateLimitResult(False, policy, 0, reset, retry_after)
+            
+            for policy, bucket_key, tokens in available:
+                self._buckets[bucket_key] = (tokens - cost, now)
+                self._dirty.add(bucket_key)
+        
+        # El más restrictivo es el que tiene menos tokens restantes
+        policy, _, tokens = min(available, key=lambda item: item[2])
+        tokens -= cost
+        reset = math.ceil((policy.limit - tokens) / policy.rate)
+        return RateLimitResult(True, policy, int(tokens), reset, 0)
+    
+    def remaining(self, policy: RateLimitPolicy, key: str) -> int:
+        """Tokens que quedan en un bucket sin consumir ninguno"""
+        with self._lock:
+            return int(self._tokens(policy, self._buckets.get(f"{policy.name}:{key}"), time.time()))
+    
+    def load(self, db=None):
+        """Carga los buckets persistidos (al arrancar)"""
+        from database import SessionLocal, RateLimitBucket
+        
+        own_session = db is None
+        db = db or SessionLocal()
+        try:
+            rows = db.query(
+                RateLimitBucket.key, RateLimitBucket.tokens, RateLimitBucket.updated_at
+            ).all()
+        finally:
+            if own_session:
+                db.close()
+        
+        with self._lock:
+            for key, tokens, updated_at in rows:
+                self._buckets[key] = (tokens, updated_at)
+        print(f"[RATELIMIT] 📥 {len(rows)} buckets cargados")
+    
+    def persist(self, db=None) -> int:
+        """
+        Guarda en bloque los buckets modificados desde la última vez
+        
+        Los buckets que ya se han rellenado del todo se borran de memoria y de
+        la BD, así que solo se conserva el estado de los clientes activos.
+        
+        Returns:
+            Número de buckets escritos o borrados
+        """
+        from database import SessionLocal, RateLimitBucket
+        from utils import upsert_rate_limit_buckets
+        
+        now = time.time()
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            rows, full = [], []
+            for bucket_key in dirty:
+                state = self._buckets.get(bucket_key)
+                if state is None:
+                    continue
+                policy = POLICIES[bucket_key.split(":", 1)[0]]
+                tokens = self._tokens(policy, state, now)
+                if tokens < policy.limit:
+                    rows.append({"key": bucket_key, "tokens": tokens, "updated_at": now})
+            # Podar los buckets llenos (modificados o cargados al arrancar)
+            for bucket_key, state in list(self._buckets.items()):
+                policy = POLICIES[bucket_key.split(":", 1)[0]]
+                if self._tokens(policy, state, now) >= policy.limit:
+                    del self._buckets[bucket_key]
+                    full.append(bucket_key)
+        
+        if not rows and not full:
+            return 0
+        
+        own_session = db is None
+        db = db or SessionLocal()
+        try:
+            upsert_rate_limit_buckets(db, rows)
+            if full:
+                db.query(RateLimitBucket).filter(
+                    RateLimitBucket.key.in_(full)
+                ).delete(synchronize_session=False)
+            db.commit()
+        except Exception:
+            db.rollback()
+            # Reintentar en la próxima pasada
+            with self._lock:
+                self._dirty.update(dirty)
+            raise
+        finally:
+            if own_session:
+                db.close()
+        
+        self.persists += 1
+        return len(rows) + len(full)
+    
+    async def run_persistence(self):
+        """Tarea de fondo: persiste cada persist_interval segundos fuera del event loop"""
+        from fastapi.concurrency import run_in_threadpool
+        
+        while True:
+            await asyncio.sleep(self.persist_interval)
+            try:
+                await run_in_threadpool(self.persist)
+            except Exception as e:
+                print(f"[RATELIMIT] ❌ Error guardando buckets: {e}")
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "buckets": len(self._buckets),
+                "dirty": len(self._dirty),
+                "rejected": self.rejected,
+                "persists": self.persists
+            }
+
+
+# Instancia global compartida
+rate_limiter = RateLimiter()
+
+
+# ============================================================================
+# MIDDLEWARE
+# ============================================================================
+
+def rate_limit_headers(result: RateLimitResult) -> list[tuple[bytes, bytes]]:
+    """Cabeceras RateLimit-* (y Retry-After si se ha rechazado)"""
+    headers = [
+        (b"ratelimit-limit", str(result.policy.limit).encode()),
+        (b"ratelimit-remaining", str(result.remaining).encode()),
+        (b"ratelimit-reset", str(result.reset).encode()),
+        (b"ratelimit-policy", result.policy.header.encode()),
+    ]
+    if not result.allowed:
+        headers.append((b"retry-after", str(result.retry_after).encode()))
+    return headers
+
+
+def client_ip(scope) -> str:
+    """IP del cliente (de X-Forwarded-For solo si RATE_LIMIT_TRUST_PROXY)"""
+    if RATE_LIMIT_TRUST_PROXY:
+        for name, value in scope.get("headers", []):
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "desconocida"
+
+
+def user_id_from_scope(scope) -> Optional[int]:
+    """
+    user_id del access token (cabecera Authorization o token de la URL del WebSocket)
+    
+    Usa la misma caché de tokens que get_current_user: en el caso habitual no
+    se decodifica el JWT, y un token revocado o inválido no cuenta para
+    ningún usuario (solo para su IP).
+    """
+    from routes.auth_routes import get_cached_user
+    
+    token = None
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            value = value.decode("latin-1")
+            if value.startswith("Bearer "):
+                token = value[7:]
+            break
+    if token is None and scope["type"] == "websocket":
+        token = scope["path"].rsplit("/", 1)[-1]
+    if not token:
+        return None
+    
+    user_data = get_cached_user(token)
+    return user_data["user_id"] if user_data else None
+
+
+def request_checks(scope) -> list[tuple[RateLimitPolicy, str]]:
+    """Buckets que consume una petición HTTP o una apertura de WebSocket"""
+    ip = client_ip(scope)
+    checks = [(POLICY_IP, ip)]
+    
+    path = scope["path"]
+    if path in AUTH_PATHS:
+        checks.append((POLICY_AUTH, ip))
+        return checks
+    
+    user_id = user_id_from_scope(scope)
+    if user_id is not None:
+        checks.append((POLICY_USER, str(user_id)))
+        if scope["type"] == "http" and scope["method"] in WRITE_METHODS:
+            checks.append((POLICY_INTERACTIONS, str(user_id)))
+    return checks
+
+
+class RateLimitMiddleware:
+    """Middleware ASGI que aplica los token buckets a REST y a la apertura de WebSockets"""
+    
+    def __init__(self, app, limiter: RateLimiter = rate_limiter):
+        self.app = app
+        self.limiter = limiter
+    
+    async def __call__(self, scope, receive, send):
+        if (
+            not self.limiter.enabled
+            or scope["type"] not in ("http", "websocket")
+            or scope["path"] in RATE_LIMIT_EXEMPT_PATHS
+            or scope.get("method") == "OPTIONS"
+        ):
+            await self.app(scope, receive, send)
+            return
+        
+        result = self.limiter.hit(request_checks(scope))
+        
+        if not result.allowed:
+            if scope["type"] == "websocket":
+                await send({"type": "websocket.close", "code": 1008})
+                return
+            body = json.dumps({
+                "detail": "Demasiadas peticiones, inténtalo más tarde",
+                "retry_after": result.retry_after
+            }).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    *rate_limit_headers(result)
+                ]
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+        
+        if scope["type"] == "websocket":
+            await self.app(scope, receive, send)
+            return
+        
+        headers = rate_limit_headers(result)
+        
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), *headers]
+            await send(message)
+        
+        await self.app(scope, receive, send_with_headers)
@@ -0,0 +1,39 @@
+"""
+Script para reconstruir la tabla de totales semanales/mensuales (imputacion_totales)
+
+Uso:
+    python rebuild_totales.py            # Todos los usuarios
+    python rebuild_totales.py <user_id>  # Solo un usuario
+"""
+import sys
+from pathlib import Path
+
+# Añadir el directorio del backend al path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from database import SessionLocal, init_db
+from utils import rebuild_totales
+
+
+def main():
+    """Reconstruye los totales desde las imputaciones"""
+    user_id = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    
+    print("🔄 Reconstruyendo totales...")
+    init_db()
+    
+    db = SessionLocal()
+    try:
+        count = rebuild_totales(db, user_id)
+        print(f"✅ {count} totales generados")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Error reconstruyendo totales: {e}")
+        import traceback
+        traceback.print_exc()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
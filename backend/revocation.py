@@ -0,0 +1,107 @@
+"""
+Lista en memoria de sesiones revocadas (jti de refresh tokens)
+
+Los access tokens se verifican sin consultar la BD; solo hay que comprobar
+que su sesión (claim "sid" = jti del refresh token) no esté revocada. La
+lista se carga al arrancar y una tarea de fondo la sincroniza de forma
+incremental (filas con revoked_at posterior a la última vista) cada
+REVOCATION_SYNC_SECONDS fuera del event loop, así que la comprobación por
+petición es un lookup en un dict que nunca consulta la BD. Las entradas se
+descartan cuando ya no puede existir ningún access token válido de esa
+sesión, con lo que la lista se mantiene pequeña.
+"""
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+REVOCATION_SYNC_SECONDS = float(os.getenv("REVOCATION_SYNC_SECONDS", "5"))
+
+
+class RevocationList:
+    """Conjunto exacto de jti revocados con caducidad y sincronización incremental"""
+    
+    def __init__(self, sync_interval: float = REVOCATION_SYNC_SECONDS):
+        self.sync_interval = sync_interval
+        # jti -> instante (timestamp) a partir del cual ya no hace falta recordarlo
+        self._revoked: dict[str, float] = {}
+        self._last_revoked_at: Optional[datetime] = None
+        self._lock = threading.Lock()
+        self.syncs = 0
+    
+    @staticmethod
+    def _forget_at(expires_at: datetime) -> float:
+        """Un jti revocado deja de importar cuando caducan sus access tokens"""
+        from auth import ACCESS_TOKEN_EXPIRE_MINUTES
+        return (expires_at + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)).timestamp()
+    
+    def add(self, jti: str, expires_at: datetime):
+        """Marca un jti como revocado en este proceso"""
+        with self._lock:
+            self._revoked[jti] = self._forget_at(expires_at)
+    
+    def load(self, db=None):
+        """Carga completa (al arrancar) de las sesiones revocadas no caducadas"""
+        self._sync(db, full=True)
+    
+    def _sync(self, db=None, full: bool = False):
+        from database import SessionLocal, RefreshToken
+        
+        own_session = db is None
+        db = db or SessionLocal()
+        try:
+            query = db.query(RefreshToken.jti, RefreshToken.expires_at, RefreshToken.revoked_at).filter(
+                RefreshToken.revoked_at.isnot(None),
+                RefreshToken.expires_at > datetime.utcnow() - timedelta(days=1)
+            )
+            if not full and self._last_revoked_at is not None:
+                query = query.filter(RefreshToken.revoked_at >= self._last_revoked_at)
+            rows = query.all()
+        finally:
+            if own_session:
+                db.close()
+        
+        now = time.time()
+        with self._lock:
+            if full:
+                self._revoked.clear()
+            for jti, expires_at, revoked_at in rows:
+                self._revoked[jti] = self._forget_at(expires_at)
+                if self._last_revoked_at is None or revoked_at > self._last_revoked_at:
+                    self._last_revoked_at = revoked_at
+            # Descartar sesiones cuyos tokens ya han caducado
+            for jti in [jti for jti, forget_at in self._revoked.items() if forget_at < now]:
+                del self._revoked[jti]
+            self.syncs += 1
+    
+    async def run_sync(self):
+        """Tarea de fondo: sincroniza cada sync_interval segundos fuera del event loop"""
+        from fastapi.concurrency import run_in_threadpool
+        
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await run_in_threadpool(self._sync)
+            except Exception as e:
+                print(f"[AUTH] ❌ Error sincronizando revocaciones: {e}")
+    
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        """Comprueba si una sesión está revocada (solo memoria, nunca consulta la BD)"""
+        if not jti:
+            return False
+        with self._lock:
+            return jti in self._revoked
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {"revoked": len(self._revoked), "syncs": self.syncs}
+
+
+# Instancia global compartida
+revocation_list = RevocationList()
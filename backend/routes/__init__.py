@@ -5,10 +5,12 @@ from . import auth_routes
 from . import project_routes
 from . import imputacion_routes
 from . import websocket_routes
+from . import analytics_routes
 
 __all__ = [
     'auth_routes',
     'project_routes', 
     'imputacion_routes',
-    'websocket_routes'
+    'websocket_routes',
+    'analytics_routes'
 ]
@@ -0,0 +1,178 @@
+"""
+Rutas de analítica: estadísticas de horas por proyecto calculadas en la BD
+"""
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import Date, case, cast, func
+from sqlalchemy.orm import Session
+from datetime import date
+from typing import Dict
+
+from database import get_db, db_handler, Imputacion, Project
+from routes.auth_routes import get_current_user
+from schemas import AnaliticaResponse
+
+router = APIRouter(prefix="/api/analytics", tags=["analytics"])
+
+# Granularidades admitidas
+PERIODOS_ANALITICA = ("dia", "semana", "mes")
+
+# Umbral de jornada larga (horas en un día)
+JORNADA_LARGA_HORAS = 8
+
+
+# ============================================================================
+# FUNCIONES AUXILIARES
+# ============================================================================
+
+def bucket_expr(dialect: str, fecha, periodo: str):
+    """
+    Expresión SQL con el inicio del periodo (día, lunes o día 1) de una fecha
+    
+    Args:
+        dialect: Nombre del dialecto ('sqlite', 'postgresql', 'mysql')
+        fecha: Columna o expresión de tipo fecha
+        periodo: 'dia', 'semana' o 'mes'
+        
+    Returns:
+        Expresión SQLAlchemy de tipo Date
+    """
+    if periodo == "dia":
+        return fecha
+    
+    if dialect == "postgresql":
+        return cast(func.date_trunc("week" if periodo == "semana" else "month", fecha), Date)
+    
+    if dialect == "mysql":
+        if periodo == "semana":
+            return func.subdate(fecha, func.weekday(fecha), type_=Date)
+        return cast(func.date_format(fecha, "%Y-%m-01"), Date)
+    
+    # SQLite: retroceder 6 días y avanzar al siguiente lunes = lunes de la semana
+    if periodo == "semana":
+        return func.date(fecha, "-6 days", "weekday 1", type_=Date)
+    return func.date(fecha, "start of month", type_=Date)
+
+
+def _stats(horas_total, dias, maximo, largos) -> dict:
+    """Normaliza una fila de agregados a la estructura de respuesta"""
+    horas_total = round(horas_total or 0, 2)
+    return {
+        "horas": horas_total,
+        "dias": dias,
+        "media_diaria": round(horas_total / dias, 2) if dias else 0,
+        "max_dia": round(maximo or 0, 2),
+        "dias_mas_8h": int(largos or 0)
+    }
+
+
+# ============================================================================
+# ENDPOINTS
+# ============================================================================
+
+@router.get("/proyectos", response_model=AnaliticaResponse)
+@db_handler
+def get_estadisticas_proyectos(
+    desde: date = Query(..., alias="from"),
+    hasta: date = Query(..., alias="to"),
+    periodo: str = "mes",
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Estadísticas de horas por proyecto y periodo, agregadas con GROUP BY en la BD
+    
+    Por cada proyecto y periodo devuelve horas totales, días imputados,
+    media diaria, máximo en un día y días con más de 8h. También devuelve
+    las mismas métricas para el total de todos los proyectos (sumando
+    primero las horas de cada día).
+    
+    Args:
+        desde: Fecha inicial del rango (incluida)
+        hasta: Fecha final del rango (incluida)
+        periodo: Granularidad: 'dia', 'semana' o 'mes'
+        current_user: Usuario actual
+        db: Sesión de base de datos
+        
+    Returns:
+        Estadísticas por proyecto y totales por periodo
+        
+    Raises:
+        HTTPException 400: Si el periodo no es válido o el rango está invertido
+    """
+    if periodo not in PERIODOS_ANALITICA:
+        raise HTTPException(status_code=400, detail="El periodo debe ser 'dia', 'semana' o 'mes'")
+    
+    if hasta < desde:
+        raise HTTPException(status_code=400, detail="La fecha 'to' debe ser posterior a 'from'")
+    
+    user_id = current_user["user_id"]
+    dialect = db.get_bind().dialect.name
+    
+    filtros = (
+        Imputacion.user_id == user_id,
+        Imputacion.fecha.between(desde, hasta),
+        Imputacion.horas > 0
+    )
+    
+    # Por proyecto: cada fila de imputaciones es un (proyecto, día)
+    bucket = bucket_expr(dialect, Imputacion.fecha, periodo).label("inicio")
+    rows = db.query(
+        Project.id,
+        Project.nombre,
+        Project.color,
+        bucket,
+        func.sum(Imputacion.horas),
+        func.count(Imputacion.id),
+        func.max(Imputacion.horas),
+        func.sum(case((Imputacion.horas > JORNADA_LARGA_HORAS, 1), else_=0))
+    ).join(
+        Project, Imputacion.project_id == Project.id
+    ).filter(
+        *filtros
+    ).group_by(
+        Project.id, Project.nombre, Project.color, Project.created_at, bucket
+    ).order_by(
+        Project.created_at, Project.id, bucket
+    ).all()
+    
+    proyectos: Dict[int, dict] = {}
+    for project_id, nombre, color, inicio, horas_total, dias, maximo, largos in rows:
+        proyecto = proyectos.setdefault(project_id, {
+            "id": project_id,
+            "nombre": nombre,
+            "color": color,
+            "periodos": []
+        })
+        proyecto["periodos"].append({"inicio": inicio.isoformat(), **_stats(horas_total, dias, maximo, largos)})
+    
+    # Total: primero horas por día (todos los proyectos) y luego por periodo
+    diario = db.query(
+        Imputacion.fecha.label("fecha"),
+        func.sum(Imputacion.horas).label("horas")
+    ).filter(
+        *filtros
+    ).group_by(Imputacion.fecha).subquery()
+    
+    bucket_total = bucket_expr(dialect, diario.c.fecha, periodo).label("inicio")
+    total_rows = db.query(
+        bucket_total,
+        func.sum(diario.c.horas),
+        func.count(diario.c.fecha),
+        func.max(diario.c.horas),
+        func.sum(case((diario.c.horas > JORNADA_LARGA_HORAS, 1), else_=0))
+    ).group_by(bucket_total).order_by(bucket_total).all()
+    
+    total = [
+        {"inicio": inicio.isoformat(), **_stats(horas_total, dias, maximo, largos)}
+        for inicio, horas_total, dias, maximo, largos in total_rows
+    ]
+    
+    print(f"[ANALYTICS] 📊 Estadísticas por {periodo} {desde.isoformat()} → {hasta.isoformat()} para {current_user['email']}")
+    
+    return {
+        "periodo": periodo,
+        "desde": desde.isoformat(),
+        "hasta": hasta.isoformat(),
+        "proyectos": list(proyectos.values()),
+        "total": total
+    }
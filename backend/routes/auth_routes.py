@@ -1,21 +1,84 @@
 """
-Rutas de autenticación: login y registro
+Rutas de autenticación: login, registro, refresco de token y logout
 """
 from fastapi import APIRouter, Depends, HTTPException, Header
+from sqlalchemy import event
 from sqlalchemy.orm import Session
 from typing import Optional
+from datetime import datetime
+import os
+import time
 
-from database import get_db, User
-from auth import hash_password, verify_password, create_access_token, get_user_from_token
-from schemas import UserRegister, UserLogin, Token, UserResponse
+from cache import TTLCache
+from database import get_db, db_handler, User, RefreshToken
+from auth import (
+    hash_password, verify_password, password_needs_rehash, create_access_token, create_refresh_token,
+    decode_access_token, get_user_from_token, PasswordPoolBusy, ACCESS_TOKEN_EXPIRE_MINUTES
+)
+from revocation import revocation_list
+from schemas import UserRegister, UserLogin, Token, TokenRefresh, RefreshRequest, UserResponse
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
+# Caché de tokens verificados -> datos del usuario (evita decodificar el JWT)
+# y de usuarios existentes (evita el SELECT en cada petición autenticada)
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "300"))
+
+token_cache = TTLCache(max_size=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL_SECONDS)
+user_exists_cache = TTLCache(max_size=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL_SECONDS)
+
+
+def invalidate_user_cache(user_id: int):
+    """
+    Invalida la caché de autenticación de un usuario (p.ej. al borrarlo)
+    
+    Los tokens cacheados del usuario dejan de valer porque cada acierto en
+    token_cache vuelve a comprobar user_exists_cache.
+    """
+    user_exists_cache.pop(user_id)
+
+
+@event.listens_for(User, "after_delete")
+def _on_user_deleted(mapper, connection, target):
+    """Invalida la caché al borrar un usuario vía ORM"""
+    invalidate_user_cache(target.id)
+
+
+def get_cached_user(token: str) -> Optional[dict]:
+    """
+    Datos de un access token, verificado una vez y cacheado hasta que caduca
+    
+    Lo usan get_current_user y el limitador de peticiones (ratelimit.py),
+    así el JWT se decodifica una sola vez por token.
+    
+    Args:
+        token: Access token JWT
+        
+    Returns:
+        Diccionario con user_id, email, exp y sid o None si no es válido
+    """
+    user_data = token_cache.get(token)
+    if user_data is not None and revocation_list.is_revoked(user_data.get("sid")):
+        token_cache.pop(token)
+        user_data = None
+    
+    if user_data is None:
+        user_data = get_user_from_token(token)
+        if not user_data:
+            return None
+        
+        # No cachear más allá de la expiración del propio token
+        token_cache.set(token, user_data, ttl=user_data["exp"] - time.time())
+    
+    return user_data
+
 
 # ============================================================================
 # DEPENDENCIA PARA OBTENER USUARIO ACTUAL
 # ============================================================================
 
+@db_handler
 def get_current_user(authorization: Optional[str] = Header(None), db: Session = Depends(get_db)) -> dict:
     """
     Obtiene el usuario actual desde el token JWT
@@ -34,24 +97,78 @@ def get_current_user(authorization: Optional[str] = Header(None), db: Session =
         raise HTTPException(status_code=401, detail="Token no proporcionado")
     
     token = authorization.replace("Bearer ", "")
-    user_data = get_user_from_token(token)
     
+    user_data = get_cached_user(token)
     if not user_data:
         raise HTTPException(status_code=401, detail="Token inválido o expirado")
     
     # Verificar que el usuario existe
-    user = db.query(User).filter(User.id == user_data["user_id"]).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    user_id = user_data["user_id"]
+    if user_exists_cache.get(user_id) is None:
+        exists = db.query(User.id).filter(User.id == user_id).first() is not None
+        if not exists:
+            raise HTTPException(status_code=404, detail="Usuario no encontrado")
+        user_exists_cache.set(user_id, True)
     
     return user_data
 
 
+# ============================================================================
+# SESIONES
+# ============================================================================
+
+def issue_session(db: Session, user: User) -> dict:
+    """
+    Crea una sesión: refresh token guardado en BD y access token de vida corta
+    
+    Args:
+        db: Sesión de base de datos
+        user: Usuario autenticado
+        
+    Returns:
+        Respuesta de login/registro (token, refresh_token, expires_in, user)
+    """
+    refresh_token, jti, expires_at = create_refresh_token(user.id)
+    db.add(RefreshToken(jti=jti, user_id=user.id, expires_at=expires_at))
+    db.commit()
+    
+    token = create_access_token({
+        "user_id": user.id,
+        "email": user.email,
+        "sid": jti
+    })
+    
+    return {
+        "token": token,
+        "refresh_token": refresh_token,
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        "user": {
+            "id": user.id,
+            "email": user.email
+        }
+    }
+
+
+def revoke_session(db: Session, jti: str):
+    """
+    Revoca una sesión: la marca en BD y en la lista en memoria de este proceso
+    (los demás procesos la verán en su siguiente sincronización)
+    """
+    session = db.query(RefreshToken).filter(RefreshToken.jti == jti).first()
+    if session is None:
+        return
+    if session.revoked_at is None:
+        session.revoked_at = datetime.utcnow()
+        db.commit()
+    revocation_list.add(session.jti, session.expires_at)
+
+
 # ============================================================================
 # ENDPOINTS
 # ============================================================================
 
 @router.post("/register", response_model=Token)
+@db_handler
 def register(user_data: UserRegister, db: Session = Depends(get_db)):
     """
     Registra un nuevo usuario
@@ -65,6 +182,7 @@ def register(user_data: UserRegister, db: Session = Depends(get_db)):
         
     Raises:
         HTTPException 400: Si el usuario ya existe
+        HTTPException 503: Si el pool de contraseñas está saturado
     """
     # Verificar si el usuario ya existe
     existing_user = db.query(User).filter(User.email == user_data.email).first()
@@ -72,7 +190,10 @@ def register(user_data: UserRegister, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="El email ya está registrado")
     
     # Crear nuevo usuario
-    hashed_password = hash_password(user_data.password)
+    try:
+        hashed_password = hash_password(user_data.password)
+    except PasswordPoolBusy:
+        raise HTTPException(status_code=503, detail="Servidor ocupado, inténtalo de nuevo", headers={"Retry-After": "1"})
     new_user = User(
         email=user_data.email,
         password=hashed_password
@@ -82,24 +203,16 @@ def register(user_data: UserRegister, db: Session = Depends(get_db)):
     db.commit()
     db.refresh(new_user)
     
-    # Crear token
-    token = create_access_token({
-        "user_id": new_user.id,
-        "email": new_user.email
-    })
+    # Crear sesión (access + refresh token)
+    response = issue_session(db, new_user)
     
     print(f"[AUTH] ✅ Usuario registrado: {new_user.email}")
     
-    return {
-        "token": token,
-        "user": {
-            "id": new_user.id,
-            "email": new_user.email
-        }
-    }
+    return response
 
 
 @router.post("/login", response_model=Token)
+@db_handler
 def login(user_data: UserLogin, db: Session = Depends(get_db)):
     """
     Inicia sesión de un usuario
@@ -113,31 +226,110 @@ def login(user_data: UserLogin, db: Session = Depends(get_db)):
         
     Raises:
         HTTPException 401: Si las credenciales son incorrectas
+        HTTPException 503: Si el pool de contraseñas está saturado
     """
     # Buscar usuario
     user = db.query(User).filter(User.email == user_data.email).first()
     
-    if not user or not verify_password(user_data.password, user.password):
+    try:
+        password_ok = user is not None and verify_password(user_data.password, user.password)
+    except PasswordPoolBusy:
+        raise HTTPException(status_code=503, detail="Servidor ocupado, inténtalo de nuevo", headers={"Retry-After": "1"})
+    
+    if not password_ok:
         raise HTTPException(status_code=401, detail="Email o contraseña incorrectos")
     
-    # Crear token
+    # Rehashear con el coste calibrado actual (mejor esfuerzo: si el pool
+    # está ocupado se deja para el próximo login)
+    if password_needs_rehash(user.password):
+        try:
+            user.password = hash_password(user_data.password)
+            db.commit()
+            print(f"[AUTH] 🔁 Contraseña rehasheada con el nuevo coste: {user.email}")
+        except PasswordPoolBusy:
+            pass
+    
+    # Crear sesión (access + refresh token)
+    response = issue_session(db, user)
+    
+    print(f"[AUTH] 🔓 Login exitoso: {user.email}")
+    
+    return response
+
+
+@router.post("/refresh", response_model=TokenRefresh)
+@db_handler
+def refresh(data: RefreshRequest, db: Session = Depends(get_db)):
+    """
+    Emite un nuevo access token a partir de un refresh token válido
+    
+    Args:
+        data: Refresh token de la sesión
+        db: Sesión de base de datos
+        
+    Returns:
+        Nuevo access token y su duración en segundos
+        
+    Raises:
+        HTTPException 401: Si el refresh token es inválido, ha caducado o está revocado
+    """
+    payload = decode_access_token(data.refresh_token)
+    if not payload or payload.get("type") != "refresh":
+        raise HTTPException(status_code=401, detail="Refresh token inválido o expirado")
+    
+    session = db.query(RefreshToken).filter(RefreshToken.jti == payload.get("jti")).first()
+    if not session or session.revoked_at is not None or session.expires_at < datetime.utcnow():
+        raise HTTPException(status_code=401, detail="Sesión revocada o expirada")
+    
+    user = db.query(User).filter(User.id == session.user_id).first()
+    if not user:
+        raise HTTPException(status_code=401, detail="Usuario no encontrado")
+    
     token = create_access_token({
         "user_id": user.id,
-        "email": user.email
+        "email": user.email,
+        "sid": session.jti
     })
     
-    print(f"[AUTH] 🔓 Login exitoso: {user.email}")
-    
     return {
         "token": token,
-        "user": {
-            "id": user.id,
-            "email": user.email
-        }
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60
     }
 
 
+@router.post("/logout")
+@db_handler
+def logout(
+    data: Optional[RefreshRequest] = None,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Cierra la sesión actual: revoca su refresh token y todos sus access tokens
+    
+    Args:
+        data: Refresh token a revocar (opcional, por defecto el de la sesión actual)
+        current_user: Usuario actual
+        db: Sesión de base de datos
+        
+    Returns:
+        Mensaje de confirmación
+    """
+    if current_user.get("sid"):
+        revoke_session(db, current_user["sid"])
+    
+    if data is not None:
+        payload = decode_access_token(data.refresh_token)
+        if payload and payload.get("type") == "refresh" and payload.get("user_id") == current_user["user_id"]:
+            revoke_session(db, payload["jti"])
+    
+    print(f"[AUTH] 🔒 Logout: {current_user['email']}")
+    
+    return {"message": "Sesión cerrada"}
+
+
 @router.get("/me", response_model=UserResponse)
+@db_handler
 def get_me(current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
     """
     Obtiene información del usuario actual
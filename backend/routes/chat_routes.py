@@ -1,17 +1,20 @@
 """
 Rutas para gestión del historial del chat
 """
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from datetime import datetime
 
-from database import get_db, ChatMessage
+from database import get_db, db_handler, ChatMessage
 from routes.auth_routes import get_current_user
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/api/chat", tags=["chat"])
 
+# Tamaño máximo de una página del historial
+CHAT_PAGE_MAX = 200
+
 
 # ============================================================================
 # SCHEMAS
@@ -37,27 +40,45 @@ class ChatMessageResponse(BaseModel):
 # ============================================================================
 
 @router.get("/messages", response_model=List[ChatMessageResponse])
+@db_handler
 def get_chat_messages(
-    limit: int = 50,
+    limit: int = Query(50, ge=1, le=CHAT_PAGE_MAX),
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
-    Obtiene el historial de mensajes del usuario
+    Obtiene una página del historial de mensajes del usuario, del más nuevo al más antiguo
+    
+    Paginación por cursor sobre el id (índice user_id, id): sin cursores
+    devuelve los últimos mensajes; con before_id, la página anterior a ese
+    mensaje (para cargar más al hacer scroll hacia arriba); con after_id, los
+    mensajes posteriores a ese, empezando por los más cercanos al cursor. Hay
+    más páginas mientras se reciban limit mensajes.
     
     Args:
-        limit: Número máximo de mensajes a devolver (default: 50)
+        limit: Número máximo de mensajes a devolver (default: 50, máx. 200)
+        before_id: Solo mensajes con id menor que este
+        after_id: Solo mensajes con id mayor que este
     """
-    messages = db.query(ChatMessage)\
-        .filter(ChatMessage.user_id == current_user["user_id"])\
-        .order_by(ChatMessage.created_at.asc())\
-        .limit(limit)\
-        .all()
+    query = db.query(ChatMessage).filter(ChatMessage.user_id == current_user["user_id"])
+    if before_id is not None:
+        query = query.filter(ChatMessage.id < before_id)
+    
+    if after_id is not None:
+        # Los más cercanos al cursor, para no dejar huecos al seguir paginando hacia delante
+        messages = query.filter(ChatMessage.id > after_id)\
+            .order_by(ChatMessage.id.asc())\
+            .limit(limit)\
+            .all()
+        return messages[::-1]
     
-    return messages
+    return query.order_by(ChatMessage.id.desc()).limit(limit).all()
 
 
 @router.post("/messages", response_model=ChatMessageResponse)
+@db_handler
 def save_chat_message(
     message_data: ChatMessageCreate,
     current_user: dict = Depends(get_current_user),
@@ -83,6 +104,7 @@ def save_chat_message(
 
 
 @router.delete("/messages")
+@db_handler
 def clear_chat_history(
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
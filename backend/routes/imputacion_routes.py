@@ -1,34 +1,232 @@
 """
 Rutas de imputaciones: CRUD y consulta por semana
 """
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, tuple_
 from sqlalchemy.orm import Session
 from datetime import date
-from typing import Dict
+from typing import Dict, Iterator, List, Optional
+import codecs
+import csv
+import io
+import json
+import os
+import tempfile
 
-from database import get_db, Imputacion, Project
+from cache import week_cache
+from database import get_db, db_handler, SessionLocal, Imputacion, ImputacionTotal, Project, User
+from auth import is_admin
+from importer import ImputacionImporter
 from routes.auth_routes import get_current_user
-from schemas import ImputacionCreate, ImputacionUpdate, ImputacionResponse, SemanaResponse
-from utils import get_monday_of_week, get_week_dates, is_weekend, validate_hours
+from schemas import (
+    ImputacionCreate, ImputacionUpdate, ImputacionResponse, SemanaResponse, RangoResponse,
+    ImputacionBatch, ImputacionBatchResponse, TotalesResponse
+)
+from utils import (
+    get_monday_of_week, get_week_dates, get_working_dates, is_weekend, validate_hours,
+    save_imputaciones_batch, apply_totales_delta, get_periodo_inicio, PERIODOS,
+    record_change, imputacion_message, get_data_version, make_etag, etag_matches, lock_user_data
+)
 
 router = APIRouter(prefix="/api/imputaciones", tags=["imputaciones"])
 
+# Máximo de días que se pueden pedir en /rango (un año)
+MAX_RANGE_DAYS = 366
+
+# Exportación: filas por bloque y columnas de salida
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_COLUMNS = ("fecha", "user_id", "email", "project_id", "proyecto", "horas")
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson"
+}
+
+# Importación: bytes del cuerpo que se mantienen en memoria antes de pasar a disco
+IMPORT_SPOOL_MAX_BYTES = 8 * 1024 * 1024
+# Tamaño máximo del CSV (por encima se responde 413)
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(50 * 1024 * 1024)))
+
+
+# ============================================================================
+# FUNCIONES AUXILIARES
+# ============================================================================
+
+def build_horas_data(db: Session, user_id: int, fechas: List[date]) -> list:
+    """
+    Construye los proyectos con horas de una lista de fechas en una sola consulta
+    
+    Hace un JOIN de proyectos con sus imputaciones en el rango de fechas y
+    pivota las filas a {fecha: horas} en una única pasada. Solo se incluyen
+    proyectos con al menos una imputación con horas > 0.
+    
+    Args:
+        db: Sesión de base de datos
+        user_id: ID del usuario
+        fechas: Fechas L-V ordenadas que forman el rango
+        
+    Returns:
+        Lista de proyectos con id, nombre, color y horas por fecha
+    """
+    if not fechas:
+        return []
+    
+    rows = db.query(
+        Project.id,
+        Project.nombre,
+        Project.color,
+        Imputacion.fecha,
+        Imputacion.horas
+    ).join(
+        Imputacion,
+        and_(
+            Imputacion.project_id == Project.id,
+            Imputacion.user_id == user_id,
+            Imputacion.fecha.between(fechas[0], fechas[-1]),
+            Imputacion.horas > 0
+        )
+    ).filter(
+        Project.user_id == user_id
+    ).order_by(Project.created_at, Project.id).all()
+    
+    # Pivotar filas a {fecha: horas}, rellenando con 0 los días sin imputación
+    proyectos: Dict[int, dict] = {}
+    for project_id, nombre, color, fecha, horas in rows:
+        proyecto = proyectos.get(project_id)
+        if proyecto is None:
+            proyecto = proyectos[project_id] = {
+                "id": project_id,
+                "nombre": nombre,
+                "color": color,
+                "horas": {f.isoformat(): 0 for f in fechas}
+            }
+        proyecto["horas"][fecha.isoformat()] = horas
+    
+    return list(proyectos.values())
+
+
+def build_semana_data(db: Session, user_id: int, lunes: date) -> list:
+    """
+    Construye los proyectos con horas de una semana (L-V)
+    
+    Args:
+        db: Sesión de base de datos
+        user_id: ID del usuario
+        lunes: Lunes de la semana
+        
+    Returns:
+        Lista de proyectos con id, nombre, color y horas por fecha
+    """
+    return build_horas_data(db, user_id, get_week_dates(lunes))
+
+
+def iter_export_rows(
+    user_id: Optional[int],
+    desde: date,
+    hasta: date,
+    formato: str,
+    chunk_size: int = EXPORT_CHUNK_SIZE
+) -> Iterator[str]:
+    """
+    Genera la exportación de imputaciones por bloques (CSV o NDJSON)
+    
+    Abre su propia sesión porque se consume mientras se envía la respuesta,
+    cuando la sesión de la petición ya está cerrada. Las filas se leen por
+    páginas con keyset sobre (fecha, user_id, project_id), una transacción
+    por página que se cierra antes de enviar el bloque: en SQLite sin WAL una
+    lectura abierta bloquea los commits de los demás, y el cliente marca el
+    ritmo del envío. La memoria no depende del tamaño de la exportación.
+    
+    Args:
+        user_id: ID del usuario (None = todos los usuarios)
+        desde: Fecha inicial (incluida)
+        hasta: Fecha final (incluida)
+        formato: 'csv' o 'ndjson'
+        chunk_size: Filas por bloque leído y enviado
+        
+    Yields:
+        Bloques de texto listos para enviar
+    """
+    db = SessionLocal()
+    try:
+        query = db.query(
+            Imputacion.fecha,
+            User.id,
+            User.email,
+            Project.id,
+            Project.nombre,
+            Imputacion.horas
+        ).join(
+            Project, Imputacion.project_id == Project.id
+        ).join(
+            User, Imputacion.user_id == User.id
+        ).filter(
+            Imputacion.fecha.between(desde, hasta)
+        )
+        if user_id is not None:
+            query = query.filter(Imputacion.user_id == user_id)
+        query = query.order_by(Imputacion.fecha, Imputacion.user_id, Imputacion.project_id)
+        
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if formato == "csv" else None
+        if writer:
+            writer.writerow(EXPORT_COLUMNS)
+        
+        last_key = None
+        while True:
+            page = query
+            if last_key is not None:
+                page = page.filter(
+                    tuple_(Imputacion.fecha, Imputacion.user_id, Imputacion.project_id) > last_key
+                )
+            rows = page.limit(chunk_size).all()
+            # Cerrar la transacción de lectura antes de enviar nada
+            db.rollback()
+            
+            for row in rows:
+                values = (row[0].isoformat(),) + tuple(row[1:])
+                if writer:
+                    writer.writerow(values)
+                else:
+                    buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, values)), ensure_ascii=False))
+                    buffer.write("\n")
+            
+            if buffer.tell():
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            
+            if len(rows) < chunk_size:
+                break
+            last_key = (rows[-1][0], rows[-1][1], rows[-1][3])
+    finally:
+        db.close()
+
 
 # ============================================================================
 # ENDPOINTS
 # ============================================================================
 
 @router.get("/semana/{fecha_inicio}", response_model=SemanaResponse)
+@db_handler
 def get_semana(
     fecha_inicio: date,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
     Obtiene todas las imputaciones de una semana (L-V) para el usuario
     
+    Soporta peticiones condicionales: si If-None-Match coincide con la
+    versión de datos del usuario se responde 304 sin consultar imputaciones.
+    
     Args:
         fecha_inicio: Cualquier fecha de la semana (se calculará el lunes)
+        response: Respuesta (para añadir ETag)
+        if_none_match: Cabecera If-None-Match
         current_user: Usuario actual
         db: Sesión de base de datos
         
@@ -40,58 +238,200 @@ def get_semana(
     # Calcular el lunes de la semana
     lunes = get_monday_of_week(fecha_inicio)
     
-    # Obtener fechas de la semana (L-V)
-    fechas = get_week_dates(lunes)
+    version = get_data_version(db, user_id)
+    etag = make_etag("s", user_id, lunes.isoformat(), version)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
     
-    # Obtener todos los proyectos del usuario
-    projects = db.query(Project).filter(
-        Project.user_id == user_id
-    ).order_by(Project.created_at).all()
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
     
-    # Construir respuesta - SOLO proyectos con horas en esta semana
-    proyectos_data = []
+    response.headers.update(headers)
     
-    for project in projects:
-        # Obtener imputaciones de esta semana para este proyecto
-        imputaciones = db.query(Imputacion).filter(
-            Imputacion.user_id == user_id,
-            Imputacion.project_id == project.id,
-            Imputacion.fecha.in_(fechas)
-        ).all()
+    proyectos_data = week_cache.get(user_id, lunes, version)
+    if proyectos_data is None:
+        generation = week_cache.generation(user_id)
+        proyectos_data = build_semana_data(db, user_id, lunes)
+        week_cache.set(user_id, lunes, proyectos_data, generation, version)
+    
+    print(f"[IMPUTACIONES] 📅 Semana del {lunes.isoformat()} para {current_user['email']}")
+    
+    return {
+        "semana": lunes.isoformat(),
+        "proyectos": proyectos_data
+    }
+
+
+@router.get("/rango", response_model=RangoResponse)
+@db_handler
+def get_rango(
+    desde: date = Query(..., alias="from"),
+    hasta: date = Query(..., alias="to"),
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Obtiene las imputaciones de un rango de fechas (L-V) para el usuario
+    
+    Devuelve la misma estructura por proyecto y día que /semana, de forma que
+    un mes o un trimestre se cargan con una sola petición.
+    
+    Args:
+        desde: Fecha inicial del rango (incluida)
+        hasta: Fecha final del rango (incluida)
+        current_user: Usuario actual
+        db: Sesión de base de datos
         
-        # Solo incluir el proyecto si tiene al menos una imputación con horas > 0
-        if not imputaciones:
-            continue
-            
-        # Verificar si tiene horas reales (> 0)
-        total_horas = sum(imp.horas for imp in imputaciones)
-        if total_horas == 0:
-            continue
+    Returns:
+        Datos del rango con proyectos y horas
         
-        # Crear diccionario de horas por fecha
-        imputaciones_dict = {imp.fecha: imp.horas for imp in imputaciones}
+    Raises:
+        HTTPException 400: Si el rango está invertido o supera el máximo
+    """
+    if hasta < desde:
+        raise HTTPException(status_code=400, detail="La fecha 'to' debe ser posterior a 'from'")
+    
+    if (hasta - desde).days + 1 > MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"El rango máximo es de {MAX_RANGE_DAYS} días")
+    
+    fechas = get_working_dates(desde, hasta)
+    proyectos_data = build_horas_data(db, current_user["user_id"], fechas)
+    
+    print(f"[IMPUTACIONES] 📆 Rango {desde.isoformat()} → {hasta.isoformat()} para {current_user['email']}")
+    
+    return {
+        "desde": desde.isoformat(),
+        "hasta": hasta.isoformat(),
+        "proyectos": proyectos_data
+    }
+
+
+@router.get("/totales", response_model=TotalesResponse)
+@db_handler
+def get_totales(
+    periodo: str = "semana",
+    desde: date = Query(..., alias="from"),
+    hasta: date = Query(..., alias="to"),
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Obtiene los totales de horas por proyecto y semana/mes de un rango
+    
+    Lee la tabla de totales agregados, así que el coste depende del número
+    de semanas o meses del rango y no del número de días imputados.
+    
+    Args:
+        periodo: 'semana' o 'mes'
+        desde: Fecha inicial del rango (incluida)
+        hasta: Fecha final del rango (incluida)
+        current_user: Usuario actual
+        db: Sesión de base de datos
         
-        horas_dict = {}
-        # Llenar con 0 las fechas sin imputación
-        for fecha in fechas:
-            horas_dict[fecha.isoformat()] = imputaciones_dict.get(fecha, 0)
+    Returns:
+        Totales por proyecto indexados por inicio de periodo
         
-        proyectos_data.append({
-            "id": project.id,
-            "nombre": project.nombre,
-            "color": project.color,
-            "horas": horas_dict
-        })
+    Raises:
+        HTTPException 400: Si el periodo no es válido o el rango está invertido
+    """
+    if periodo not in PERIODOS:
+        raise HTTPException(status_code=400, detail="El periodo debe ser 'semana' o 'mes'")
     
-    print(f"[IMPUTACIONES] 📅 Semana del {lunes.isoformat()} para {current_user['email']}")
+    if hasta < desde:
+        raise HTTPException(status_code=400, detail="La fecha 'to' debe ser posterior a 'from'")
+    
+    user_id = current_user["user_id"]
+    
+    rows = db.query(
+        Project.id,
+        Project.nombre,
+        Project.color,
+        ImputacionTotal.inicio,
+        ImputacionTotal.horas
+    ).join(
+        ImputacionTotal,
+        and_(
+            ImputacionTotal.project_id == Project.id,
+            ImputacionTotal.user_id == user_id,
+            ImputacionTotal.periodo == periodo,
+            ImputacionTotal.inicio.between(get_periodo_inicio(desde, periodo), hasta)
+        )
+    ).filter(
+        Project.user_id == user_id
+    ).order_by(Project.created_at, Project.id, ImputacionTotal.inicio).all()
+    
+    proyectos: Dict[int, dict] = {}
+    for project_id, nombre, color, inicio, horas in rows:
+        # Redondear para absorber el error acumulado de las sumas incrementales
+        horas = round(horas, 2)
+        if horas <= 0:
+            continue
+        proyecto = proyectos.setdefault(project_id, {
+            "id": project_id,
+            "nombre": nombre,
+            "color": color,
+            "totales": {}
+        })
+        proyecto["totales"][inicio.isoformat()] = horas
     
     return {
-        "semana": lunes.isoformat(),
-        "proyectos": proyectos_data
+        "periodo": periodo,
+        "desde": desde.isoformat(),
+        "hasta": hasta.isoformat(),
+        "proyectos": list(proyectos.values())
     }
 
 
+@router.get("/export")
+def export_imputaciones(
+    desde: date = Query(..., alias="from"),
+    hasta: date = Query(..., alias="to"),
+    formato: str = Query("csv", alias="format"),
+    all_users: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Exporta las imputaciones de un rango de fechas en streaming (CSV o NDJSON)
+    
+    La memoria usada es constante: las filas se leen por bloques y se envían
+    según se generan.
+    
+    Args:
+        desde: Fecha inicial del rango (incluida)
+        hasta: Fecha final del rango (incluida)
+        formato: 'csv' (por defecto) o 'ndjson'
+        all_users: Exportar todos los usuarios (solo administradores)
+        current_user: Usuario actual
+        
+    Returns:
+        StreamingResponse con el fichero de exportación
+        
+    Raises:
+        HTTPException 400: Si el formato no es válido o el rango está invertido
+        HTTPException 403: Si pide todos los usuarios sin ser administrador
+    """
+    if formato not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="El formato debe ser 'csv' o 'ndjson'")
+    
+    if hasta < desde:
+        raise HTTPException(status_code=400, detail="La fecha 'to' debe ser posterior a 'from'")
+    
+    if all_users and not is_admin(current_user):
+        raise HTTPException(status_code=403, detail="Solo un administrador puede exportar todos los usuarios")
+    
+    user_id = None if all_users else current_user["user_id"]
+    filename = f"imputaciones_{desde.isoformat()}_{hasta.isoformat()}.{formato}"
+    
+    print(f"[IMPUTACIONES] 📤 Exportación {formato} {desde.isoformat()} → {hasta.isoformat()} para {current_user['email']}")
+    
+    return StreamingResponse(
+        iter_export_rows(user_id, desde, hasta, formato),
+        media_type=EXPORT_MEDIA_TYPES[formato],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
 @router.post("", response_model=ImputacionResponse)
+@db_handler
 def create_or_update_imputacion(
     imputacion_data: ImputacionCreate,
     current_user: dict = Depends(get_current_user),
@@ -131,12 +471,15 @@ def create_or_update_imputacion(
     if not project:
         raise HTTPException(status_code=404, detail="Proyecto no encontrado")
     
-    # Buscar imputación existente
+    # Buscar imputación existente (bloqueada: su valor previo alimenta los totales)
+    lock_user_data(db, user_id)
     imputacion = db.query(Imputacion).filter(
         Imputacion.user_id == user_id,
         Imputacion.project_id == imputacion_data.project_id,
         Imputacion.fecha == imputacion_data.fecha
-    ).first()
+    ).with_for_update().first()
+    
+    horas_anteriores = imputacion.horas if imputacion else 0
     
     if imputacion:
         # Actualizar existente
@@ -153,15 +496,137 @@ def create_or_update_imputacion(
         db.add(imputacion)
         action = "creada"
     
+    # Mantener totales semanales/mensuales en la misma transacción
+    apply_totales_delta(db, user_id, [
+        (imputacion_data.project_id, imputacion_data.fecha, imputacion_data.horas - horas_anteriores)
+    ])
+    record_change(db, user_id, imputacion_message(
+        imputacion_data.project_id, imputacion_data.fecha, imputacion_data.horas
+    ))
+    
     db.commit()
     db.refresh(imputacion)
+    week_cache.invalidate(user_id, [imputacion.fecha])
     
     print(f"[IMPUTACIONES] ✅ Imputación {action}: {imputacion.horas}h en {project.nombre} el {imputacion.fecha}")
     
     return imputacion
 
 
+@router.post("/batch", response_model=ImputacionBatchResponse)
+@db_handler
+def batch_imputaciones(
+    batch: ImputacionBatch,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Crea o actualiza muchas imputaciones en una sola transacción
+    
+    Las celdas se validan en conjunto (fin de semana, rango de horas y
+    propiedad del proyecto, resuelta con una sola consulta) y las válidas se
+    escriben con un upsert nativo y un único commit. Las celdas inválidas no
+    abortan el lote: se devuelven con su error.
+    
+    Args:
+        batch: Lista de celdas (project_id, fecha, horas)
+        current_user: Usuario actual
+        db: Sesión de base de datos
+        
+    Returns:
+        Resultado por celda y contadores de guardadas / errores
+    """
+    user_id = current_user["user_id"]
+    
+    rows, resultados, _ = save_imputaciones_batch(db, user_id, batch.imputaciones)
+    
+    if rows:
+        db.commit()
+        week_cache.invalidate(user_id, [row["fecha"] for row in rows])
+    
+    errores = sum(1 for r in resultados if not r["ok"])
+    
+    print(f"[IMPUTACIONES] 📦 Lote guardado: {len(rows)} celdas, {errores} errores para {current_user['email']}")
+    
+    return {
+        "guardadas": len(rows),
+        "errores": errores,
+        "resultados": resultados
+    }
+
+
+@router.post("/import")
+async def import_imputaciones(
+    request: Request,
+    create_projects: bool = True,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Importa imputaciones históricas desde un CSV enviado como cuerpo (text/csv)
+    
+    El CSV debe tener cabecera project (o proyecto), fecha y horas. El cuerpo
+    se vuelca por trozos a un fichero temporal (comprobando tamaño y UTF-8
+    antes de escribir nada) y se importa por bloques en transacciones
+    grandes; las filas inválidas se devuelven en el informe en lugar de
+    abortar la importación.
+    
+    Args:
+        request: Petición con el CSV como cuerpo
+        create_projects: Crear los proyectos que no existan (respetando el máximo de 3)
+        current_user: Usuario actual
+        db: Sesión de base de datos
+        
+    Returns:
+        Informe con filas procesadas, importadas y rechazadas
+        
+    Raises:
+        HTTPException 413: Si el CSV supera IMPORT_MAX_BYTES
+        HTTPException 400: Si el CSV no está codificado en UTF-8
+    """
+    too_large = HTTPException(
+        status_code=413,
+        detail=f"El CSV supera el tamaño máximo ({IMPORT_MAX_BYTES / (1024 * 1024):g} MB)"
+    )
+    
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > IMPORT_MAX_BYTES:
+        raise too_large
+    
+    with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_MAX_BYTES) as spool:
+        # Se decodifica a la vez que se recibe: un error de codificación a mitad
+        # del fichero se detecta antes de importar (y confirmar) ningún bloque
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        size = 0
+        try:
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > IMPORT_MAX_BYTES:
+                    raise too_large
+                decoder.decode(chunk)
+                spool.write(chunk)
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="El CSV no está codificado en UTF-8")
+        spool.seek(0)
+        
+        def _run():
+            lines = io.TextIOWrapper(spool, encoding="utf-8-sig", newline="")
+            try:
+                return ImputacionImporter(db, current_user["user_id"], create_projects).run(lines)
+            finally:
+                lines.detach()
+        
+        report = await run_in_threadpool(_run)
+    
+    print(f"[IMPUTACIONES] 📥 Importación: {report['importadas']} importadas, "
+          f"{report['rechazadas']} rechazadas para {current_user['email']}")
+    
+    return report
+
+
 @router.put("/{imputacion_id}", response_model=ImputacionResponse)
+@db_handler
 def update_imputacion(
     imputacion_id: int,
     imputacion_data: ImputacionUpdate,
@@ -186,11 +651,12 @@ def update_imputacion(
     """
     user_id = current_user["user_id"]
     
-    # Buscar imputación
+    # Buscar imputación (bloqueada: su valor previo alimenta los totales)
+    lock_user_data(db, user_id)
     imputacion = db.query(Imputacion).filter(
         Imputacion.id == imputacion_id,
         Imputacion.user_id == user_id
-    ).first()
+    ).with_for_update().first()
     
     if not imputacion:
         raise HTTPException(status_code=404, detail="Imputación no encontrada")
@@ -199,10 +665,15 @@ def update_imputacion(
     if not validate_hours(imputacion_data.horas):
         raise HTTPException(status_code=400, detail="Las horas deben estar entre 0 y 24")
     
-    # Actualizar
+    # Actualizar (y sus totales en la misma transacción)
+    apply_totales_delta(db, user_id, [
+        (imputacion.project_id, imputacion.fecha, imputacion_data.horas - imputacion.horas)
+    ])
     imputacion.horas = imputacion_data.horas
+    record_change(db, user_id, imputacion_message(imputacion.project_id, imputacion.fecha, imputacion.horas))
     db.commit()
     db.refresh(imputacion)
+    week_cache.invalidate(user_id, [imputacion.fecha])
     
     print(f"[IMPUTACIONES] 📝 Imputación actualizada: {imputacion.horas}h el {imputacion.fecha}")
     
@@ -1,14 +1,15 @@
 """
 Rutas de proyectos: CRUD completo
 """
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header, Response
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
-from database import get_db, Project
+from cache import week_cache, project_ids_cache
+from database import get_db, db_handler, Project
 from routes.auth_routes import get_current_user
 from schemas import ProjectCreate, ProjectResponse
-from utils import validate_project_limit
+from utils import validate_project_limit, record_change, get_data_version, make_etag, etag_matches
 
 router = APIRouter(prefix="/api/projects", tags=["projects"])
 
@@ -18,17 +19,36 @@ router = APIRouter(prefix="/api/projects", tags=["projects"])
 # ============================================================================
 
 @router.get("", response_model=List[ProjectResponse])
-def get_projects(current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
+@db_handler
+def get_projects(
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
     """
     Obtiene todos los proyectos del usuario actual
     
+    Soporta peticiones condicionales: si If-None-Match coincide con la
+    versión de datos del usuario se responde 304 sin consultar proyectos.
+    
     Args:
+        response: Respuesta (para añadir ETag)
+        if_none_match: Cabecera If-None-Match
         current_user: Usuario actual (inyectado)
         db: Sesión de base de datos
         
     Returns:
         Lista de proyectos
     """
+    etag = make_etag("p", current_user["user_id"], get_data_version(db, current_user["user_id"]))
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    
+    response.headers.update(headers)
+    
     projects = db.query(Project).filter(
         Project.user_id == current_user["user_id"]
     ).order_by(Project.created_at).all()
@@ -39,6 +59,7 @@ def get_projects(current_user: dict = Depends(get_current_user), db: Session = D
 
 
 @router.post("", response_model=ProjectResponse)
+@db_handler
 def create_project(
     project_data: ProjectCreate,
     current_user: dict = Depends(get_current_user),
@@ -81,8 +102,14 @@ def create_project(
     )
     
     db.add(new_project)
+    db.flush()
+    record_change(db, user_id, {
+        "type": "project_created",
+        "project": {"id": new_project.id, "nombre": new_project.nombre, "color": new_project.color}
+    })
     db.commit()
     db.refresh(new_project)
+    project_ids_cache.pop(user_id)
     
     print(f"[PROJECTS] ✅ Proyecto creado: {new_project.nombre} por {current_user['email']}")
     
@@ -90,6 +117,7 @@ def create_project(
 
 
 @router.delete("/{project_id}")
+@db_handler
 def delete_project(
     project_id: int,
     current_user: dict = Depends(get_current_user),
@@ -126,7 +154,10 @@ def delete_project(
     
     # Eliminar proyecto (las imputaciones se borran en cascada)
     db.delete(project)
+    record_change(db, user_id, {"type": "project_deleted", "project_id": project_id})
     db.commit()
+    week_cache.invalidate_user(user_id)
+    project_ids_cache.pop(user_id)
     
     print(f"[PROJECTS] 🗑️ Proyecto eliminado: {project_name} por {current_user['email']}")
     
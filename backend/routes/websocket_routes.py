@@ -2,71 +2,551 @@
 Rutas WebSocket para actualizaciones en tiempo real
 """
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+import anyio
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
-from typing import Dict, List
+from typing import Dict, List, Optional, Union
+from datetime import date
+import asyncio
 import json
+import os
+import time
 
-from database import SessionLocal, Imputacion, Project
+from broadcast import broadcast_bus
+from cache import week_cache, project_ids_cache
+from database import run_with_session, Imputacion, Project
 from auth import get_user_from_token
-from utils import is_weekend, validate_hours
+from ratelimit import rate_limiter, POLICY_USER, POLICY_INTERACTIONS
+from routes.imputacion_routes import build_semana_data
+from schemas import ImputacionBatch
+from utils import (
+    is_weekend, validate_hours, apply_totales_delta, save_imputaciones_batch, get_monday_of_week,
+    record_change, get_changes_since, get_data_version, imputacion_message, imputaciones_message,
+    lock_user_data
+)
+from writebehind import write_buffer
+from wsframing import encode_message, encode_json, ENCODING_JSON, WS_ENCODINGS
 
 router = APIRouter()
 
-# Gestión de conexiones activas por usuario
-# Estructura: {user_id: [websocket1, websocket2, ...]}
-active_connections: Dict[int, List[WebSocket]] = {}
+# Cola de salida por conexión: mensajes pendientes como máximo y política con
+# los clientes lentos cuando se llena ("drop_oldest" descarta el más antiguo,
+# "disconnect" cierra la conexión para que el cliente se reconecte y recargue)
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "100"))
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop_oldest")
+# Un envío que tarda más que esto se considera un cliente colgado
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+
+# Latidos: cada WS_HEARTBEAT_SECONDS se envía {"type": "ping"} a todas las
+# conexiones y el cliente responde {"action": "pong"}; una conexión de la que no
+# llega nada en WS_IDLE_TIMEOUT_SECONDS se da por muerta y se cierra (0 = nunca)
+WS_HEARTBEAT_SECONDS = float(os.getenv("WS_HEARTBEAT_SECONDS", "25"))
+WS_IDLE_TIMEOUT_SECONDS = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "60"))
+# Conexiones abiertas como máximo en este worker, por usuario y en total (0 = sin límite)
+WS_MAX_CONNECTIONS_PER_USER = int(os.getenv("WS_MAX_CONNECTIONS_PER_USER", "10"))
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "1000"))
+
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "disconnect")
+
+# Códigos de cierre: inactiva (el cliente se reconecta) y límite de conexiones
+CLOSE_IDLE = 1001
+CLOSE_TRY_AGAIN_LATER = 1013
+
+PING_PAYLOAD = encode_json({"type": "ping"})
+
+
+class Connection:
+    """
+    Conexión WebSocket con cola de salida acotada y tarea de envío propia
+    
+    Todo lo que se envía al cliente pasa por la cola, de modo que quien
+    difunde nunca espera a la red y la tarea de envío es el único escritor
+    del socket. La cola guarda los mensajes ya codificados con la
+    codificación de la conexión (ver wsframing.py).
+    """
+    
+    def __init__(self, websocket: WebSocket, user_id: int,
+                 queue_size: int = WS_QUEUE_SIZE, policy: str = WS_SLOW_CONSUMER_POLICY,
+                 encoding: str = ENCODING_JSON):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"WS_SLOW_CONSUMER_POLICY debe ser uno de {SLOW_CONSUMER_POLICIES}")
+        self.websocket = websocket
+        self.user_id = user_id
+        self.policy = policy
+        self.encoding = encoding
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        # Tamaño de lo encolado (caracteres o bytes): la memoria que retiene la conexión
+        self.queued_bytes = 0
+        self.dropped = 0
+        self.received = 0
+        self.sent = 0
+        self.connected_at = time.monotonic()
+        self.last_seen = self.connected_at
+        self.closed = False
+        self.sender_task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        """Arranca la tarea que vacía la cola hacia el socket"""
+        self.sender_task = asyncio.create_task(self._sender())
+    
+    def touch(self):
+        """Anota que ha llegado un mensaje del cliente (incluidos los pong)"""
+        self.received += 1
+        self.last_seen = time.monotonic()
+    
+    def send(self, message: dict) -> bool:
+        """
+        Codifica y encola un mensaje sin esperar a la red
+        
+        Returns:
+            False si la conexión está cerrada o se ha cerrado por lenta
+        """
+        return self.send_encoded(encode_message(message, self.encoding))
+    
+    def send_encoded(self, payload: Union[str, bytes]) -> bool:
+        """
+        Encola un mensaje ya codificado con self.encoding
+        
+        Returns:
+            False si la conexión está cerrada o se ha cerrado por lenta
+        """
+        if self.closed:
+            return False
+        
+        try:
+            self.queue.put_nowait(payload)
+            self.queued_bytes += len(payload)
+            return True
+        except asyncio.QueueFull:
+            pass
+        
+        if self.policy == "drop_oldest":
+            self.queued_bytes -= len(self.queue.get_nowait())
+            self.queue.put_nowait(payload)
+            self.queued_bytes += len(payload)
+            self.dropped += 1
+            return True
+        
+        print(f"[WS] 🐢 Cliente lento desconectado: usuario {self.user_id}")
+        self.close(code=1013)
+        return False
+    
+    async def _sender(self):
+        try:
+            while not self.closed:
+                payload = await self.queue.get()
+                self.queued_bytes -= len(payload)
+                # fail_after y no asyncio.wait_for: en Python < 3.12 wait_for puede
+                # tragarse la cancelación si el envío termina a la vez
+                with anyio.fail_after(WS_SEND_TIMEOUT_SECONDS):
+                    if isinstance(payload, bytes):
+                        await self.websocket.send_bytes(payload)
+                    else:
+                        await self.websocket.send_text(payload)
+                self.sent += 1
+        except TimeoutError:
+            print(f"[WS] ⏱️ Envío bloqueado, cerrando conexión de usuario {self.user_id}")
+            self.close(code=1013)
+        except Exception as e:
+            # El cliente ya se ha ido: lo limpia el bucle de recepción
+            print(f"[WS] 🔌 Envío fallido a usuario {self.user_id}: {e!r}")
+            self.closed = True
+            remove_connection(self)
+    
+    def close(self, code: int = 1000):
+        """Deja de aceptar mensajes y cierra el socket en segundo plano"""
+        if self.closed:
+            return
+        self.closed = True
+        remove_connection(self)
+        asyncio.create_task(self._close(code))
+    
+    async def _close(self, code: int):
+        if self.sender_task is not None and self.sender_task is not asyncio.current_task():
+            self.sender_task.cancel()
+        try:
+            await self.websocket.close(code=code)
+        except (RuntimeError, OSError):
+            pass
+    
+    async def shutdown(self):
+        """Para la tarea de envío al terminar la conexión"""
+        self.closed = True
+        if self.sender_task is not None:
+            self.sender_task.cancel()
+            try:
+                await self.sender_task
+            except asyncio.CancelledError:
+                pass
+
+
+class ConnectionRegistry:
+    """
+    Conexiones WebSocket vivas de este worker, por usuario
+    
+    Aplica los límites de conexiones (WS_MAX_CONNECTIONS_PER_USER y
+    WS_MAX_CONNECTIONS), envía los latidos a todas las conexiones desde una
+    sola tarea y resume su edad y la memoria que retienen sus colas para
+    /health. Las conexiones inactivas las cierra el propio bucle de recepción
+    del endpoint (ver reap).
+    """
+    
+    def __init__(self, max_per_user: int = WS_MAX_CONNECTIONS_PER_USER, max_total: int = WS_MAX_CONNECTIONS,
+                 heartbeat_seconds: float = WS_HEARTBEAT_SECONDS, idle_timeout: float = WS_IDLE_TIMEOUT_SECONDS):
+        # Estructura: {user_id: [connection1, connection2, ...]}
+        self.connections: Dict[int, List[Connection]] = {}
+        self.max_per_user = max_per_user
+        self.max_total = max_total
+        self.heartbeat_interval = heartbeat_seconds
+        self.idle_timeout = idle_timeout
+        self.total = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.reaped = 0
+        self.pings = 0
+        self._task: Optional[asyncio.Task] = None
+    
+    async def start(self):
+        """Arranca la tarea de latidos"""
+        if self.heartbeat_interval > 0:
+            self._task = asyncio.create_task(self._heartbeat())
+    
+    async def stop(self):
+        """Para la tarea de latidos (al apagar el servidor)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    def check_limits(self, user_id: int) -> Optional[str]:
+        """
+        Comprueba si se puede abrir otra conexión
+        
+        Args:
+            user_id: ID del usuario que se conecta
+            
+        Returns:
+            Motivo del rechazo, o None si se admite
+        """
+        if self.max_total and self.total >= self.max_total:
+            return "Demasiadas conexiones en el servidor"
+        if self.max_per_user and len(self.connections.get(user_id, [])) >= self.max_per_user:
+            return "Demasiadas conexiones abiertas para este usuario"
+        return None
+    
+    def add(self, connection: Connection):
+        """Añade una conexión WebSocket para un usuario"""
+        connections = self.connections.setdefault(connection.user_id, [])
+        connections.append(connection)
+        self.total += 1
+        self.accepted += 1
+        print(f"[WS] ✅ Conexión añadida para usuario {connection.user_id} (total: {len(connections)})")
+    
+    def remove(self, connection: Connection):
+        """Elimina una conexión WebSocket de un usuario"""
+        user_id = connection.user_id
+        if user_id in self.connections and connection in self.connections[user_id]:
+            self.connections[user_id].remove(connection)
+            self.total -= 1
+            print(f"[WS] 🔌 Conexión eliminada para usuario {user_id} (restantes: {len(self.connections[user_id])})")
+            
+            # Si no quedan conexiones, eliminar el usuario
+            if not self.connections[user_id]:
+                del self.connections[user_id]
+    
+    async def reap(self, connection: Connection):
+        """Cierra una conexión de la que no ha llegado nada (ni los pong) en idle_timeout"""
+        self.reaped += 1
+        print(f"[WS] 💤 Conexión inactiva cerrada: usuario {connection.user_id} "
+              f"({time.monotonic() - connection.last_seen:.0f} s sin mensajes)")
+        self.remove(connection)
+        await connection.shutdown()
+        try:
+            await connection.websocket.close(code=CLOSE_IDLE)
+        except (RuntimeError, OSError):
+            pass
+    
+    def all(self) -> List[Connection]:
+        return [connection for connections in self.connections.values() for connection in connections]
+    
+    def ping_all(self) -> int:
+        """
+        Envía un latido a todas las conexiones
+        
+        Returns:
+            Número de conexiones en las que se ha encolado
+        """
+        sent = sum(1 for connection in self.all() if connection.send_encoded(PING_PAYLOAD))
+        self.pings += sent
+        return sent
+    
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            self.ping_all()
+    
+    def stats(self) -> dict:
+        now = time.monotonic()
+        connections = self.all()
+        ages = [now - connection.connected_at for connection in connections]
+        encodings: Dict[str, int] = {}
+        for connection in connections:
+            encodings[connection.encoding] = encodings.get(connection.encoding, 0) + 1
+        
+        return {
+            "connections": self.total,
+            "users": len(self.connections),
+            "max_per_user": self.max_per_user,
+            "max_total": self.max_total,
+            "heartbeat_seconds": self.heartbeat_interval,
+            "idle_timeout_seconds": self.idle_timeout,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "reaped": self.reaped,
+            "pings": self.pings,
+            "encodings": encodings,
+            "queued_messages": sum(connection.queue.qsize() for connection in connections),
+            "queued_bytes": sum(connection.queued_bytes for connection in connections),
+            "dropped": sum(connection.dropped for connection in connections),
+            "oldest_seconds": round(max(ages), 1) if ages else 0,
+            "average_age_seconds": round(sum(ages) / len(ages), 1) if ages else 0,
+            "max_idle_seconds": round(max((now - c.last_seen for c in connections), default=0), 1)
+        }
+
+
+# Instancia global: conexiones activas de este worker
+connection_registry = ConnectionRegistry()
 
 
 # ============================================================================
 # FUNCIONES AUXILIARES
 # ============================================================================
 
-async def broadcast_to_user(user_id: int, message: dict):
+def broadcast_to_user(user_id: int, message: dict):
     """
-    Envía un mensaje a todas las conexiones de un usuario
+    Difunde un mensaje a todas las conexiones de un usuario, en cualquier worker
+    
+    Se publica en el bus compartido (broadcast.py), que lo entrega al momento
+    a las conexiones de este proceso con deliver_to_user y a las de los demás
+    workers cuando lo reciben.
     
     Args:
         user_id: ID del usuario
         message: Diccionario con el mensaje a enviar
     """
-    if user_id not in active_connections:
-        return
+    broadcast_bus.publish(user_id, message)
+
+
+def deliver_to_user(user_id: int, message: dict) -> int:
+    """
+    Encola un mensaje en las conexiones locales (de este worker) de un usuario
     
-    # Lista de conexiones a eliminar si fallan
-    to_remove = []
+    No espera a la red: cada conexión lo envía desde su propia tarea, así que
+    un cliente lento no retrasa a los demás. El mensaje se codifica una sola
+    vez por codificación, no una vez por pestaña.
     
-    for websocket in active_connections[user_id]:
-        try:
-            await websocket.send_json(message)
-        except:
-            to_remove.append(websocket)
+    Args:
+        user_id: ID del usuario
+        message: Diccionario con el mensaje a enviar
+        
+    Returns:
+        Número de conexiones en las que se ha encolado
+    """
+    encoded: Dict[str, Union[str, bytes]] = {}
+    delivered = 0
+    # Copia: send_encoded() puede quitar conexiones lentas de la lista
+    for connection in list(connection_registry.connections.get(user_id, [])):
+        payload = encoded.get(connection.encoding)
+        if payload is None:
+            payload = encoded[connection.encoding] = encode_message(message, connection.encoding)
+        if connection.send_encoded(payload):
+            delivered += 1
+    return delivered
+
+
+def add_connection(connection: Connection):
+    """Añade una conexión WebSocket para un usuario (ver ConnectionRegistry.add)"""
+    connection_registry.add(connection)
+
+
+def remove_connection(connection: Connection):
+    """Elimina una conexión WebSocket de un usuario (ver ConnectionRegistry.remove)"""
+    connection_registry.remove(connection)
+
+
+def get_project_ids(db: Session, user_id: int) -> frozenset:
+    """Ids de los proyectos del usuario (para project_ids_cache)"""
+    return frozenset(
+        project_id for (project_id,) in db.query(Project.id).filter(Project.user_id == user_id)
+    )
+
+
+async def owns_project(user_id: int, project_id: int) -> bool:
+    """
+    Comprueba que el proyecto es del usuario con project_ids_cache
+    
+    Si el proyecto no está en la caché se recarga una vez de la base de datos
+    (puede haberse creado en otro worker). Un proyecto borrado en otro worker
+    puede seguir en la caché hasta PROJECT_CACHE_TTL_SECONDS; en ese caso la
+    base de datos rechaza la celda al guardarla.
     
-    # Eliminar conexiones fallidas
-    for ws in to_remove:
-        active_connections[user_id].remove(ws)
+    Args:
+        user_id: ID del usuario
+        project_id: ID del proyecto
+        
+    Returns:
+        True si el proyecto es del usuario
+    """
+    project_ids = project_ids_cache.get(user_id)
+    if project_ids is None or project_id not in project_ids:
+        project_ids = await run_with_session(get_project_ids, user_id)
+        project_ids_cache.set(user_id, project_ids)
+    return project_id in project_ids
+
+
+def save_imputacion(db: Session, user_id: int, project_id: int, fecha: date,
+                    horas: float) -> tuple[Optional[str], Optional[int]]:
+    """
+    Guarda una imputación recibida por WebSocket y mantiene totales, versión y change_log
     
-    # Si no quedan conexiones, eliminar el usuario del dict
-    if not active_connections[user_id]:
-        del active_connections[user_id]
+    Args:
+        db: Sesión de base de datos (síncrona, o la de run_sync en modo DB_ASYNC)
+        user_id: ID del usuario
+        project_id: ID del proyecto
+        fecha: Fecha de la imputación
+        horas: Horas a imputar
+        
+    Returns:
+        (mensaje de error o None, seq del cambio o None si no se guardó)
+    """
+    # Verificar proyecto
+    project = db.query(Project).filter(
+        Project.id == project_id,
+        Project.user_id == user_id
+    ).first()
+    
+    if not project:
+        return "Proyecto no encontrado", None
+    
+    # Buscar o crear imputación (bloqueada: su valor previo alimenta los totales)
+    lock_user_data(db, user_id)
+    imputacion = db.query(Imputacion).filter(
+        Imputacion.user_id == user_id,
+        Imputacion.project_id == project_id,
+        Imputacion.fecha == fecha
+    ).with_for_update().first()
+    
+    horas_anteriores = imputacion.horas if imputacion else 0
+    
+    if imputacion:
+        imputacion.horas = horas
+    else:
+        imputacion = Imputacion(
+            user_id=user_id,
+            project_id=project_id,
+            fecha=fecha,
+            horas=horas
+        )
+        db.add(imputacion)
+    
+    # Mantener totales en la misma transacción
+    apply_totales_delta(db, user_id, [(project_id, fecha, horas - horas_anteriores)])
+    seq = record_change(db, user_id, imputacion_message(project_id, fecha, horas))
+    
+    db.commit()
+    return None, seq
 
 
-def add_connection(user_id: int, websocket: WebSocket):
-    """Añade una conexión WebSocket para un usuario"""
-    if user_id not in active_connections:
-        active_connections[user_id] = []
-    active_connections[user_id].append(websocket)
-    print(f"[WS] ✅ Conexión añadida para usuario {user_id} (total: {len(active_connections[user_id])})")
+def save_imputaciones_lote(db: Session, user_id: int, items: list) -> tuple[list[dict], list[dict], Optional[int]]:
+    """
+    Guarda un lote de celdas recibido por WebSocket en una sola transacción
+    
+    Args:
+        db: Sesión de base de datos (síncrona, o la de run_sync en modo DB_ASYNC)
+        user_id: ID del usuario
+        items: Celdas validadas con ImputacionBatch
+        
+    Returns:
+        (filas guardadas, resultado por celda, seq del cambio)
+    """
+    rows, resultados, seq = save_imputaciones_batch(db, user_id, items)
+    if rows:
+        db.commit()
+    return rows, resultados, seq
 
 
-def remove_connection(user_id: int, websocket: WebSocket):
-    """Elimina una conexión WebSocket de un usuario"""
-    if user_id in active_connections and websocket in active_connections[user_id]:
-        active_connections[user_id].remove(websocket)
-        print(f"[WS] 🔌 Conexión eliminada para usuario {user_id} (restantes: {len(active_connections[user_id])})")
+def build_sync_message(db: Session, user_id: int, since: Optional[int], semana: Optional[date]) -> dict:
+    """
+    Construye el mensaje de sincronización al conectar (o con la acción "sync")
+    
+    - Con since y todos los cambios posteriores en change_log: {"type": "sync"}
+      con esos cambios (cada uno con su seq), que el cliente aplica como si
+      le hubieran llegado en vivo.
+    - Si se ha quedado demasiado atrás, o no trae since pero sí semana:
+      {"type": "snapshot"} con la semana (misma forma que GET /semana) y la
+      lista de proyectos.
+    - Sin since ni semana: {"type": "sync"} sin cambios, solo con el seq actual.
+    
+    Args:
+        db: Sesión de base de datos (síncrona, o la de run_sync en modo DB_ASYNC)
+        user_id: ID del usuario
+        since: Último seq que conoce el cliente
+        semana: Cualquier fecha de la semana que muestra el cliente
         
-        # Si no quedan conexiones, eliminar el usuario
-        if not active_connections[user_id]:
-            del active_connections[user_id]
+    Returns:
+        Mensaje a enviar al cliente
+    """
+    current = get_data_version(db, user_id)
+    
+    if since is not None:
+        changes = get_changes_since(db, user_id, since, current)
+        if changes is not None:
+            return {"type": "sync", "seq": current, "changes": changes}
+    elif semana is None:
+        return {"type": "sync", "seq": current, "changes": []}
+    
+    lunes = get_monday_of_week(semana or date.today())
+    proyectos = week_cache.get(user_id, lunes, current)
+    if proyectos is None:
+        generation = week_cache.generation(user_id)
+        proyectos = build_semana_data(db, user_id, lunes)
+        week_cache.set(user_id, lunes, proyectos, generation, current)
+    
+    projects = db.query(Project.id, Project.nombre, Project.color).filter(
+        Project.user_id == user_id
+    ).order_by(Project.created_at).all()
+    
+    return {
+        "type": "snapshot",
+        "seq": current,
+        "semana": lunes.isoformat(),
+        "proyectos": proyectos,
+        "projects": [
+            {"id": project_id, "nombre": nombre, "color": color}
+            for project_id, nombre, color in projects
+        ]
+    }
+
+
+def parse_sync_params(since, semana) -> tuple[Optional[int], Optional[date]]:
+    """
+    Interpreta since y semana (de la URL o de la acción "sync"); los inválidos se ignoran
+    
+    Returns:
+        (since, semana)
+    """
+    try:
+        since = int(since) if since is not None else None
+    except (TypeError, ValueError):
+        since = None
+    try:
+        semana = date.fromisoformat(semana) if semana else None
+    except (TypeError, ValueError):
+        semana = None
+    return since, semana
 
 
 # ============================================================================
@@ -78,6 +558,16 @@ async def websocket_endpoint(websocket: WebSocket, token: str):
     """
     Endpoint WebSocket para actualizaciones en tiempo real
     
+    Acepta ?since=<seq>&semana=<YYYY-MM-DD> para que una reconexión reciba
+    solo los cambios perdidos (o un snapshot) en vez de recargar por REST;
+    ver build_sync_message. Con ?encoding=binary las actualizaciones de
+    celdas se envían en frames binarios compactos (ver wsframing.py).
+    
+    El servidor envía {"type": "ping"} cada WS_HEARTBEAT_SECONDS y el cliente
+    responde {"action": "pong"}; sin mensajes en WS_IDLE_TIMEOUT_SECONDS la
+    conexión se cierra (1001). Por encima de los límites de conexiones se
+    acepta y se cierra al momento con 1013.
+    
     Args:
         websocket: Conexión WebSocket
         token: Token JWT del usuario
@@ -91,20 +581,62 @@ async def websocket_endpoint(websocket: WebSocket, token: str):
     
     user_id = user_data["user_id"]
     
-    # Aceptar conexión
-    await websocket.accept()
-    add_connection(user_id, websocket)
+    encoding = websocket.query_params.get("encoding", ENCODING_JSON)
+    if encoding not in WS_ENCODINGS:
+        encoding = ENCODING_JSON
     
-    # Obtener sesión de BD
-    db = SessionLocal()
+    # Límites de conexiones: se comprueba y se registra sin await de por medio
+    reason = connection_registry.check_limits(user_id)
+    if reason:
+        connection_registry.rejected += 1
+        print(f"[WS] 🚫 Conexión rechazada para usuario {user_id}: {reason}")
+        await websocket.accept()
+        await websocket.close(code=CLOSE_TRY_AGAIN_LATER, reason=reason)
+        return
+    
+    connection = Connection(websocket, user_id, encoding=encoding)
+    add_connection(connection)
     
+    # Cada mensaje usa su propia sesión fuera del event loop (run_with_session)
     try:
+        # Aceptar conexión
+        await websocket.accept()
+        connection.start()
+        
+        # Estado inicial: cambios perdidos desde since, o snapshot de la semana
+        since, semana = parse_sync_params(websocket.query_params.get("since"), websocket.query_params.get("semana"))
+        connection.send(await run_with_session(build_sync_message, user_id, since, semana))
+        
         while True:
-            # Recibir mensaje del cliente
-            data = await websocket.receive_json()
+            # Recibir mensaje del cliente; los latidos garantizan que un cliente vivo envía algo
+            try:
+                with anyio.fail_after(connection_registry.idle_timeout or None):
+                    data = await websocket.receive_json()
+            except TimeoutError:
+                await connection_registry.reap(connection)
+                break
+            connection.touch()
             
             action = data.get("action")
             
+            # Respuesta a un latido: no cuenta para el limitador
+            if action == "pong":
+                continue
+            
+            # Cada acción de escritura cuenta como una interacción del usuario; con
+            # escritura diferida, "imputar" se cobra más abajo, una vez por celda volcada
+            checks = [(POLICY_USER, str(user_id))]
+            if action != "sync" and not (action == "imputar" and write_buffer.enabled):
+                checks.append((POLICY_INTERACTIONS, str(user_id)))
+            limit = rate_limiter.hit(checks)
+            if limit is not None and not limit.allowed:
+                connection.send({
+                    "type": "error",
+                    "message": "Demasiadas peticiones, inténtalo más tarde",
+                    "retry_after": limit.retry_after
+                })
+                continue
+            
             if action == "imputar":
                 # Procesar imputación
                 try:
@@ -114,7 +646,7 @@ async def websocket_endpoint(websocket: WebSocket, token: str):
                     
                     # Validaciones
                     if not all([project_id, fecha_str, horas is not None]):
-                        await websocket.send_json({
+                        connection.send({
                             "type": "error",
                             "message": "Datos incompletos"
                         })
@@ -126,7 +658,7 @@ async def websocket_endpoint(websocket: WebSocket, token: str):
                     
                     # Validar fin de semana
                     if is_weekend(fecha):
-                        await websocket.send_json({
+                        connection.send({
                             "type": "error",
                             "message": "No se puede imputar en fin de semana"
                         })
@@ -134,64 +666,107 @@ async def websocket_endpoint(websocket: WebSocket, token: str):
                     
                     # Validar horas
                     if not validate_hours(horas):
-                        await websocket.send_json({
+                        connection.send({
                             "type": "error",
                             "message": "Horas inválidas (0-24)"
                         })
                         continue
                     
-                    # Verificar proyecto
-                    project = db.query(Project).filter(
-                        Project.id == project_id,
-                        Project.user_id == user_id
-                    ).first()
-                    
-                    if not project:
-                        await websocket.send_json({
-                            "type": "error",
-                            "message": "Proyecto no encontrado"
-                        })
-                        continue
-                    
-                    # Buscar o crear imputación
-                    imputacion = db.query(Imputacion).filter(
-                        Imputacion.user_id == user_id,
-                        Imputacion.project_id == project_id,
-                        Imputacion.fecha == fecha
-                    ).first()
+                    # El seq del cambio solo se conoce al guardar: sin él con escritura diferida
+                    message = imputacion_message(project_id, fecha, horas)
                     
-                    if imputacion:
-                        imputacion.horas = horas
+                    if write_buffer.enabled:
+                        # El proyecto se valida antes de confirmar: lo que se difunde ya no se rechaza al volcar
+                        if not await owns_project(user_id, project_id):
+                            connection.send({
+                                "type": "error",
+                                "message": "Proyecto no encontrado"
+                            })
+                            continue
+                        
+                        # Las ediciones de una celda que ya espera al volcado se coalescen y no
+                        # cuentan como interacción: teclear en la rejilla no agota el límite
+                        if not write_buffer.is_pending(user_id, project_id, fecha):
+                            limit = rate_limiter.hit([(POLICY_INTERACTIONS, str(user_id))])
+                            if limit is not None and not limit.allowed:
+                                connection.send({
+                                    "type": "error",
+                                    "message": "Demasiadas peticiones, inténtalo más tarde",
+                                    "retry_after": limit.retry_after
+                                })
+                                continue
+                        
+                        # Escritura diferida: se confirma ya y se vuelca en bloque (writebehind.py)
+                        write_buffer.put(user_id, project_id, fecha, horas)
                     else:
-                        imputacion = Imputacion(
-                            user_id=user_id,
-                            project_id=project_id,
-                            fecha=fecha,
-                            horas=horas
-                        )
-                        db.add(imputacion)
-                    
-                    db.commit()
+                        error, message["seq"] = await run_with_session(save_imputacion, user_id, project_id, fecha, horas)
+                        
+                        if error:
+                            connection.send({
+                                "type": "error",
+                                "message": error
+                            })
+                            continue
+                        
+                        week_cache.invalidate(user_id, [fecha])
                     
                     # Broadcast a todas las conexiones del usuario
-                    await broadcast_to_user(user_id, {
-                        "type": "imputacion_updated",
-                        "project_id": project_id,
-                        "fecha": fecha_str,
-                        "horas": horas
-                    })
+                    broadcast_to_user(user_id, message)
                     
                     print(f"[WS] ✅ Imputación guardada: {horas}h en proyecto {project_id} el {fecha}")
                 
                 except Exception as e:
                     print(f"[WS] ❌ Error procesando imputación: {e}")
-                    await websocket.send_json({
+                    connection.send({
+                        "type": "error",
+                        "message": f"Error: {str(e)}"
+                    })
+            
+            elif action == "imputar_batch":
+                # Procesar muchas celdas: un commit y un único broadcast
+                try:
+                    batch = ImputacionBatch(imputaciones=data.get("imputaciones"))
+                except ValidationError:
+                    connection.send({
+                        "type": "error",
+                        "message": "Lote inválido (1-500 celdas con project_id, fecha y horas)"
+                    })
+                    continue
+                
+                try:
+                    rows, resultados, seq = await run_with_session(save_imputaciones_lote, user_id, batch.imputaciones)
+                except Exception as e:
+                    print(f"[WS] ❌ Error procesando lote: {e}")
+                    connection.send({
                         "type": "error",
                         "message": f"Error: {str(e)}"
                     })
+                    continue
+                
+                errores = [
+                    {**r, "fecha": r["fecha"].isoformat()} for r in resultados if not r["ok"]
+                ]
+                
+                if rows:
+                    week_cache.invalidate(user_id, [row["fecha"] for row in rows])
+                    broadcast_to_user(user_id, {**imputaciones_message(rows), "seq": seq})
+                
+                # Resultado del lote solo para quien lo envió
+                connection.send({
+                    "type": "imputar_batch_result",
+                    "guardadas": len(rows),
+                    "errores": errores
+                })
+                
+                print(f"[WS] 📦 Lote guardado: {len(rows)} celdas, {len(errores)} errores para usuario {user_id}")
+            
+            elif action == "sync":
+                # El cliente ha visto un hueco en los seq: reenviar lo que falta
+                since, semana = parse_sync_params(data.get("since"), data.get("semana"))
+                connection.send(await run_with_session(build_sync_message, user_id, since, semana))
             
             else:
-                await websocket.send_json({
+                connection.send({
                     "type": "error",
                     "message": f"Acción desconocida: {action}"
                 })
@@ -203,5 +778,7 @@ async def websocket_endpoint(websocket: WebSocket, token: str):
         print(f"[WS] ❌ Error en WebSocket: {e}")
     
     finally:
-        remove_connection(user_id, websocket)
-        db.close()
+        remove_connection(connection)
+        await connection.shutdown()
+        # No dejar en memoria las ediciones de un cliente que se va
+        await write_buffer.flush(user_id)
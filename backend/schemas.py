@@ -3,7 +3,7 @@ Esquemas Pydantic para validación de datos
 """
 from pydantic import BaseModel, Field, validator
 from datetime import date, datetime
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 
 
 # ============================================================================
@@ -32,9 +32,22 @@ class UserLogin(BaseModel):
 class Token(BaseModel):
     """Esquema para respuesta de token"""
     token: str
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None
     user: dict
 
 
+class RefreshRequest(BaseModel):
+    """Esquema para refrescar el access token o cerrar sesión"""
+    refresh_token: str
+
+
+class TokenRefresh(BaseModel):
+    """Esquema para respuesta de refresco de token"""
+    token: str
+    expires_in: int
+
+
 class UserResponse(BaseModel):
     """Esquema para respuesta de usuario"""
     id: int
@@ -103,12 +116,68 @@ class ImputacionResponse(BaseModel):
         from_attributes = True
 
 
+class ImputacionBatchItem(BaseModel):
+    """Celda de una imputación masiva (se valida celda a celda en la ruta)"""
+    project_id: int
+    fecha: date
+    horas: float
+
+
+class ImputacionBatch(BaseModel):
+    """Esquema para guardar muchas celdas de golpe (p.ej. una semana entera)"""
+    imputaciones: List[ImputacionBatchItem] = Field(..., min_length=1, max_length=500)
+
+
+class ImputacionBatchResult(BaseModel):
+    """Resultado de una celda de la imputación masiva"""
+    project_id: int
+    fecha: date
+    horas: float
+    ok: bool
+    error: Optional[str] = None
+
+
+class ImputacionBatchResponse(BaseModel):
+    """Esquema para respuesta de imputación masiva"""
+    guardadas: int
+    errores: int
+    resultados: List[ImputacionBatchResult]
+
+
 class SemanaResponse(BaseModel):
     """Esquema para respuesta de semana completa"""
     semana: str
     proyectos: list
 
 
+class RangoResponse(BaseModel):
+    """Esquema para respuesta de un rango de fechas (varias semanas, mes, año)"""
+    desde: str
+    hasta: str
+    proyectos: list
+
+
+class TotalesResponse(BaseModel):
+    """Esquema para respuesta de totales por semana o mes"""
+    periodo: str
+    desde: str
+    hasta: str
+    proyectos: list
+
+
+# ============================================================================
+# ANALYTICS SCHEMAS
+# ============================================================================
+
+class AnaliticaResponse(BaseModel):
+    """Esquema para respuesta de estadísticas por proyecto y periodo"""
+    periodo: str
+    desde: str
+    hasta: str
+    proyectos: list
+    total: list
+
+
 # ============================================================================
 # WEBSOCKET SCHEMAS
 # ============================================================================
@@ -0,0 +1,160 @@
+"""
+Prueba: el event loop no se bloquea con muchos WebSocket guardando a la vez
+
+Ejecuta el endpoint real (routes/websocket_routes.websocket_endpoint) con
+sockets simulados que envían "imputar" seguidos, mientras una tarea mide
+cuánto se retrasa un sleep de 1 ms, y comprueba que el retraso máximo y el
+p99 quedan por debajo de un umbral. Si el acceso a BD vuelve a hacerse dentro
+del event loop, el retraso se dispara y la prueba falla.
+
+Los umbrales se pueden relajar en máquinas lentas con LOOP_LAG_MAX_MS y
+LOOP_LAG_P99_MS.
+
+Uso (desde backend/):
+    python -m pytest tests/test_ws_loop_lag.py
+    python -m unittest tests.test_ws_loop_lag
+"""
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import unittest
+from datetime import date, timedelta
+from pathlib import Path
+
+# Añadir el directorio del backend al path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# BD temporal, sin límite de interacciones y con commit por mensaje (sin escritura diferida)
+TEST_DB_PATH = os.path.join(tempfile.gettempdir(), "test_ws_loop_lag.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{TEST_DB_PATH}"
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+os.environ["WS_WRITE_BEHIND"] = "false"
+
+from fastapi import WebSocketDisconnect
+
+import routes.websocket_routes as ws_routes
+from auth import create_access_token
+from broadcast import broadcast_bus
+from database import Base, engine, SessionLocal, User, Project
+
+SOCKETS = 10
+MESSAGES_PER_SOCKET = 20
+# Pausa entre mensajes de un mismo socket (alguien tecleando en la rejilla)
+MESSAGE_INTERVAL_MS = 5
+PROBE_MS = 1
+
+MAX_LAG_MS = float(os.getenv("LOOP_LAG_MAX_MS", "100"))
+P99_LAG_MS = float(os.getenv("LOOP_LAG_P99_MS", "50"))
+
+MONDAY = date(2024, 1, 1)
+
+
+class FakeWebSocket:
+    """WebSocket simulado: entrega los mensajes preparados y cuenta las respuestas"""
+    
+    def __init__(self, messages: list[dict]):
+        self.query_params = {}
+        self.incoming = list(messages)
+        self.sent = 0
+    
+    async def accept(self):
+        pass
+    
+    async def receive_json(self) -> dict:
+        if not self.incoming:
+            raise WebSocketDisconnect()
+        await asyncio.sleep(MESSAGE_INTERVAL_MS / 1000)
+        return self.incoming.pop(0)
+    
+    async def send_text(self, text: str):
+        self.sent += 1
+    
+    async def send_bytes(self, data: bytes):
+        self.sent += 1
+    
+    async def close(self, code: int = 1000, reason: str = None):
+        pass
+
+
+async def probe(lags: list[float], stop: asyncio.Event):
+    """Mide el retraso de un sleep corto mientras dura la prueba"""
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(PROBE_MS / 1000)
+        lags.append((time.perf_counter() - t0) * 1000 - PROBE_MS)
+
+
+def seed_users() -> list[tuple[str, int]]:
+    """Crea un usuario con un proyecto por socket y devuelve (token, project_id)"""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        users = []
+        for i in range(SOCKETS):
+            user = User(email=f"lag{i}@example.com", password="x")
+            db.add(user)
+            db.flush()
+            project = Project(user_id=user.id, nombre="Proyecto")
+            db.add(project)
+            db.flush()
+            users.append((create_access_token({"user_id": user.id, "email": user.email}), project.id))
+        db.commit()
+        return users
+    finally:
+        db.close()
+
+
+def socket_messages(project_id: int) -> list[dict]:
+    return [
+        {
+            "action": "imputar",
+            "project_id": project_id,
+            "fecha": (MONDAY + timedelta(days=i % 5)).isoformat(),
+            "horas": float(i % 9)
+        }
+        for i in range(MESSAGES_PER_SOCKET)
+    ]
+
+
+class WebSocketLoopLagTest(unittest.IsolatedAsyncioTestCase):
+    
+    async def asyncSetUp(self):
+        self.users = seed_users()
+        await broadcast_bus.start(ws_routes.deliver_to_user)
+    
+    async def asyncTearDown(self):
+        await broadcast_bus.stop()
+        engine.dispose()
+    
+    async def test_concurrent_saves_keep_loop_responsive(self):
+        lags: list[float] = []
+        stop = asyncio.Event()
+        probe_task = asyncio.create_task(probe(lags, stop))
+        
+        sockets = [FakeWebSocket(socket_messages(project_id)) for _, project_id in self.users]
+        # Sin los logs por mensaje del endpoint
+        with contextlib.redirect_stdout(io.StringIO()):
+            await asyncio.gather(*(
+                ws_routes.websocket_endpoint(websocket, token)
+                for websocket, (token, _) in zip(sockets, self.users)
+            ))
+        stop.set()
+        await probe_task
+        
+        # Cada mensaje recibe su confirmación: la prueba ha guardado de verdad
+        for websocket in sockets:
+            self.assertGreaterEqual(websocket.sent, MESSAGES_PER_SOCKET)
+        
+        lags.sort()
+        p99 = lags[int(len(lags) * 0.99)]
+        self.assertLess(p99, P99_LAG_MS, f"p99 del retraso del event loop: {p99:.1f} ms")
+        self.assertLess(lags[-1], MAX_LAG_MS, f"retraso máximo del event loop: {lags[-1]:.1f} ms")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,5 @@
 """
-Script para actualizar la base de datos con la tabla de chat_messages
+Script para actualizar la base de datos aplicando las migraciones pendientes
 """
 import sys
 from pathlib import Path
@@ -7,17 +7,20 @@ from pathlib import Path
 # Añadir el directorio del backend al path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from database import Base, engine
+from database import engine
+from migrations import run_migrations, get_schema_version, LATEST_VERSION
 
 def update_database():
-    """Actualiza la base de datos añadiendo las nuevas tablas"""
+    """Actualiza la base de datos aplicando las migraciones pendientes"""
     print("🔄 Actualizando base de datos...")
     
     try:
-        # Crear todas las tablas (incluida chat_messages)
-        Base.metadata.create_all(bind=engine)
-        print("✅ Base de datos actualizada correctamente")
-        print("📋 Tabla 'chat_messages' creada")
+        applied = run_migrations(engine)
+        if applied:
+            print(f"✅ Base de datos actualizada a la versión {LATEST_VERSION}")
+            print(f"📋 Migraciones aplicadas: {', '.join(str(v) for v in applied)}")
+        else:
+            print(f"✅ La base de datos ya está en la versión {get_schema_version(engine)}")
         
     except Exception as e:
         print(f"❌ Error actualizando la base de datos: {e}")
@@ -1,9 +1,29 @@
 """
 Utilidades y funciones auxiliares
 """
+import json
+from collections import defaultdict
 from datetime import datetime, date, timedelta
+from typing import Optional
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
-from database import Project
+from database import ChangeLogEntry, Imputacion, ImputacionTotal, Project, RateLimitBucket, UserDataVersion
+
+# Parámetros por sentencia INSERT en los upserts masivos: límite de SQLite
+# anterior a 3.32 (SQLITE_MAX_VARIABLE_NUMBER); las filas por sentencia se
+# derivan del número de columnas
+UPSERT_MAX_PARAMS = 999
+
+# Periodos de los totales agregados
+PERIODO_SEMANA = "semana"
+PERIODO_MES = "mes"
+PERIODOS = (PERIODO_SEMANA, PERIODO_MES)
+
+# Cambios que se conservan por usuario en change_log: quien se ha perdido más
+# recibe un snapshot. Se poda cada CHANGE_LOG_PRUNE_EVERY escrituras
+CHANGE_LOG_SIZE = 200
+CHANGE_LOG_PRUNE_EVERY = 20
 
 
 # ============================================================================
@@ -51,6 +71,22 @@ def get_week_dates(lunes: date) -> list[date]:
     return [lunes + timedelta(days=i) for i in range(5)]
 
 
+def get_working_dates(desde: date, hasta: date) -> list[date]:
+    """
+    Obtiene la lista de fechas L-V entre dos fechas (ambas incluidas)
+    
+    Args:
+        desde: Fecha inicial
+        hasta: Fecha final
+        
+    Returns:
+        Lista ordenada de fechas laborables del rango
+    """
+    dias = (hasta - desde).days + 1
+    fechas = (desde + timedelta(days=i) for i in range(max(dias, 0)))
+    return [fecha for fecha in fechas if not is_weekend(fecha)]
+
+
 # ============================================================================
 # VALIDACIONES
 # ============================================================================
@@ -81,3 +117,479 @@ def validate_hours(horas: float) -> bool:
         True si es válido
     """
     return 0 <= horas <= 24
+
+
+# ============================================================================
+# ESCRITURA
+# ============================================================================
+
+def _upsert(db: Session, model, rows: list[dict], index_elements: list[str],
+            update_columns: list[str], increment: bool = False) -> None:
+    """
+    Upsert masivo con la sintaxis nativa del dialecto
+    
+    Las filas se envían en sentencias de UPSERT_MAX_PARAMS // columnas filas
+    
+    Args:
+        db: Sesión de base de datos
+        model: Modelo SQLAlchemy destino
+        rows: Filas a insertar
+        index_elements: Columnas de la restricción única
+        update_columns: Columnas a actualizar si la fila ya existe
+        increment: Si es True suma el valor nuevo al existente en vez de reemplazarlo
+    """
+    dialect = db.get_bind().dialect.name
+    chunk_size = max(1, UPSERT_MAX_PARAMS // len(rows[0]))
+    
+    for i in range(0, len(rows), chunk_size):
+        values = rows[i:i + chunk_size]
+        
+        if dialect in ("sqlite", "postgresql"):
+            insert = sqlite_insert if dialect == "sqlite" else pg_insert
+            stmt = insert(model).values(values)
+            set_ = {
+                col: (getattr(model, col) + stmt.excluded[col]) if increment else stmt.excluded[col]
+                for col in update_columns
+            }
+            db.execute(stmt.on_conflict_do_update(index_elements=index_elements, set_=set_))
+        
+        elif dialect == "mysql":
+            from sqlalchemy.dialects.mysql import insert as mysql_insert
+            stmt = mysql_insert(model).values(values)
+            set_ = {
+                col: (getattr(model, col) + stmt.inserted[col]) if increment else stmt.inserted[col]
+                for col in update_columns
+            }
+            db.execute(stmt.on_duplicate_key_update(**set_))
+        
+        else:
+            # Dialecto sin upsert nativo: buscar y actualizar fila a fila
+            for value in values:
+                obj = db.query(model).filter_by(**{col: value[col] for col in index_elements}).first()
+                if obj is None:
+                    db.add(model(**value))
+                    continue
+                for col in update_columns:
+                    new_value = value[col]
+                    if increment:
+                        new_value = (getattr(obj, col) or 0) + new_value
+                    setattr(obj, col, new_value)
+            db.flush()
+
+
+def upsert_imputaciones(db: Session, rows: list[dict]) -> None:
+    """
+    Inserta o actualiza imputaciones en bloque sobre unique_user_project_fecha
+    
+    Usa el upsert nativo del dialecto (ON CONFLICT en SQLite/PostgreSQL,
+    ON DUPLICATE KEY en MySQL). No hace commit: el llamador controla la
+    transacción. Las filas no deben repetir (user_id, project_id, fecha).
+    
+    Args:
+        db: Sesión de base de datos
+        rows: Diccionarios con user_id, project_id, fecha y horas
+    """
+    if not rows:
+        return
+    
+    now = datetime.utcnow()
+    _upsert(
+        db,
+        Imputacion,
+        [{**row, "created_at": now, "updated_at": now} for row in rows],
+        index_elements=["user_id", "project_id", "fecha"],
+        update_columns=["horas", "updated_at"]
+    )
+
+
+def upsert_rate_limit_buckets(db: Session, rows: list[dict]) -> None:
+    """
+    Inserta o actualiza en bloque el estado de los buckets del limitador
+    
+    No hace commit: el llamador controla la transacción.
+    
+    Args:
+        db: Sesión de base de datos
+        rows: Diccionarios con key, tokens y updated_at
+    """
+    if not rows:
+        return
+    
+    _upsert(db, RateLimitBucket, rows, index_elements=["key"], update_columns=["tokens", "updated_at"])
+
+
+def get_interactions_remaining(user_id: int) -> int:
+    """
+    Interacciones (escrituras) que le quedan ahora mismo a un usuario
+    
+    Args:
+        user_id: ID del usuario
+        
+    Returns:
+        Tokens disponibles en su bucket de interacciones
+    """
+    from ratelimit import rate_limiter, POLICY_INTERACTIONS
+    return rate_limiter.remaining(POLICY_INTERACTIONS, str(user_id))
+
+
+# ============================================================================
+# TOTALES POR PERIODO
+# ============================================================================
+
+def get_periodo_inicio(fecha: date, periodo: str) -> date:
+    """
+    Obtiene el inicio del periodo (lunes o día 1 del mes) que contiene la fecha
+    
+    Args:
+        fecha: Fecha cualquiera
+        periodo: 'semana' o 'mes'
+        
+    Returns:
+        Fecha de inicio del periodo
+    """
+    if periodo == PERIODO_SEMANA:
+        return get_monday_of_week(fecha)
+    return fecha.replace(day=1)
+
+
+def apply_totales_delta(db: Session, user_id: int, deltas: list[tuple[int, date, float]]) -> None:
+    """
+    Aplica variaciones de horas a los totales semanales y mensuales
+    
+    Debe llamarse en la misma transacción que la escritura de imputaciones.
+    No hace commit.
+    
+    Args:
+        db: Sesión de base de datos
+        user_id: ID del usuario
+        deltas: Tuplas (project_id, fecha, horas_nuevas - horas_anteriores)
+    """
+    buckets: dict[tuple, float] = defaultdict(float)
+    for project_id, fecha, delta in deltas:
+        if not delta:
+            continue
+        for periodo in PERIODOS:
+            buckets[(project_id, periodo, get_periodo_inicio(fecha, periodo))] += delta
+    
+    if not buckets:
+        return
+    
+    _upsert(
+        db,
+        ImputacionTotal,
+        [
+            {"user_id": user_id, "project_id": project_id, "periodo": periodo, "inicio": inicio, "horas": horas}
+            for (project_id, periodo, inicio), horas in buckets.items()
+        ],
+        index_elements=["user_id", "project_id", "periodo", "inicio"],
+        update_columns=["horas"],
+        increment=True
+    )
+
+
+def rebuild_totales(db: Session, user_id: Optional[int] = None) -> int:
+    """
+    Reconstruye los totales desde las imputaciones (backfill o corrección)
+    
+    Args:
+        db: Sesión de base de datos
+        user_id: Reconstruir solo este usuario (None = todos)
+        
+    Returns:
+        Número de filas de totales generadas
+    """
+    delete = db.query(ImputacionTotal)
+    rows = db.query(Imputacion.user_id, Imputacion.project_id, Imputacion.fecha, Imputacion.horas)\
+        .filter(Imputacion.horas > 0)
+    if user_id is not None:
+        delete = delete.filter(ImputacionTotal.user_id == user_id)
+        rows = rows.filter(Imputacion.user_id == user_id)
+    delete.delete(synchronize_session=False)
+    
+    buckets: dict[tuple, float] = defaultdict(float)
+    for row_user_id, project_id, fecha, horas in rows.yield_per(10000):
+        for periodo in PERIODOS:
+            buckets[(row_user_id, project_id, periodo, get_periodo_inicio(fecha, periodo))] += horas
+    
+    db.bulk_insert_mappings(ImputacionTotal, [
+        {"user_id": u, "project_id": p, "periodo": periodo, "inicio": inicio, "horas": horas}
+        for (u, p, periodo, inicio), horas in buckets.items()
+    ])
+    db.commit()
+    
+    return len(buckets)
+
+
+# ============================================================================
+# VERSIÓN DE DATOS Y ETAGS
+# ============================================================================
+
+def bump_data_version(db: Session, user_id: int) -> None:
+    """
+    Incrementa la versión de datos del usuario
+    
+    Debe llamarse en la misma transacción que cualquier escritura de
+    proyectos o imputaciones. No hace commit.
+    
+    Args:
+        db: Sesión de base de datos
+        user_id: ID del usuario
+    """
+    _upsert(
+        db,
+        UserDataVersion,
+        [{"user_id": user_id, "version": 1}],
+        index_elements=["user_id"],
+        update_columns=["version"],
+        increment=True
+    )
+
+
+def lock_user_data(db: Session, user_id: int) -> None:
+    """
+    Serializa hasta el commit las escrituras de imputaciones de un usuario
+    
+    Bloquea su fila de user_data_versions con un upsert que no cambia la
+    versión (en SQLite, toma el bloqueo de escritura de la BD). Debe llamarse
+    antes de leer las horas previas que alimentan apply_totales_delta: si dos
+    escritores de la misma celda leyeran el mismo valor previo, se sumarían
+    los dos deltas y los totales se desviarían. Las lecturas de horas previas
+    usan además with_for_update para ver el último valor confirmado también
+    con aislamiento repeatable read (MySQL). No hace commit.
+    
+    Args:
+        db: Sesión de base de datos
+        user_id: ID del usuario
+    """
+    _upsert(
+        db,
+        UserDataVersion,
+        [{"user_id": user_id, "version": 0}],
+        index_elements=["user_id"],
+        update_columns=["version"],
+        increment=True
+    )
+
+
+def get_data_version(db: Session, user_id: int) -> int:
+    """
+    Obtiene la versión de datos actual del usuario (0 si nunca ha escrito)
+    
+    Args:
+        db: Sesión de base de datos
+        user_id: ID del usuario
+        
+    Returns:
+        Versión de datos
+    """
+    version = db.query(UserDataVersion.version).filter(
+        UserDataVersion.user_id == user_id
+    ).scalar()
+    return version or 0
+
+
+def record_change(db: Session, user_id: int, message: dict) -> int:
+    """
+    Incrementa la versión de datos y apunta el cambio en change_log
+    
+    La nueva versión es el número de secuencia del cambio. Debe llamarse en
+    la misma transacción que la escritura, en lugar de bump_data_version.
+    No hace commit.
+    
+    Args:
+        db: Sesión de base de datos
+        user_id: ID del usuario
+        message: Mensaje WebSocket que describe el cambio (sin "seq")
+        
+    Returns:
+        Número de secuencia del cambio
+    """
+    bump_data_version(db, user_id)
+    seq = get_data_version(db, user_id)
+    db.add(ChangeLogEntry(user_id=user_id, seq=seq, message=json.dumps(message, default=str)))
+    
+    if seq % CHANGE_LOG_PRUNE_EVERY == 0:
+        db.query(ChangeLogEntry).filter(
+            ChangeLogEntry.user_id == user_id,
+            ChangeLogEntry.seq <= seq - CHANGE_LOG_SIZE
+        ).delete(synchronize_session=False)
+    
+    return seq
+
+
+def imputacion_message(project_id: int, fecha: date, horas: float) -> dict:
+    """Mensaje WebSocket de una celda actualizada"""
+    return {
+        "type": "imputacion_updated",
+        "project_id": project_id,
+        "fecha": fecha.isoformat(),
+        "horas": horas
+    }
+
+
+def imputaciones_message(rows: list[dict]) -> dict:
+    """Mensaje WebSocket de varias celdas actualizadas (filas con project_id, fecha y horas)"""
+    return {
+        "type": "imputaciones_updated",
+        "imputaciones": [
+            {
+                "project_id": row["project_id"],
+                "fecha": row["fecha"].isoformat(),
+                "horas": row["horas"]
+            }
+            for row in rows
+        ]
+    }
+
+
+def get_changes_since(db: Session, user_id: int, since: int, current: int) -> Optional[list[dict]]:
+    """
+    Obtiene los cambios posteriores a un número de secuencia
+    
+    Si falta alguno (podado del log, o escrito con bump_data_version sin
+    apuntarlo, como la importación) no se puede reconstruir el estado con
+    deltas y el llamador debe enviar un snapshot.
+    
+    Args:
+        db: Sesión de base de datos
+        user_id: ID del usuario
+        since: Último número de secuencia que conoce el cliente
+        current: Versión de datos actual
+        
+    Returns:
+        Mensajes con su "seq" en orden, o None si hace falta un snapshot
+    """
+    if since > current or current - since > CHANGE_LOG_SIZE:
+        return None
+    if since == current:
+        return []
+    
+    rows = db.query(ChangeLogEntry.seq, ChangeLogEntry.message).filter(
+        ChangeLogEntry.user_id == user_id,
+        ChangeLogEntry.seq > since,
+        ChangeLogEntry.seq <= current
+    ).order_by(ChangeLogEntry.seq).all()
+    
+    if len(rows) != current - since:
+        return None
+    
+    return [{**json.loads(message), "seq": seq} for seq, message in rows]
+
+
+def make_etag(*parts) -> str:
+    """
+    Construye un ETag débil a partir de sus componentes
+    
+    Returns:
+        ETag con formato W/"a-b-c"
+    """
+    return 'W/"' + "-".join(str(part) for part in parts) + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Comprueba si la cabecera If-None-Match contiene el ETag (comparación débil)
+    
+    Args:
+        if_none_match: Valor de la cabecera If-None-Match
+        etag: ETag actual del recurso
+        
+    Returns:
+        True si el cliente ya tiene la versión actual
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    
+    def _opaque(tag: str) -> str:
+        tag = tag.strip()
+        return tag[2:] if tag.startswith("W/") else tag
+    
+    return any(_opaque(tag) == _opaque(etag) for tag in if_none_match.split(","))
+
+
+# ============================================================================
+# IMPUTACIÓN MASIVA
+# ============================================================================
+
+def save_imputaciones_batch(db: Session, user_id: int, items: list) -> tuple[list[dict], list[dict], Optional[int]]:
+    """
+    Valida en conjunto y guarda muchas celdas en la transacción en curso
+    
+    La propiedad de los proyectos y las horas previas se resuelven con una
+    consulta cada una; las celdas válidas se escriben con un upsert nativo y se
+    actualizan totales y versión de datos (apuntando el cambio en change_log).
+    Las celdas inválidas no abortan el lote. No hace commit: el llamador
+    controla la transacción (y después invalida la caché de semanas con las
+    fechas guardadas).
+    
+    Args:
+        db: Sesión de base de datos
+        user_id: ID del usuario
+        items: Celdas con project_id, fecha y horas (p. ej. ImputacionBatchItem)
+        
+    Returns:
+        (filas guardadas, resultado por celda con ok/error, seq del cambio o None si no se guardó nada)
+    """
+    # Resolver la propiedad de todos los proyectos de una vez
+    project_ids = {item.project_id for item in items}
+    own_projects = {
+        project_id for (project_id,) in db.query(Project.id).filter(
+            Project.id.in_(project_ids),
+            Project.user_id == user_id
+        )
+    }
+    
+    resultados = []
+    # Si una celda se repite en el lote gana el último valor
+    rows: dict[tuple, dict] = {}
+    
+    for item in items:
+        error = None
+        if is_weekend(item.fecha):
+            error = "No se puede imputar en sábado o domingo"
+        elif not validate_hours(item.horas):
+            error = "Las horas deben estar entre 0 y 24"
+        elif item.project_id not in own_projects:
+            error = "Proyecto no encontrado"
+        else:
+            rows[(item.project_id, item.fecha)] = {
+                "user_id": user_id,
+                "project_id": item.project_id,
+                "fecha": item.fecha,
+                "horas": item.horas
+            }
+        
+        resultados.append({
+            "project_id": item.project_id,
+            "fecha": item.fecha,
+            "horas": item.horas,
+            "ok": error is None,
+            "error": error
+        })
+    
+    if rows:
+        # Horas previas de las celdas afectadas para actualizar los totales
+        lock_user_data(db, user_id)
+        anteriores = {
+            (project_id, fecha): horas
+            for project_id, fecha, horas in db.query(
+                Imputacion.project_id, Imputacion.fecha, Imputacion.horas
+            ).filter(
+                Imputacion.user_id == user_id,
+                Imputacion.project_id.in_({key[0] for key in rows}),
+                Imputacion.fecha.in_({key[1] for key in rows})
+            ).with_for_update()
+        }
+        
+        upsert_imputaciones(db, list(rows.values()))
+        apply_totales_delta(db, user_id, [
+            (project_id, fecha, row["horas"] - anteriores.get((project_id, fecha), 0))
+            for (project_id, fecha), row in rows.items()
+        ])
+        seq = record_change(db, user_id, imputaciones_message(list(rows.values())))
+    else:
+        seq = None
+    
+    return list(rows.values()), resultados, seq
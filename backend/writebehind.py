@@ -0,0 +1,246 @@
+"""
+Buffer de escritura diferida (write-behind) para las imputaciones por WebSocket
+
+Al teclear en la rejilla llegan muchos "imputar" para la misma celda en menos
+de un segundo y cada uno era un commit en SQLite, que solo admite un escritor.
+Con WS_WRITE_BEHIND=true el WebSocket guarda en memoria el último valor de
+cada (usuario, proyecto, fecha), confirma al cliente al momento (difundiendo
+imputacion_updated) y el buffer escribe todo lo pendiente en una sola
+transacción cada WS_WRITE_BEHIND_FLUSH_MS.
+
+Garantías de durabilidad:
+
+- Una edición confirmada está solo en memoria hasta el siguiente volcado
+  (como mucho WS_WRITE_BEHIND_FLUSH_MS, o antes si se acumulan
+  WS_WRITE_BEHIND_MAX_CELLS celdas). Si el proceso muere sin apagarse
+  (SIGKILL, falta de memoria, caída de la máquina) se pierden las ediciones
+  de esa ventana.
+- Al desconectarse un cliente se vuelcan sus celdas, y al apagar el servidor
+  de forma ordenada se vuelca todo antes de cerrar la base de datos.
+- Si un volcado falla las celdas vuelven al buffer (sin pisar valores más
+  nuevos) y se reintentan en la siguiente pasada.
+- Las celdas que la base de datos rechaza (p. ej. un proyecto borrado
+  entretanto) se descartan y se avisa al usuario con un mensaje "error".
+- Las lecturas REST de la semana pueden ir hasta un intervalo por detrás de lo
+  difundido por WebSocket; la caché de semanas se invalida en cada volcado.
+- La confirmación inmediata no lleva número de secuencia (seq): el cambio
+  entra en change_log al volcarse, y un cliente que se reconecta lo recibe
+  desde ahí.
+- Una escritura REST sobre la misma celda dentro de la ventana puede quedar
+  pisada por el valor del buffer cuando este se vuelca (gana el volcado).
+
+Desactivado (por defecto) cada edición se guarda con su propio commit.
+"""
+import asyncio
+import os
+from datetime import date
+from typing import Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+WS_WRITE_BEHIND = os.getenv("WS_WRITE_BEHIND", "false").lower() == "true"
+WS_WRITE_BEHIND_FLUSH_MS = int(os.getenv("WS_WRITE_BEHIND_FLUSH_MS", "250"))
+# Con tantas celdas pendientes se vuelca sin esperar al intervalo
+WS_WRITE_BEHIND_MAX_CELLS = int(os.getenv("WS_WRITE_BEHIND_MAX_CELLS", "500"))
+
+
+class WriteBehindBuffer:
+    """
+    Último valor pendiente por celda, volcado en bloque a la base de datos
+    
+    Los volcados se serializan con un lock: nunca hay dos transacciones del
+    buffer a la vez compitiendo por el escritor de SQLite.
+    """
+    
+    def __init__(self, enabled: bool = WS_WRITE_BEHIND, flush_ms: int = WS_WRITE_BEHIND_FLUSH_MS,
+                 max_cells: int = WS_WRITE_BEHIND_MAX_CELLS):
+        self.enabled = enabled
+        self.flush_interval = flush_ms / 1000
+        self.max_cells = max_cells
+        # {user_id: {(project_id, fecha): horas}}
+        self._pending: Dict[int, Dict[Tuple[int, date], float]] = {}
+        self._cells = 0
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._notify: Optional[Callable[[int, dict], None]] = None
+        self.accepted = 0
+        self.coalesced = 0
+        self.written = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.errors = 0
+    
+    async def start(self, notify: Callable[[int, dict], None]):
+        """
+        Arranca el volcado periódico (si el buffer está activado)
+        
+        Args:
+            notify: Función para avisar a un usuario (p. ej. broadcast_to_user)
+        """
+        self._notify = notify
+        self._lock = asyncio.Lock()
+        if self.enabled:
+            self._task = asyncio.create_task(self._run())
+            print(f"[WRITEBEHIND] ✏️ Buffer activado (volcado cada {int(self.flush_interval * 1000)} ms)")
+    
+    async def stop(self):
+        """Para el volcado periódico y vuelca todo lo pendiente (al apagar el servidor)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+    
+    def put(self, user_id: int, project_id: int, fecha: date, horas: float):
+        """
+        Guarda el último valor de una celda ya validada, sin tocar la base de datos
+        
+        Args:
+            user_id: ID del usuario
+            project_id: ID del proyecto
+            fecha: Fecha de la imputación
+            horas: Horas a imputar
+        """
+        cells = self._pending.setdefault(user_id, {})
+        key = (project_id, fecha)
+        if key in cells:
+            self.coalesced += 1
+        else:
+            self._cells += 1
+        cells[key] = horas
+        self.accepted += 1
+        
+        if self._cells >= self.max_cells and self._task is not None:
+            asyncio.create_task(self.flush())
+    
+    def is_pending(self, user_id: int, project_id: int, fecha: date) -> bool:
+        """Indica si la celda ya tiene un valor pendiente de volcar (otra edición se coalescería)"""
+        return (project_id, fecha) in self._pending.get(user_id, {})
+    
+    async def flush(self, user_id: Optional[int] = None) -> int:
+        """
+        Vuelca las celdas pendientes en una transacción
+        
+        Args:
+            user_id: Volcar solo las de este usuario (None = todas)
+            
+        Returns:
+            Número de filas escritas
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        
+        async with self._lock:
+            user_ids = list(self._pending) if user_id is None else [user_id]
+            batch = {uid: self._pending.pop(uid) for uid in user_ids if uid in self._pending}
+            if not batch:
+                return 0
+            self._cells -= sum(len(cells) for cells in batch.values())
+            
+            try:
+                saved, rejected = await self._write(batch)
+            except Exception as e:
+                self.errors += 1
+                print(f"[WRITEBEHIND] ❌ Error volcando {sum(len(c) for c in batch.values())} celdas: {e}")
+                self._restore(batch)
+                return 0
+        
+        self.flushes += 1
+        self.written += sum(len(rows) for rows in saved.values())
+        self._after_write(saved, rejected)
+        return sum(len(rows) for rows in saved.values())
+    
+    async def _write(self, batch: Dict[int, Dict[Tuple[int, date], float]]) -> tuple[dict, dict]:
+        """Escribe el lote de todos los usuarios con un solo commit"""
+        from database import run_with_session
+        
+        return await run_with_session(_save_pending, batch)
+    
+    def _restore(self, batch: Dict[int, Dict[Tuple[int, date], float]]):
+        """Devuelve al buffer un lote fallido sin pisar los valores llegados después"""
+        for uid, cells in batch.items():
+            pending = self._pending.setdefault(uid, {})
+            for key, horas in cells.items():
+                if key not in pending:
+                    pending[key] = horas
+                    self._cells += 1
+    
+    def _after_write(self, saved: dict, rejected: dict):
+        from cache import week_cache
+        
+        for uid, rows in saved.items():
+            week_cache.invalidate(uid, [row["fecha"] for row in rows])
+        
+        for uid, resultados in rejected.items():
+            self.rejected += len(resultados)
+            print(f"[WRITEBEHIND] ⚠️ {len(resultados)} celdas rechazadas para usuario {uid}")
+            if self._notify is not None:
+                for r in resultados:
+                    self._notify(uid, {
+                        "type": "error",
+                        "message": f"No se guardó la imputación del {r['fecha'].isoformat()}: {r['error']}",
+                        "project_id": r["project_id"],
+                        "fecha": r["fecha"].isoformat()
+                    })
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+    
+    def pending(self) -> int:
+        """Celdas pendientes de volcar"""
+        return self._cells
+    
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "flush_ms": int(self.flush_interval * 1000),
+            "pending": self._cells,
+            "accepted": self.accepted,
+            "coalesced": self.coalesced,
+            "written": self.written,
+            "rejected": self.rejected,
+            "flushes": self.flushes,
+            "errors": self.errors
+        }
+
+
+def _save_pending(db, batch: Dict[int, Dict[Tuple[int, date], float]]) -> tuple[dict, dict]:
+    """
+    Guarda las celdas pendientes de varios usuarios y hace un único commit
+    
+    Args:
+        db: Sesión de base de datos (síncrona, o la de run_sync en modo DB_ASYNC)
+        batch: {user_id: {(project_id, fecha): horas}}
+        
+    Returns:
+        ({user_id: filas guardadas}, {user_id: celdas rechazadas})
+    """
+    from schemas import ImputacionBatchItem
+    from utils import save_imputaciones_batch
+    
+    saved, rejected = {}, {}
+    for uid, cells in batch.items():
+        items = [
+            ImputacionBatchItem(project_id=project_id, fecha=fecha, horas=horas)
+            for (project_id, fecha), horas in cells.items()
+        ]
+        rows, resultados, _ = save_imputaciones_batch(db, uid, items)
+        if rows:
+            saved[uid] = rows
+        errores = [r for r in resultados if not r["ok"]]
+        if errores:
+            rejected[uid] = errores
+    
+    db.commit()
+    return saved, rejected
+
+
+# Instancia global compartida
+write_buffer = WriteBehindBuffer()
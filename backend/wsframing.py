@@ -0,0 +1,133 @@
+"""
+Codificación de los mensajes WebSocket
+
+El cliente elige la codificación al conectar (?encoding=...):
+
+- "json" (por defecto): todos los mensajes como texto JSON.
+- "binary": las actualizaciones de celdas (imputacion_updated e
+  imputaciones_updated), que son casi todo el tráfico, van en un frame
+  binario de formato fijo; el resto de mensajes sigue en JSON. El cliente
+  distingue unos de otros por el tipo de frame (texto o binario).
+
+Formato binario (little-endian):
+
+    cabecera  B tipo | I seq (0 = sin seq) | H día base | H nº de celdas
+    celda     I project_id | B días desde el día base | H horas en centésimas
+
+El día base son los días desde BASE_DATE de la fecha más antigua del
+mensaje. Si alguna celda no cabe en el formato (horas con más de dos
+decimales, fechas separadas más de 255 días...) el mensaje se envía en JSON.
+
+Además de esto, uvicorn negocia permessage-deflate con los navegadores
+(WS_PER_MESSAGE_DEFLATE en main.py), que comprime ambos formatos.
+"""
+import json
+import struct
+from datetime import date, timedelta
+from typing import Union
+
+ENCODING_JSON = "json"
+ENCODING_BINARY = "binary"
+WS_ENCODINGS = (ENCODING_JSON, ENCODING_BINARY)
+
+BASE_DATE = date(2000, 1, 1)
+
+FRAME_TYPES = {
+    "imputacion_updated": 1,
+    "imputaciones_updated": 2,
+}
+FRAME_TYPE_NAMES = {code: name for name, code in FRAME_TYPES.items()}
+
+HEADER = struct.Struct("<BIHH")
+CELL = struct.Struct("<IBH")
+
+MAX_CELLS = 0xFFFF
+
+
+def encode_json(message: dict) -> str:
+    """Codifica un mensaje en JSON compacto (igual que WebSocket.send_json)"""
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def _cells(message: dict) -> list[dict]:
+    if message["type"] == "imputacion_updated":
+        return [message]
+    return message["imputaciones"]
+
+
+def encode_binary(message: dict) -> Union[bytes, None]:
+    """
+    Codifica una actualización de celdas en el formato binario
+    
+    Args:
+        message: Mensaje imputacion_updated o imputaciones_updated
+        
+    Returns:
+        Frame binario, o None si el mensaje no se puede representar
+    """
+    frame_type = FRAME_TYPES.get(message.get("type"))
+    if frame_type is None:
+        return None
+    
+    cells = _cells(message)
+    if not cells or len(cells) > MAX_CELLS:
+        return None
+    
+    try:
+        days = [(date.fromisoformat(cell["fecha"]) - BASE_DATE).days for cell in cells]
+        base = min(days)
+        values = []
+        for cell, day in zip(cells, days):
+            centesimas = round(cell["horas"] * 100)
+            if abs(centesimas - cell["horas"] * 100) > 1e-6:
+                return None
+            values.extend((cell["project_id"], day - base, centesimas))
+        
+        header = HEADER.pack(frame_type, message.get("seq") or 0, base, len(cells))
+        return header + struct.pack("<" + "IBH" * len(cells), *values)
+    except (struct.error, ValueError, TypeError, KeyError):
+        return None
+
+
+def decode_binary(frame: bytes) -> dict:
+    """
+    Decodifica un frame binario al mismo mensaje que se habría enviado en JSON
+    
+    Args:
+        frame: Frame generado por encode_binary
+        
+    Returns:
+        Mensaje imputacion_updated o imputaciones_updated
+    """
+    frame_type, seq, base, count = HEADER.unpack_from(frame, 0)
+    cells = []
+    for project_id, offset, centesimas in CELL.iter_unpack(frame[HEADER.size:HEADER.size + CELL.size * count]):
+        cells.append({
+            "project_id": project_id,
+            "fecha": (BASE_DATE + timedelta(days=base + offset)).isoformat(),
+            "horas": centesimas / 100
+        })
+    
+    name = FRAME_TYPE_NAMES[frame_type]
+    message = {"type": name, **cells[0]} if name == "imputacion_updated" else {"type": name, "imputaciones": cells}
+    if seq:
+        message["seq"] = seq
+    return message
+
+
+def encode_message(message: dict, encoding: str = ENCODING_JSON) -> Union[str, bytes]:
+    """
+    Codifica un mensaje para una conexión
+    
+    Args:
+        message: Mensaje a enviar
+        encoding: Codificación negociada por la conexión
+        
+    Returns:
+        Texto (frame de texto) o bytes (frame binario)
+    """
+    if encoding == ENCODING_BINARY:
+        frame = encode_binary(message)
+        if frame is not None:
+            return frame
+    return encode_json(message)
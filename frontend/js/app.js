@@ -47,10 +47,12 @@ class AppManager {
             });
             
             if (response.ok) {
+                this.token = localStorage.getItem('token');
                 this.userData = await response.json();
                 await this.onLoginSuccess();
             } else {
                 localStorage.removeItem('token');
+                localStorage.removeItem('refresh_token');
                 this.token = null;
                 this.showGuestMode();
             }
@@ -157,6 +159,7 @@ class AppManager {
                 this.token = data.token;
                 this.userData = data.user;
                 localStorage.setItem('token', this.token);
+                if (data.refresh_token) localStorage.setItem('refresh_token', data.refresh_token);
                 this.hideLoginModal();
                 await this.onLoginSuccess();
             } else {
@@ -203,6 +206,7 @@ class AppManager {
                 this.token = data.token;
                 this.userData = data.user;
                 localStorage.setItem('token', this.token);
+                if (data.refresh_token) localStorage.setItem('refresh_token', data.refresh_token);
                 this.hideRegisterModal();
                 await this.onLoginSuccess();
             } else {
@@ -246,6 +250,7 @@ class AppManager {
         
         await projectManager.loadProjects();
         await tableManager.loadWeek(new Date());
+        calendarManager.loadMonthHours();
         
         if (window.chatBot) {
             window.chatBot.updateToken(this.token);
@@ -258,6 +263,34 @@ class AppManager {
                 if (tableManager) {
                     tableManager.updateCell(message.project_id, message.fecha, message.horas);
                 }
+                calendarManager.updateDay(message.project_id, message.fecha, message.horas);
+                break;
+            case 'imputaciones_updated':
+                if (tableManager) {
+                    message.imputaciones.forEach(cell => {
+                        tableManager.updateCell(cell.project_id, cell.fecha, cell.horas);
+                    });
+                }
+                message.imputaciones.forEach(cell => {
+                    calendarManager.updateDay(cell.project_id, cell.fecha, cell.horas);
+                });
+                break;
+            case 'snapshot':
+                if (tableManager) {
+                    tableManager.applySnapshot(message);
+                }
+                calendarManager.loadMonthHours();
+                projectManager.projects = message.projects;
+                projectManager.updateCreateButton();
+                break;
+            case 'project_created':
+            case 'project_deleted':
+                // Cambio de proyectos perdido mientras no había conexión
+                projectManager.loadProjects();
+                if (tableManager && tableManager.currentWeekMonday) {
+                    tableManager.loadWeek(tableManager.currentWeekMonday);
+                }
+                calendarManager.loadMonthHours();
                 break;
             case 'error':
                 alert(message.message || 'Ha ocurrido un error');
@@ -300,12 +333,27 @@ class AppManager {
     
     logout() {
         wsManager.disconnect();
+        
+        // Revocar la sesión en el servidor (sin esperar respuesta)
+        if (this.token) {
+            fetch('https://aregest.arelance.com/api/auth/logout', {
+                method: 'POST',
+                headers: {
+                    'Authorization': `Bearer ${this.token}`,
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({ refresh_token: localStorage.getItem('refresh_token') || '' })
+            }).catch(() => {});
+        }
+        
         localStorage.removeItem('token');
+        localStorage.removeItem('refresh_token');
         this.token = null;
         this.userData = null;
         this.isAuthenticated = false;
         this.showGuestMode();
         tableManager.clearTable();
+        calendarManager.clearHours();
         
         if (window.chatBot) {
             window.chatBot.updateToken(null);
@@ -7,6 +7,7 @@ class CalendarManager {
         this.currentDate = new Date();
         this.selectedDate = new Date();
         this.daysWithHours = new Set(); // Fechas que tienen horas imputadas
+        this.hoursByDay = {}; // Fecha -> {project_id: horas} de los días visibles
         
         this.calendarGrid = document.getElementById('calendar-grid');
         this.calendarTitle = document.getElementById('calendar-title');
@@ -35,6 +36,91 @@ class CalendarManager {
     changeMonth(direction) {
         this.currentDate.setMonth(this.currentDate.getMonth() + direction);
         this.render();
+        this.loadMonthHours();
+    }
+    
+    /**
+     * Primer y último día de la cuadrícula visible (6 semanas empezando en lunes)
+     */
+    getVisibleRange() {
+        const firstDay = new Date(this.currentDate.getFullYear(), this.currentDate.getMonth(), 1);
+        const firstDayOfWeek = firstDay.getDay();
+        const daysToFillBefore = firstDayOfWeek === 0 ? 6 : firstDayOfWeek - 1;
+        
+        const from = new Date(firstDay);
+        from.setDate(from.getDate() - daysToFillBefore);
+        const to = new Date(from);
+        to.setDate(to.getDate() + 41);
+        return [this.formatDate(from), this.formatDate(to)];
+    }
+    
+    /**
+     * Carga los días con horas de todo el mes visible en una sola petición (GET /rango)
+     */
+    async loadMonthHours() {
+        const token = localStorage.getItem('token');
+        if (!token) return;
+        
+        const [from, to] = this.getVisibleRange();
+        
+        try {
+            const response = await fetch(
+                `https://aregest.arelance.com/api/imputaciones/rango?from=${from}&to=${to}`,
+                {
+                    headers: {
+                        'Authorization': `Bearer ${token}`
+                    }
+                }
+            );
+            
+            // Descartar la respuesta si mientras tanto se ha cambiado de mes
+            const [currentFrom] = this.getVisibleRange();
+            if (!response.ok || currentFrom !== from) return;
+            
+            const data = await response.json();
+            this.hoursByDay = {};
+            data.proyectos.forEach(proyecto => {
+                Object.entries(proyecto.horas).forEach(([fecha, horas]) => {
+                    if (horas > 0) {
+                        this.hoursByDay[fecha] = this.hoursByDay[fecha] || {};
+                        this.hoursByDay[fecha][proyecto.id] = horas;
+                    }
+                });
+            });
+            this.markDaysWithHours(Object.keys(this.hoursByDay));
+        } catch (error) {
+            console.error('Error cargando horas del mes:', error);
+        }
+    }
+    
+    /**
+     * Actualiza un día tras un cambio recibido por WebSocket (sin volver a pedir el mes)
+     */
+    updateDay(projectId, fecha, horas) {
+        const [from, to] = this.getVisibleRange();
+        if (fecha < from || fecha > to) return;
+        
+        const day = this.hoursByDay[fecha] || {};
+        if (horas > 0) {
+            day[projectId] = horas;
+        } else {
+            delete day[projectId];
+        }
+        
+        if (Object.keys(day).length) {
+            this.hoursByDay[fecha] = day;
+        } else {
+            delete this.hoursByDay[fecha];
+        }
+        this.markDaysWithHours(Object.keys(this.hoursByDay));
+    }
+    
+    /**
+     * Quita las marcas de días con horas (al cerrar sesión)
+     */
+    clearHours() {
+        this.hoursByDay = {};
+        this.markDaysWithHours([]);
     }
     
     /**
@@ -10,6 +10,10 @@ class ChatBot {
         this.botApiUrl = 'https://aregest.arelance.com/chat';
         this.backendApiUrl = 'https://aregest.arelance.com/api/chat';
         this.isLoadingHistory = false;
+        // Paginación del historial: id del mensaje más antiguo mostrado
+        this.historyPageSize = 50;
+        this.oldestMessageId = null;
+        this.hasMoreHistory = false;
         
         // Elementos del DOM
         this.chatWrapper = null;
@@ -66,6 +70,11 @@ class ChatBot {
                 this.sendMessage();
             }
         });
+        
+        // Al llegar arriba del todo se carga la página anterior del historial
+        this.chatMessages.addEventListener('scroll', () => {
+            if (this.chatMessages.scrollTop < 40) this.loadOlderMessages();
+        });
     }
     
     /**
@@ -94,23 +103,43 @@ class ChatBot {
     }
     
     /**
-     * Carga el historial de mensajes desde la BD
+     * Pide una página del historial (del más nuevo al más antiguo)
+     * @param {number|null} beforeId - Cursor: solo mensajes anteriores a este id
+     */
+    async fetchHistoryPage(beforeId = null) {
+        const params = new URLSearchParams({ limit: this.historyPageSize });
+        if (beforeId !== null) params.set('before_id', beforeId);
+        
+        const response = await fetch(`${this.backendApiUrl}/messages?${params}`, {
+            headers: {
+                'Authorization': `Bearer ${this.token}`
+            }
+        });
+        
+        if (!response.ok) return null;
+        
+        const messages = await response.json();
+        this.hasMoreHistory = messages.length === this.historyPageSize;
+        if (messages.length > 0) {
+            this.oldestMessageId = messages[messages.length - 1].id;
+        }
+        // En pantalla van en orden cronológico
+        return messages.reverse();
+    }
+    
+    /**
+     * Carga la última página del historial desde la BD
      */
     async loadChatHistory() {
         if (this.isLoadingHistory || !this.token) return;
         
         this.isLoadingHistory = true;
+        this.oldestMessageId = null;
+        this.hasMoreHistory = false;
         
         try {
-            const response = await fetch(`${this.backendApiUrl}/messages?limit=500`, {
-                headers: {
-                    'Authorization': `Bearer ${this.token}`
-                }
-            });
-            
-            if (!response.ok) return;
-            
-            let messages = await response.json();
+            const messages = await this.fetchHistoryPage();
+            if (!messages) return;
             
             const welcomeMsg = this.chatMessages.querySelector('.chat-welcome');
             this.chatMessages.innerHTML = '';
@@ -122,12 +151,6 @@ class ChatBot {
                 return;
             }
             
-            // Quedarnos solo con los últimos 50 mensajes (los más recientes)
-            const MAX_DISPLAY = 50;
-            if (messages.length > MAX_DISPLAY) {
-                messages = messages.slice(-MAX_DISPLAY);
-            }
-            
             // Cargar mensajes sin hacer scroll individual
             messages.forEach(msg => {
                 if (msg.role === 'user') {
@@ -147,6 +170,35 @@ class ChatBot {
         }
     }
     
+    /**
+     * Añade arriba la página anterior del historial, sin mover lo que se está viendo
+     */
+    async loadOlderMessages() {
+        if (this.isLoadingHistory || !this.hasMoreHistory || !this.token) return;
+        
+        this.isLoadingHistory = true;
+        
+        try {
+            const messages = await this.fetchHistoryPage(this.oldestMessageId);
+            if (!messages || messages.length === 0) return;
+            
+            const previousHeight = this.chatMessages.scrollHeight;
+            const fragment = document.createDocumentFragment();
+            messages
+                .filter(msg => msg.role === 'user' || msg.role === 'bot')
+                .forEach(msg => fragment.appendChild(this.createMessageElement(msg.role, msg.message)));
+            this.chatMessages.insertBefore(fragment, this.chatMessages.firstChild);
+            
+            // Mantener a la vista el mensaje que estaba arriba
+            this.chatMessages.scrollTop += this.chatMessages.scrollHeight - previousHeight;
+            
+        } catch (error) {
+            // Silenciar error de carga de historial
+        } finally {
+            this.isLoadingHistory = false;
+        }
+    }
+    
     /**
      * Guarda un mensaje en la BD
      */
@@ -260,19 +312,7 @@ class ChatBot {
      * @param {boolean} skipScroll - Si true, no hace scroll (para carga masiva de historial)
      */
     addUserMessage(text, save = true, skipScroll = false) {
-        const messageEl = document.createElement('div');
-        messageEl.className = 'chat-message user';
-        
-        const time = new Date().toLocaleTimeString('es-ES', { hour: '2-digit', minute: '2-digit' });
-        
-        messageEl.innerHTML = `
-            <div class="chat-bubble">
-                <p class="chat-bubble-text">${this.escapeHtml(text)}</p>
-                <div class="chat-bubble-time">${time}</div>
-            </div>
-        `;
-        
-        this.chatMessages.appendChild(messageEl);
+        this.chatMessages.appendChild(this.createMessageElement('user', text));
         
         if (!skipScroll) this.scrollToBottom();
         if (save) this.saveChatMessage('user', text);
@@ -283,8 +323,19 @@ class ChatBot {
      * @param {boolean} skipScroll - Si true, no hace scroll (para carga masiva de historial)
      */
     addBotMessage(text, save = true, skipScroll = false) {
+        this.chatMessages.appendChild(this.createMessageElement('bot', text));
+        
+        if (!skipScroll) this.scrollToBottom();
+        if (save) this.saveChatMessage('bot', text);
+    }
+    
+    /**
+     * Crea el elemento de un mensaje
+     * @param {string} role - 'user' o 'bot'
+     */
+    createMessageElement(role, text) {
         const messageEl = document.createElement('div');
-        messageEl.className = 'chat-message bot';
+        messageEl.className = `chat-message ${role}`;
         
         const time = new Date().toLocaleTimeString('es-ES', { hour: '2-digit', minute: '2-digit' });
         
@@ -295,10 +346,7 @@ class ChatBot {
             </div>
         `;
         
-        this.chatMessages.appendChild(messageEl);
-        
-        if (!skipScroll) this.scrollToBottom();
-        if (save) this.saveChatMessage('bot', text);
+        return messageEl;
     }
     
     /**
@@ -110,6 +110,33 @@ class DashboardManager {
                     );
                 }
                 break;
+            
+            case 'imputaciones_updated':
+                // Actualizar todas las celdas del lote
+                if (tableManager) {
+                    message.imputaciones.forEach(cell => {
+                        tableManager.updateCell(cell.project_id, cell.fecha, cell.horas);
+                    });
+                }
+                break;
+                
+            case 'snapshot':
+                // Estado completo de la semana al reconectar tras perder demasiados cambios
+                if (tableManager) {
+                    tableManager.applySnapshot(message);
+                }
+                projectManager.projects = message.projects;
+                projectManager.updateCreateButton();
+                break;
+            
+            case 'project_created':
+            case 'project_deleted':
+                // Cambio de proyectos perdido mientras no había conexión
+                projectManager.loadProjects();
+                if (tableManager && tableManager.currentWeekMonday) {
+                    tableManager.loadWeek(tableManager.currentWeekMonday);
+                }
+                break;
                 
             case 'error':
                 alert(message.message || 'Ha ocurrido un error');
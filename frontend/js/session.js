@@ -0,0 +1,62 @@
+/**
+ * Gestión de sesión: renueva el access token de vida corta con el refresh token
+ * Envuelve fetch para que las peticiones a la API usen siempre el token vigente
+ * y reintenta una vez tras un 401 si la sesión se puede refrescar
+ */
+
+const SESSION_API_URL = 'https://aregest.arelance.com';
+const nativeFetch = window.fetch.bind(window);
+let refreshPromise = null;
+
+function refreshAccessToken() {
+    const refreshToken = localStorage.getItem('refresh_token');
+    if (!refreshToken) return Promise.resolve(null);
+    
+    // Una sola petición de refresco aunque fallen varias llamadas a la vez
+    if (!refreshPromise) {
+        refreshPromise = nativeFetch(`${SESSION_API_URL}/api/auth/refresh`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ refresh_token: refreshToken })
+        })
+            .then(response => response.ok ? response.json() : null)
+            .then(data => {
+                if (!data) {
+                    localStorage.removeItem('refresh_token');
+                    return null;
+                }
+                localStorage.setItem('token', data.token);
+                return data.token;
+            })
+            .catch(() => null)
+            .finally(() => { refreshPromise = null; });
+    }
+    return refreshPromise;
+}
+
+function withToken(init, token) {
+    const headers = new Headers((init && init.headers) || {});
+    headers.set('Authorization', `Bearer ${token}`);
+    return { ...(init || {}), headers };
+}
+
+window.fetch = async (input, init) => {
+    const url = typeof input === 'string' ? input : input.url;
+    const headers = new Headers((init && init.headers) || {});
+    
+    // Solo peticiones autenticadas a la API (login/registro/refresh van tal cual)
+    if (!headers.has('Authorization') || url.includes('/api/auth/refresh')) {
+        return nativeFetch(input, init);
+    }
+    
+    const currentToken = localStorage.getItem('token');
+    if (currentToken) init = withToken(init, currentToken);
+    
+    const response = await nativeFetch(input, init);
+    if (response.status !== 401) return response;
+    
+    const newToken = await refreshAccessToken();
+    if (!newToken) return response;
+    
+    return nativeFetch(input, withToken(init, newToken));
+};
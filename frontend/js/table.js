@@ -78,6 +78,20 @@ class TableManager {
         }
     }
     
+    /**
+     * Aplica un snapshot recibido por WebSocket al reconectar
+     * (misma forma que GET /semana más la lista de proyectos)
+     */
+    applySnapshot(snapshot) {
+        if (!this.currentWeekMonday || this.formatDate(this.currentWeekMonday) !== snapshot.semana) {
+            return;
+        }
+        
+        this.projects = snapshot.projects;
+        this.weekData = snapshot;
+        this.renderTable(snapshot);
+    }
+    
     /**
      * Carga los proyectos del usuario
      */
@@ -411,22 +425,21 @@ class TableManager {
             const dates = this.getWeekDates(this.currentWeekMonday);
             
             try {
-                // Poner todas las horas a 0 para esta semana
-                for (const date of dates) {
-                    const dateStr = this.formatDate(date);
-                    await fetch(`https://aregest.arelance.com/api/imputaciones`, {
-                        method: 'POST',
-                        headers: {
-                            'Authorization': `Bearer ${token}`,
-                            'Content-Type': 'application/json'
-                        },
-                        body: JSON.stringify({
+                // Poner todas las horas a 0 para esta semana (una sola petición)
+                await fetch(`https://aregest.arelance.com/api/imputaciones/batch`, {
+                    method: 'POST',
+                    headers: {
+                        'Authorization': `Bearer ${token}`,
+                        'Content-Type': 'application/json'
+                    },
+                    body: JSON.stringify({
+                        imputaciones: dates.map(date => ({
                             project_id: projectId,
-                            fecha: dateStr,
+                            fecha: this.formatDate(date),
                             horas: 0
-                        })
-                    });
-                }
+                        }))
+                    })
+                });
                 
                 console.log(`✅ Proyecto ${projectName} quitado de la semana`);
                 
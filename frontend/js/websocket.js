@@ -2,6 +2,38 @@
  * Gestión de WebSocket para actualizaciones en tiempo real
  */
 
+// Frames binarios de actualización de celdas (ver backend/wsframing.py)
+const FRAME_TYPES = { 1: 'imputacion_updated', 2: 'imputaciones_updated' };
+const FRAME_HEADER_SIZE = 9;
+const FRAME_CELL_SIZE = 7;
+const FRAME_BASE_DATE = Date.UTC(2000, 0, 1);
+const DAY_MS = 24 * 60 * 60 * 1000;
+
+function decodeFrame(buffer) {
+    const view = new DataView(buffer);
+    const type = FRAME_TYPES[view.getUint8(0)];
+    const seq = view.getUint32(1, true);
+    const base = view.getUint16(5, true);
+    const count = view.getUint16(7, true);
+    
+    const cells = [];
+    for (let i = 0; i < count; i++) {
+        const offset = FRAME_HEADER_SIZE + i * FRAME_CELL_SIZE;
+        const day = base + view.getUint8(offset + 4);
+        cells.push({
+            project_id: view.getUint32(offset, true),
+            fecha: new Date(FRAME_BASE_DATE + day * DAY_MS).toISOString().slice(0, 10),
+            horas: view.getUint16(offset + 5, true) / 100
+        });
+    }
+    
+    const message = type === 'imputacion_updated'
+        ? { type, ...cells[0] }
+        : { type, imputaciones: cells };
+    if (seq) message.seq = seq;
+    return message;
+}
+
 class WebSocketManager {
     constructor() {
         this.ws = null;
@@ -10,13 +42,28 @@ class WebSocketManager {
         this.maxReconnectAttempts = 5;
         this.reconnectDelay = 3000;
         this.messageHandlers = [];
+        // Último número de secuencia de cambios visto (null hasta el primer mensaje)
+        this.lastSeq = null;
+        this.syncPending = false;
+        // Actualizaciones de celdas en frames binarios compactos (el resto sigue en JSON)
+        this.encoding = 'binary';
     }
     
     connect() {
+        // El access token caduca pronto: usar siempre el último guardado
+        this.token = localStorage.getItem('token');
         if (!this.token) return;
         
-        const wsUrl = `wss://aregest.arelance.com/ws/${this.token}`;
+        // Al reconectar se piden solo los cambios perdidos (o un snapshot de la semana)
+        const params = new URLSearchParams({ encoding: this.encoding });
+        if (this.lastSeq !== null) params.set('since', this.lastSeq);
+        const semana = this.currentWeek();
+        if (semana) params.set('semana', semana);
+        
+        const wsUrl = `wss://aregest.arelance.com/ws/${this.token}?${params}`;
         this.ws = new WebSocket(wsUrl);
+        this.ws.binaryType = 'arraybuffer';
+        this.syncPending = true;
         
         this.ws.onopen = () => {
             this.reconnectAttempts = 0;
@@ -24,8 +71,10 @@ class WebSocketManager {
         
         this.ws.onmessage = (event) => {
             try {
-                const data = JSON.parse(event.data);
-                this.messageHandlers.forEach(handler => handler(data));
+                const data = typeof event.data === 'string'
+                    ? JSON.parse(event.data)
+                    : decodeFrame(event.data);
+                this.handleMessage(data);
             } catch (error) {
                 // Silenciar error de parseo
             }
@@ -38,6 +87,69 @@ class WebSocketManager {
         };
     }
     
+    handleMessage(data) {
+        // Latido del servidor: sin respuesta cierra la conexión por inactividad
+        if (data.type === 'ping') {
+            this.send({ action: 'pong' });
+            return;
+        }
+        
+        if (data.type === 'sync') {
+            // Cambios perdidos: se aplican como si hubieran llegado en vivo
+            data.changes
+                .filter(change => this.lastSeq === null || change.seq > this.lastSeq)
+                .forEach(change => this.dispatch(change));
+            this.lastSeq = data.seq;
+            this.syncPending = false;
+            return;
+        }
+        
+        if (data.type === 'snapshot') {
+            this.lastSeq = data.seq;
+            this.syncPending = false;
+            this.dispatch(data);
+            return;
+        }
+        
+        // Una sincronización rechazada (p. ej. por el limitador) se puede repetir
+        if (data.type === 'error') this.syncPending = false;
+        
+        if (typeof data.seq === 'number' && this.lastSeq !== null) {
+            // Ya incluido en una sincronización anterior
+            if (data.seq <= this.lastSeq) return;
+            
+            // Hueco (p. ej. un cambio hecho por REST): pedir lo que falta,
+            // que incluye también este mensaje
+            if (data.seq > this.lastSeq + 1) {
+                this.requestSync();
+                return;
+            }
+        }
+        
+        if (typeof data.seq === 'number') this.lastSeq = data.seq;
+        this.dispatch(data);
+    }
+    
+    dispatch(data) {
+        this.messageHandlers.forEach(handler => handler(data));
+    }
+    
+    requestSync() {
+        if (this.syncPending) return;
+        this.syncPending = true;
+        this.send({
+            action: 'sync',
+            since: this.lastSeq,
+            semana: this.currentWeek()
+        });
+    }
+    
+    currentWeek() {
+        const table = window.tableManager;
+        if (!table || !table.currentWeekMonday) return null;
+        return table.formatDate(table.currentWeekMonday);
+    }
+    
     attemptReconnect() {
         if (this.reconnectAttempts < this.maxReconnectAttempts) {
             this.reconnectAttempts++;
@@ -64,7 +176,16 @@ class WebSocketManager {
         });
     }
     
+    imputarLote(imputaciones) {
+        // imputaciones: [{ project_id, fecha, horas }, ...] (máx. 500)
+        this.send({
+            action: 'imputar_batch',
+            imputaciones: imputaciones
+        });
+    }
+    
     disconnect() {
+        this.lastSeq = null;
         if (this.ws) {
             this.ws.close();
             this.ws = null;